@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from db_backend import connect, rebuild_transaction_store  # noqa: E402
+from db_setup import setup_database  # noqa: E402
+from etl_pipeline import run_pipeline  # noqa: E402
+from generate_synthetic_data import generate  # noqa: E402
+
+""" Synthetic databases at a given scale of the sample data, shared by the benchmarks """
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+# sample data: 20 pharmacies and 20 users with about 5 purchases each
+SAMPLE_PHARMACIES = 20
+SAMPLE_USERS = 20
+
+
+def build_database(scale, cache_dir=CACHE_DIR, seed=42, workers=None):
+    """ Returns the path of a SQLite database loaded with synthetic data at `scale` x the sample size
+
+    Databases are cached by scale and seed, so only the first run pays for generating and loading them.
+
+    Args:
+        scale (float): Size relative to the sample data (1 is 20 pharmacies and 20 users).
+        cache_dir (str): Folder where the generated databases are kept.
+        seed (int): Seed of the synthetic data generator.
+        workers (int | None): Worker processes of the ETL pipeline.
+
+    Returns:
+        str: Path of the database file.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    db_path = os.path.join(cache_dir, f"phantom_mask_x{scale:g}_seed{seed}.db")
+    store_path = os.path.splitext(db_path)[0] + "_transactions"
+    if os.path.exists(db_path):
+        # adds the tables and indexes of a newer schema (and the transaction store) to databases cached before it
+        setup_database(db_path)
+        if not os.path.exists(store_path):
+            conn = connect(db_path, "bulk")
+            rebuild_transaction_store(conn, store_path)
+            conn.close()
+        return db_path
+
+    partial_path = db_path + ".partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    with tempfile.TemporaryDirectory(dir=cache_dir) as data_dir:
+        generate(
+            data_dir,
+            pharmacies=max(1, round(SAMPLE_PHARMACIES * scale)),
+            users=max(1, round(SAMPLE_USERS * scale)),
+            seed=seed,
+        )
+        setup_database(partial_path)
+        conn = connect(partial_path, "bulk")
+        for dataset in ("pharmacies", "users"):
+            run_pipeline(dataset, os.path.join(data_dir, f"{dataset}.json"), conn, workers, restart=True)
+        rebuild_transaction_store(conn, store_path)
+        conn.close()
+    os.replace(partial_path, db_path)
+    return db_path
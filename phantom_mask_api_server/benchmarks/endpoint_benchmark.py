@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+from .datasets import CACHE_DIR, build_database
+
+""" End-to-end benchmark of every API route at several data scales
+
+Each route is called in-process through the Django test client against synthetic databases
+at the requested scales (1x, 100x and 10,000x the sample data by default). Latency percentiles,
+SQL queries per request and peak Python memory per request are written as JSON, and a previous
+result file can be passed with --compare to print the differences.
+
+Usage (from phantom_mask_api_server/):
+    python -m benchmarks.endpoint_benchmark --output results.json
+    python -m benchmarks.endpoint_benchmark --scales 1 100 --compare results.json
+    python -m benchmarks.endpoint_benchmark --scales 100 --profile none --output sqlite_defaults.json
+"""
+
+DEFAULT_SCALES = [1, 100, 10000]
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "phantom_mask_api_server.settings")
+    import django
+    django.setup()
+
+
+def use_database(db_path):
+    """ Points the default database alias (and the in-process copies of its data) at db_path """
+    from django.conf import settings
+    from django.db import connections
+    from phantom_mask.catalog_snapshot import clear_catalog_snapshots
+    from phantom_mask.catalog_version import forget_catalog_version
+    for conn in connections.all():
+        conn.close()
+    connections["default"].settings_dict["NAME"] = db_path
+    # the databases of all scales can have the same catalog version
+    forget_catalog_version()
+    clear_catalog_snapshots()
+    if "TRANSACTION_STORE_DIR" not in os.environ:
+        settings.TRANSACTION_STORE_DIR = os.path.splitext(db_path)[0] + "_transactions"
+
+
+def build_scenarios():
+    """ Returns (route name, method, path, params) for every route of phantom_mask/urls.py
+
+    Request parameters are taken from the loaded database, so they hit real data at every scale.
+    """
+    from django.urls import reverse
+    from phantom_mask.models import Masks, PharmacyMasks, Transactions, Users
+
+    pharmacy_mask = PharmacyMasks.objects.select_related("pharmacy").order_by("id").first()
+    first_date = Transactions.objects.order_by("transaction_date").values_list("transaction_date", flat=True).first()
+    last_date = Transactions.objects.order_by("-transaction_date").values_list("transaction_date", flat=True).first()
+    start, end = first_date.strftime("%Y-%m-%d"), last_date.strftime("%Y-%m-%d")
+    richest_user = Users.objects.order_by("-cash_balance").values_list("id", flat=True).first()
+    mask_model = Masks.objects.order_by("id").values_list("model", flat=True).first()
+
+    return [
+        ("api-root-view", "get", reverse("api-root-view"), {}),
+        ("pharmacies-open-list-view", "get", reverse("pharmacies-open-list-view"), {"day": "mon", "time": "10:00"}),
+        ("pharmacy-masks-list-view", "get", reverse("pharmacy-masks-list-view"),
+         {"pharmacy": pharmacy_mask.pharmacy.name, "sort_by": "price"}),
+        ("pharmacies-compare-mask-list-view", "get", reverse("pharmacies-compare-mask-list-view"),
+         {"min": "5", "max": "30", "cond": "gt2"}),
+        ("freq-transactions-user-list-view", "get", reverse("freq-transactions-user-list-view"),
+         {"start": start, "end": end, "x": "10"}),
+        ("mask-transactions-view", "get", reverse("mask-transactions-view"), {"start": start, "end": end}),
+        ("search-view", "get", reverse("search-view"), {"type": "pharmacy", "q": "care"}),
+        ("search-view:mask", "get", reverse("search-view"), {"type": "mask", "q": mask_model.lower()}),
+        # purchases are followed by cancellations, so the database ends where it started
+        ("purchase-mask-view", "post", reverse("purchase-mask-view"), {
+            "user_id": richest_user, "pharmacy_id": pharmacy_mask.pharmacy_id,
+            "mask_id": pharmacy_mask.mask_id, "quantity": 1,
+        }),
+        ("cancel-latest-transaction-view", "post", reverse("cancel-latest-transaction-view"), {}),
+    ]
+
+
+def check_route_coverage(scenarios):
+    """ Fails when a route of phantom_mask/urls.py has no benchmark scenario """
+    from phantom_mask.urls import urlpatterns
+    covered = {name.split(":")[0] for name, *_ in scenarios}
+    missing = [pattern.name for pattern in urlpatterns if pattern.name not in covered]
+    if missing:
+        raise SystemExit(f"No benchmark scenario for routes: {', '.join(missing)}")
+
+
+def percentile(sorted_values, fraction):
+    """ Nearest-rank percentile of an already sorted list """
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def call(client, method, path, params):
+    if method == "get":
+        return client.get(path, params, HTTP_ACCEPT="application/json")
+    return client.post(path, params, content_type="application/json", HTTP_ACCEPT="application/json")
+
+
+def run_scenario(client, scenario, scenarios_by_name, iterations, warmup):
+    """ Measures one route; purchases and cancellations are always run as a pair """
+    from django.db import connections
+    from django.test.utils import CaptureQueriesContext
+
+    name, method, path, params = scenario
+    pair = {
+        "purchase-mask-view": ("cancel-latest-transaction-view", False),
+        "cancel-latest-transaction-view": ("purchase-mask-view", True),
+    }.get(name)
+
+    def once(measure):
+        """ Runs the request (with its paired write if any) and returns measure's result """
+        if pair and pair[1]:
+            call(client, *scenarios_by_name[pair[0]][1:])
+        result = measure()
+        if pair and not pair[1]:
+            call(client, *scenarios_by_name[pair[0]][1:])
+        return result
+
+    for _ in range(warmup):
+        once(lambda: call(client, method, path, params))
+
+    # latency, without any instrumentation
+    latencies, statuses, sizes = [], set(), []
+
+    def timed():
+        start = time.perf_counter()
+        response = call(client, method, path, params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses.add(response.status_code)
+        sizes.append(len(response.content))
+
+    for _ in range(iterations):
+        once(timed)
+
+    # SQL queries on every database alias
+    def counted():
+        with ExitStack() as stack:
+            contexts = [stack.enter_context(CaptureQueriesContext(conn)) for conn in connections.all()]
+            call(client, method, path, params)
+        return sum(len(context) for context in contexts), [
+            query["sql"] for context in contexts for query in context.captured_queries
+        ]
+
+    query_count, queries = once(counted)
+
+    # peak Python memory allocated while serving the request
+    def traced():
+        tracemalloc.start()
+        try:
+            call(client, method, path, params)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    peak_memory = once(traced)
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "status_codes": sorted(statuses),
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "mean": statistics.fmean(latencies),
+            "max": latencies[-1],
+        },
+        "sql_queries": query_count,
+        "sql": queries[:20],
+        "peak_memory_bytes": peak_memory,
+        "response_bytes": int(statistics.median(sizes)),
+    }
+
+
+def benchmark_scale(scale, iterations, warmup, cache_dir, routes=None):
+    from django.test import Client
+
+    db_path = build_database(scale, cache_dir)
+    use_database(db_path)
+    client = Client(HTTP_HOST="localhost")
+    scenarios = build_scenarios()
+    check_route_coverage(scenarios)
+    scenarios_by_name = {scenario[0]: scenario for scenario in scenarios}
+
+    results = {}
+    for scenario in scenarios:
+        if routes and scenario[0] not in routes:
+            continue
+        results[scenario[0]] = result = run_scenario(client, scenario, scenarios_by_name, iterations, warmup)
+        latency = result["latency_ms"]
+        print(f"  {scenario[0]:<36} p50 {latency['p50']:>9.2f} ms  p95 {latency['p95']:>9.2f} ms  "
+              f"p99 {latency['p99']:>9.2f} ms  {result['sql_queries']:>4} queries  "
+              f"{result['peak_memory_bytes'] / 1024:>9.0f} KiB peak")
+    return {"database": os.path.basename(db_path), "database_bytes": os.path.getsize(db_path), "routes": results}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path, threshold):
+    """ Prints the change of each metric against a previous result file; returns the regressions """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressions = []
+    print(f"\nCompared with {baseline_path} (revision {baseline['meta'].get('revision')}):")
+    for scale, scale_result in current["scales"].items():
+        old_routes = baseline["scales"].get(scale, {}).get("routes", {})
+        for route, result in scale_result["routes"].items():
+            old = old_routes.get(route)
+            if not old:
+                continue
+            changes = {
+                "p50": (old["latency_ms"]["p50"], result["latency_ms"]["p50"]),
+                "p95": (old["latency_ms"]["p95"], result["latency_ms"]["p95"]),
+                "p99": (old["latency_ms"]["p99"], result["latency_ms"]["p99"]),
+                "queries": (old["sql_queries"], result["sql_queries"]),
+                "memory": (old["peak_memory_bytes"], result["peak_memory_bytes"]),
+            }
+            parts = []
+            for metric, (before, after) in changes.items():
+                delta = (after - before) / before * 100 if before else (0.0 if after == before else float("inf"))
+                parts.append(f"{metric} {delta:+.0f}%")
+                if metric != "p99" and delta > threshold * 100:
+                    regressions.append(f"x{scale} {route} {metric}: {before:g} -> {after:g}")
+            print(f"  x{scale:<6} {route:<36} " + "  ".join(parts))
+
+    if regressions:
+        print(f"\nRegressions over {threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every API route at several data scales.")
+    parser.add_argument("--scales", type=float, nargs="+", default=DEFAULT_SCALES,
+                        help="data sizes relative to the sample data")
+    parser.add_argument("--iterations", type=int, default=50, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed requests per route")
+    parser.add_argument("--routes", nargs="+", help="only benchmark these route names")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="folder of the generated databases")
+    parser.add_argument("--profile", help="database profile of db_profiles.py (defaults to the settings)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="previous JSON result to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative increase reported as a regression by --compare")
+    args = parser.parse_args()
+
+    if args.profile:
+        os.environ["DATABASE_PROFILE"] = args.profile
+    setup_django()
+    from django.conf import settings
+    import django
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "platform": platform.platform(),
+            "debug": settings.DEBUG,
+            "database_profile": settings.DATABASE_PROFILE,
+            "iterations": args.iterations,
+        },
+        "scales": {},
+    }
+    for scale in args.scales:
+        print(f"x{scale:g}")
+        results["scales"][f"{scale:g}"] = benchmark_scale(scale, args.iterations, args.warmup, args.cache_dir, args.routes)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        if compare(results, args.compare, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
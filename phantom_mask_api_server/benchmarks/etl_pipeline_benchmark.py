@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .datasets import SAMPLE_PHARMACIES, SAMPLE_USERS, generate, setup_database
+from etl_pipeline import read_shards, run_pipeline, transform_pharmacies, transform_users
+
+""" Benchmark of the parallel ETL pipeline: throughput by number of worker processes
+
+Usage (from phantom_mask_api_server/):
+    python -m benchmarks.etl_pipeline_benchmark --scale 500 --workers 1 2 4 8
+"""
+
+
+def transform_throughput(path, transform, workers, shard_size):
+    """ Records per second of the parse/validate stage alone """
+    start = time.perf_counter()
+    records = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        shards = [shard for shard, _ in read_shards(path, shard_size)]
+        for rows, rejected in pool.map(transform, shards):
+            records += len(rows) + len(rejected)
+    return records / (time.perf_counter() - start)
+
+
+def pipeline_throughput(folder, paths, workers, shard_size):
+    """ Records per second of the whole reader -> workers -> writer pipeline """
+    db_path = os.path.join(folder, f"bench_{workers}.db")
+    setup_database(db_path)
+    conn = sqlite3.connect(db_path)
+    start = time.perf_counter()
+    records = 0
+    for dataset in ("pharmacies", "users"):
+        stats = run_pipeline(dataset, paths[dataset], conn, workers, shard_size, restart=True)
+        records += stats["pharmacies"] + stats["users"]
+    elapsed = time.perf_counter() - start
+    conn.close()
+    os.remove(db_path)
+    return records / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parallel ETL pipeline by worker count.")
+    parser.add_argument("--scale", type=int, default=500, help="size of the synthetic dataset relative to the sample data")
+    parser.add_argument("--workers", type=int, nargs="+", default=None,
+                        help="worker counts to measure (defaults to 1, 2, 4, ... up to the CPU count)")
+    parser.add_argument("--shard-size", type=int, default=500, help="records per shard")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({1, cpu_count} | {2 ** i for i in range(1, 8) if 2 ** i < cpu_count})
+
+    results = {"scale": args.scale, "cpu_count": cpu_count, "shard_size": args.shard_size, "runs": []}
+    with tempfile.TemporaryDirectory() as folder:
+        generate(folder, pharmacies=SAMPLE_PHARMACIES * args.scale, users=SAMPLE_USERS * args.scale)
+        paths = {dataset: os.path.join(folder, f"{dataset}.json") for dataset in ("pharmacies", "users")}
+        print(f"{'workers':>7} {'pharmacy parse/s':>17} {'user parse/s':>13} {'pipeline rec/s':>15} {'speedup':>8}")
+        baseline = None
+        for workers in worker_counts:
+            run = {
+                "workers": workers,
+                "pharmacies_transform_per_s": transform_throughput(paths["pharmacies"], transform_pharmacies, workers, args.shard_size),
+                "users_transform_per_s": transform_throughput(paths["users"], transform_users, workers, args.shard_size),
+                "pipeline_records_per_s": pipeline_throughput(folder, paths, workers, args.shard_size),
+            }
+            baseline = baseline or run["pipeline_records_per_s"]
+            run["pipeline_speedup"] = run["pipeline_records_per_s"] / baseline
+            results["runs"].append(run)
+            print(f"{workers:>7} {run['pharmacies_transform_per_s']:>17.0f} {run['users_transform_per_s']:>13.0f} "
+                  f"{run['pipeline_records_per_s']:>15.0f} {run['pipeline_speedup']:>7.2f}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
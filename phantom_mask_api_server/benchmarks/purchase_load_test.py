@@ -0,0 +1,263 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlencode
+
+from .datasets import CACHE_DIR, build_database
+from .endpoint_benchmark import percentile
+
+""" Concurrent purchase load test against a real server process
+
+Starts the API server on a copy of a synthetic database, drives it with N concurrent clients
+issuing a configurable mix of purchase, cancel and read requests, and reports throughput,
+latency percentiles, lock errors and whether cash balances were conserved.
+
+Usage (from phantom_mask_api_server/):
+    python -m benchmarks.purchase_load_test --clients 16 --duration 30 --mix purchase=80,cancel=5,read=15
+"""
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_COMMANDS = {
+    "runserver": "{python} manage.py runserver --noreload 127.0.0.1:{port}",
+    "gunicorn": "{python} -m gunicorn --config gunicorn.conf.py --bind 127.0.0.1:{port}",
+    "gunicorn-wsgi": "env SERVER_MODE=wsgi {python} -m gunicorn --config gunicorn.conf.py --bind 127.0.0.1:{port}",
+}
+LOCK_ERRORS = ("database is locked", "database table is locked", "busy")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(command, port, db_path, log_path, profile=None, timeout=30):
+    """ Starts the server on db_path and waits until it answers """
+    env = {**os.environ, "DATABASE_PATH": db_path}
+    if profile:
+        env["DATABASE_PROFILE"] = profile
+    args = command.format(python=sys.executable, port=port).split()
+    with open(log_path, "wb") as log:
+        process = subprocess.Popen(args, cwd=PROJECT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log_path, "r", encoding="utf-8", errors="replace") as log:
+                raise SystemExit(f"Server exited: {log.read()[-2000:]}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/api/")
+            if conn.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("Server did not start in time")
+
+
+def ledger(db_path):
+    """ Returns the cash balance totals and the transaction totals of a database """
+    conn = sqlite3.connect(db_path)
+    users, = conn.execute("SELECT SUM(cash_balance) FROM users").fetchone()
+    pharmacies, = conn.execute("SELECT SUM(cash_balance) FROM pharmacies").fetchone()
+    transactions, amount = conn.execute("SELECT COUNT(*), COALESCE(SUM(transaction_amount), 0) FROM transactions").fetchone()
+    conn.close()
+    return {"users": users, "pharmacies": pharmacies, "transactions": transactions, "transaction_amount": amount}
+
+
+def load_request_pool(db_path, seed):
+    """ Picks users, pharmacy masks and read requests from the database """
+    conn = sqlite3.connect(db_path)
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY cash_balance DESC LIMIT 1000")]
+    pharmacy_masks = conn.execute("SELECT pharmacy_id, mask_id FROM pharmacy_masks ORDER BY random() LIMIT 1000").fetchall()
+    pharmacy_names = [row[0] for row in conn.execute("SELECT name FROM pharmacies ORDER BY id LIMIT 100")]
+    start, end = conn.execute("SELECT date(MIN(transaction_date)), date(MAX(transaction_date)) FROM transactions").fetchone()
+    conn.close()
+
+    rng = random.Random(seed)
+    reads = [
+        "/api/pharmacies/open/?" + urlencode({"day": "mon", "time": "10:00"}),
+        "/api/pharmacies/masks/?" + urlencode({"pharmacy": rng.choice(pharmacy_names), "sort_by": "price"}),
+        "/api/pharmacies/compare-masks/?" + urlencode({"min": 5, "max": 30, "cond": "gt2"}),
+        "/api/transactions/active-users/?" + urlencode({"start": start, "end": end, "x": 10}),
+        "/api/transactions/amounts/?" + urlencode({"start": start, "end": end}),
+        "/api/search/?" + urlencode({"type": "mask", "q": "true"}),
+    ]
+    return user_ids, pharmacy_masks, reads
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        kind, weight = part.split("=")
+        if kind not in ("purchase", "cancel", "read"):
+            raise SystemExit(f"Unknown request kind in --mix: {kind}")
+        weights[kind] = float(weight)
+    return weights
+
+
+class Client(threading.Thread):
+    """ Issues requests of the configured mix until the deadline """
+
+    def __init__(self, port, deadline, weights, pool, seed, results):
+        super().__init__(daemon=True)
+        self.port = port
+        self.deadline = deadline
+        self.kinds, self.weights = zip(*weights.items())
+        self.user_ids, self.pharmacy_masks, self.reads = pool
+        self.rng = random.Random(seed)
+        self.results = results
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        for attempt in range(2):
+            try:
+                if self.conn is None:
+                    self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+                headers = {"Content-Type": "application/json", "Accept": "application/json"}
+                self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+                response = self.conn.getresponse()
+                return response.status, response.read().decode(errors="replace")
+            except (OSError, http.client.HTTPException):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            kind = self.rng.choices(self.kinds, self.weights)[0]
+            if kind == "purchase":
+                pharmacy_id, mask_id = self.rng.choice(self.pharmacy_masks)
+                args = ("POST", "/api/purchase/masks/", {
+                    "user_id": self.rng.choice(self.user_ids), "pharmacy_id": pharmacy_id,
+                    "mask_id": mask_id, "quantity": self.rng.randint(1, 3),
+                })
+            elif kind == "cancel":
+                args = ("POST", "/api/cancel-transactions/latest/", {})
+            else:
+                args = ("GET", self.rng.choice(self.reads))
+
+            start = time.perf_counter()
+            try:
+                status, body = self.request(*args)
+            except (OSError, http.client.HTTPException) as e:
+                status, body = 0, repr(e)
+            elapsed = (time.perf_counter() - start) * 1000
+            lock_error = status >= 500 and any(error in body.lower() for error in LOCK_ERRORS)
+            self.results.append((kind, status, elapsed, lock_error))
+
+
+def summarize(results, duration):
+    by_kind = defaultdict(list)
+    for result in results:
+        by_kind[result[0]].append(result)
+
+    summary = {}
+    for kind, kind_results in sorted(by_kind.items()):
+        latencies = sorted(r[2] for r in kind_results)
+        statuses = Counter(r[1] for r in kind_results)
+        summary[kind] = {
+            "requests": len(kind_results),
+            "throughput_per_s": len(kind_results) / duration,
+            "succeeded_per_s": statuses[200] / duration,
+            "latency_ms": {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+                           "p99": percentile(latencies, 0.99), "max": latencies[-1]},
+            "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+            "lock_errors": sum(1 for r in kind_results if r[3]),
+        }
+    return summary
+
+
+def check_balances(before, after, tolerance=0.01):
+    """ Money only moves between users and pharmacies, and every move has a transaction record """
+    moved = after["transaction_amount"] - before["transaction_amount"]
+    checks = {
+        # the sum of user and pharmacy cash balances is unchanged
+        "conservation": (before["users"] + before["pharmacies"]) - (after["users"] + after["pharmacies"]),
+        # users paid exactly the amount of the transactions that were added (lost updates break this)
+        "users_ledger": (before["users"] - after["users"]) - moved,
+        "pharmacies_ledger": (after["pharmacies"] - before["pharmacies"]) - moved,
+    }
+    return {name: {"difference": diff, "ok": abs(diff) <= tolerance} for name, diff in checks.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test concurrent purchases against a real server.")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client connections")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--mix", default="purchase=80,cancel=5,read=15", help="weights of the request kinds")
+    parser.add_argument("--scale", type=float, default=100, help="synthetic data size relative to the sample data")
+    parser.add_argument("--server", default="runserver", choices=sorted(SERVER_COMMANDS), help="server to start")
+    parser.add_argument("--server-command", help="custom server command ({python} and {port} are substituted)")
+    parser.add_argument("--profile", help="database profile of the server (defaults to its settings)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the request generator")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="folder of the generated databases")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as folder:
+        # the load test writes, so it runs on a copy of the cached database
+        db_path = os.path.join(folder, "phantom_mask_db.db")
+        shutil.copyfile(build_database(args.scale, args.cache_dir), db_path)
+        pool = load_request_pool(db_path, args.seed)
+        before = ledger(db_path)
+
+        port = free_port()
+        server = start_server(args.server_command or SERVER_COMMANDS[args.server], port, db_path,
+                              os.path.join(folder, "server.log"), args.profile)
+        try:
+            results = []
+            start = time.monotonic()
+            clients = [Client(port, start + args.duration, weights, pool, args.seed + i, results)
+                       for i in range(args.clients)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            duration = time.monotonic() - start
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        after = ledger(db_path)
+
+    summary = summarize(results, duration)
+    balances = check_balances(before, after)
+    report = {
+        "clients": args.clients, "duration_s": duration, "mix": weights, "scale": args.scale,
+        "server": args.server_command or args.server,
+        "database_profile": args.profile, "requests": summary, "balances": balances,
+        "transactions_added": after["transactions"] - before["transactions"],
+    }
+
+    print(f"{args.clients} clients, {duration:.1f} s, server: {report['server']}, profile: {args.profile or 'settings'}")
+    for kind, stats in summary.items():
+        latency = stats["latency_ms"]
+        print(f"  {kind:<9} {stats['throughput_per_s']:>8.1f} req/s  ({stats['succeeded_per_s']:.1f} ok/s)  "
+              f"p50 {latency['p50']:.1f} ms  p95 {latency['p95']:.1f} ms  p99 {latency['p99']:.1f} ms  "
+              f"lock errors {stats['lock_errors']}  statuses {stats['status_codes']}")
+    for name, check in balances.items():
+        print(f"  {name:<18} {'ok' if check['ok'] else 'FAILED'} (difference {check['difference']:+.4f})")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if not all(check["ok"] for check in balances.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
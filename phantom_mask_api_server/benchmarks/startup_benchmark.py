@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+""" Cold start report of a worker process: import time by package and time to the first requests
+
+Each run starts a new Python process that loads the application like a server worker
+(phantom_mask_api_server.wsgi or .asgi), then serves the first request of each --paths in turn
+through the Django test client. The report gives the median over --runs of:
+- ready: process start (as seen by this script) to the application loaded,
+- first request: time of the first request of each path, including the modules it imports,
+- the packages with the most import time (python -X importtime, summed by top-level package).
+
+Usage (from phantom_mask_api_server/):
+    python -m benchmarks.startup_benchmark
+    python -m benchmarks.startup_benchmark --runs 10 --paths /api/ "/api/search/?type=mask&q=true" --output startup.json
+"""
+
+DEFAULT_PATHS = ["/api/", "/swagger/?format=openapi"]
+
+# run in the child process; prints one JSON line with the timings (seconds, from its own clock)
+CHILD = """
+import json, os, sys, time
+started = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "phantom_mask_api_server.settings")
+import importlib
+importlib.import_module("phantom_mask_api_server." + sys.argv[1])
+ready = time.perf_counter()
+from django.conf import settings
+from django.test import Client
+settings.ALLOWED_HOSTS.append("testserver")
+client = Client()
+first_requests = []
+for path in sys.argv[2:]:
+    start = time.perf_counter()
+    status = client.get(path).status_code
+    first_requests.append([path, status, time.perf_counter() - start])
+print(json.dumps({"ready": ready - started, "first_requests": first_requests}))
+"""
+
+
+def run_once(server_mode, paths, importtime):
+    """ Starts a worker process; returns (wall time to ready, child timings, -X importtime output) """
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD, server_mode] + paths
+    start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True, env={**os.environ, "PERFORMANCE_LOG_LEVEL": "ERROR"})
+    if result.returncode != 0:
+        raise RuntimeError(f"worker process failed:\n{result.stderr}")
+    wall = time.perf_counter() - start
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    # interpreter startup is the part of the wall time the child can't measure itself
+    first_total = sum(seconds for _, _, seconds in timings["first_requests"])
+    return wall - first_total, timings, result.stderr
+
+
+def import_times_by_package(importtime_output):
+    """ Sums the self time (µs) of the modules in -X importtime output by top-level package """
+    totals = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + int(self_us)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of a worker process.")
+    parser.add_argument("--runs", type=int, default=5, help="worker processes started per measurement")
+    parser.add_argument("--server-mode", choices=["wsgi", "asgi"], default="asgi", help="application module to load")
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS, help="first requests, in order")
+    parser.add_argument("--top", type=int, default=15, help="packages listed by import time")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    ready, first_requests = [], {path: [] for path in args.paths}
+    for _ in range(args.runs):
+        wall_ready, timings, _ = run_once(args.server_mode, args.paths, importtime=False)
+        ready.append(wall_ready)
+        for path, status, seconds in timings["first_requests"]:
+            if status >= 500:
+                raise RuntimeError(f"{path} answered {status}")
+            first_requests[path].append(seconds)
+
+    runs_by_package = [import_times_by_package(run_once(args.server_mode, args.paths, importtime=True)[2])
+                       for _ in range(args.runs)]
+    packages = {package for run in runs_by_package for package in run}
+    import_ms = {
+        package: statistics.median(run.get(package, 0) for run in runs_by_package) / 1000 for package in packages
+    }
+
+    results = {
+        "server_mode": args.server_mode,
+        "runs": args.runs,
+        "ready_ms": statistics.median(ready) * 1000,
+        "first_request_ms": {path: statistics.median(values) * 1000 for path, values in first_requests.items()},
+        "import_ms": dict(sorted(import_ms.items(), key=lambda item: -item[1])),
+    }
+
+    print(f"ready (process start to application loaded): {results['ready_ms']:.0f} ms")
+    for path, ms in results["first_request_ms"].items():
+        print(f"first request {path:<40} {ms:>7.0f} ms")
+    print(f"time to first request: {results['ready_ms'] + results['first_request_ms'][args.paths[0]]:.0f} ms")
+    print(f"\nimport time by package (self time, {sum(import_ms.values()):.0f} ms in total):")
+    for package, ms in list(results["import_ms"].items())[:args.top]:
+        print(f"  {package:<30} {ms:>7.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import glob
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+
+""" gunicorn settings of the production server (python -m gunicorn --config gunicorn.conf.py)
+
+SERVER_MODE=asgi (default) runs phantom_mask_api_server/asgi.py on uvicorn workers, so the async
+read views share the event loop of a worker; SERVER_MODE=wsgi runs wsgi.py on threaded workers.
+
+Environment:
+    PORT: listening port (8000).
+    WEB_CONCURRENCY: worker processes (2 x CPUs + 1).
+    SERVER_THREADS: threads per worker: the request threads of wsgi workers, or the thread
+        pool that runs the sync views and sync_to_async() calls of asgi workers (4).
+    SERVER_TIMEOUT: seconds before a stuck worker is restarted (30).
+    METRICS_DIR: folder where the workers share their metrics (a folder in the temp directory).
+    OUTBOX_CONSUMER_INTERVAL: seconds between two runs of the outbox consumers, which the server
+        starts next to the workers (1; 0 doesn't start them, e.g. when they run elsewhere).
+"""
+
+SERVER_MODE = os.environ.get("SERVER_MODE", "asgi")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("SERVER_THREADS", 4))
+timeout = int(os.environ.get("SERVER_TIMEOUT", 30))
+keepalive = 5
+accesslog = "-"
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "phantom_mask_api_server.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+    # asgiref sizes its sync_to_async thread pool from ASGI_THREADS
+    os.environ.setdefault("ASGI_THREADS", str(threads))
+elif SERVER_MODE == "wsgi":
+    wsgi_app = "phantom_mask_api_server.wsgi:application"
+    worker_class = "gthread"
+else:
+    raise RuntimeError(f"Unknown SERVER_MODE '{SERVER_MODE}', expected 'asgi' or 'wsgi'")
+
+
+# the workers write their metrics here, so /metrics can add up all of them (see phantom_mask/metrics.py)
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "phantom_mask_metrics"))
+
+
+def on_starting(server):
+    """ Removes the metrics of a previous run of the server """
+    for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "metrics-*.json")):
+        os.remove(path)
+
+
+def when_ready(server):
+    """ Starts the outbox consumers (phantom_mask/outbox.py), which update the transaction store """
+    interval = os.environ.get("OUTBOX_CONSUMER_INTERVAL", "1")
+    server.outbox_consumers = None
+    if float(interval) > 0:
+        server.outbox_consumers = subprocess.Popen(
+            [sys.executable, "manage.py", "run_outbox_consumers", "--interval", interval],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+
+
+def on_exit(server):
+    consumers = getattr(server, "outbox_consumers", None)
+    if consumers is not None:
+        consumers.terminate()
+        consumers.wait(timeout=10)
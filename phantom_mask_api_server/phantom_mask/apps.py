@@ -1,6 +1,32 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+
+
+def apply_database_profile(sender, connection, **kwargs):
+    """ Applies the PRAGMAs of the alias' PROFILE (settings.DATABASE_PROFILE by default) to every new SQLite connection """
+    from django.conf import settings
+    from phantom_mask_api_server.db_profiles import apply_pragmas, get_profile
+
+    if connection.vendor == 'sqlite':
+        profile = connection.settings_dict.get('PROFILE', settings.DATABASE_PROFILE)
+        apply_pragmas(connection.connection, get_profile(profile)['pragmas'])
 
 
 class PhantomMaskConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'phantom_mask'
+
+    def ready(self):
+        connection_created.connect(apply_database_profile, dispatch_uid='phantom_mask.apply_database_profile')
+
+        # per-request SQL timing of the performance middleware
+        from .instrumentation import install_query_timer
+        connection_created.connect(install_query_timer, dispatch_uid='phantom_mask.install_query_timer')
+
+        # writes of the catalog models (e.g. from the admin) bump the catalog version
+        from .catalog_version import catalog_changed
+        for model_name in ('Pharmacies', 'Masks', 'PharmacyMasks'):
+            model = self.get_model(model_name)
+            post_save.connect(catalog_changed, sender=model, dispatch_uid=f'phantom_mask.catalog_saved.{model_name}')
+            post_delete.connect(catalog_changed, sender=model, dispatch_uid=f'phantom_mask.catalog_deleted.{model_name}')
@@ -0,0 +1,68 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from rest_framework import generics, views
+from rest_framework.response import Response
+
+""" Async versions of the DRF base views (DRF itself only dispatches synchronously)
+
+Under ASGI an async view does not hold a worker thread while it waits for the database, so a
+worker can serve many slow clients at once. Under WSGI Django runs them in an event loop per request.
+"""
+
+
+class AsyncAPIView(views.APIView):
+    """ APIView whose handlers (get, post, ...) are coroutines """
+
+    # makes Django's as_view() return a coroutine function
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        """ Same steps as APIView.dispatch(), awaiting the handler """
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # authentication, permissions and throttling may hit the database
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncListAPIView(AsyncAPIView, generics.GenericAPIView):
+    """ ListAPIView that fetches the queryset with the async ORM
+
+    Views that set fast_fields skip the serializer: the rows are fetched with values_list() (joins
+    and annotations done in SQL) and returned as plain dicts, which render to the same JSON as
+    serializer_class as long as fast_fields lists the serializer's fields, in order.
+    """
+
+    # output field name -> values_list() lookup (e.g. {"mask_name": "mask__name"})
+    fast_fields = None
+
+    async def get(self, request, *args, **kwargs):
+        # building the queryset validates the parameters and may run small lookups
+        queryset = await sync_to_async(lambda: self.filter_queryset(self.get_queryset()))()
+        if self.fast_fields is not None:
+            names = list(self.fast_fields)
+            rows = queryset.values_list(*self.fast_fields.values())
+            return Response([dict(zip(names, row)) async for row in rows])
+
+        objects = [obj async for obj in queryset]
+        serializer = self.get_serializer(objects, many=True)
+        return Response(serializer.data)
@@ -0,0 +1,208 @@
+import threading
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .catalog_version import acurrent_catalog_version, current_catalog_version
+from .models import Masks, Pharmacies, PharmacyMasks
+
+""" In-process read model of the catalog (pharmacies, opening hours, masks and prices)
+
+The catalog is small and rarely changes, so each process keeps a CatalogSnapshot of it per
+database alias and answers the open pharmacies, pharmacy masks and compare masks endpoints from
+memory. A snapshot is built for one catalog version (see catalog_version.py); when the version
+changes, the next request builds a new snapshot and swaps it in with a single assignment, while
+requests already running keep the snapshot they started with.
+
+The answers are the same as the ORM queries of the views: strings compare by code point (SQLite's
+BINARY collation), and rows with equal prices are ordered by mask id. The lookups that go through
+every pharmacy (opening hours, price counts) are vectorized with numpy, and the async views run
+them off the event loop.
+"""
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+
+class PharmacyRecord:
+    __slots__ = ("id", "name", "hours", "offers", "offers_by_name", "offers_by_price")
+
+    def __init__(self, id, name, hours):
+        self.id = id
+        self.name = name
+        # (open, close) of each day in DAYS, as stored ("HH:MM" or None)
+        self.hours = hours
+        self.offers = ()
+        self.offers_by_name = ()
+        self.offers_by_price = ()
+
+
+class MaskRecord:
+    __slots__ = ("id", "name", "model", "color", "num_per_pack")
+
+    def __init__(self, id, name, model, color, num_per_pack):
+        self.id = id
+        self.name = name
+        self.model = model
+        self.color = color
+        self.num_per_pack = num_per_pack
+
+
+class OfferRecord:
+    """ A mask sold by a pharmacy (a pharmacy_masks row) """
+
+    __slots__ = ("pharmacy", "mask", "price")
+
+    def __init__(self, pharmacy, mask, price):
+        self.pharmacy = pharmacy
+        self.mask = mask
+        self.price = price
+
+    def as_row(self):
+        """ Row of the pharmacy masks list (the fields of PharmacyMasksSerializer) """
+        return {
+            "pharmacy_name": self.pharmacy.name,
+            "mask_name": self.mask.name,
+            "model": self.mask.model,
+            "color": self.mask.color,
+            "num_per_pack": self.mask.num_per_pack,
+            "price": self.price,
+        }
+
+
+class CatalogSnapshot:
+    """ Immutable catalog of one database alias at one catalog version """
+
+    def __init__(self, version, pharmacies, masks, offers):
+        self.version = version
+        # id-indexed arrays (None where there is no row with that id)
+        self.pharmacies = [None] * (max((pharmacy.id for pharmacy in pharmacies), default=0) + 1)
+        self.masks = [None] * (max((mask.id for mask in masks), default=0) + 1)
+        for pharmacy in pharmacies:
+            self.pharmacies[pharmacy.id] = pharmacy
+        for mask in masks:
+            self.masks[mask.id] = mask
+
+        self.pharmacies_by_id = tuple(sorted(pharmacies, key=lambda pharmacy: pharmacy.id))
+        self.pharmacies_by_name = tuple(sorted(pharmacies, key=lambda pharmacy: (pharmacy.name, pharmacy.id)))
+        self.pharmacy_names = {pharmacy.name: pharmacy for pharmacy in self.pharmacies_by_id[::-1]}
+
+        offers_of_pharmacy = {}
+        for offer in offers:
+            offers_of_pharmacy.setdefault(offer.pharmacy.id, []).append(offer)
+        for pharmacy_id, pharmacy_offers in offers_of_pharmacy.items():
+            pharmacy = self.pharmacies[pharmacy_id]
+            pharmacy_offers.sort(key=lambda offer: offer.mask.id)
+            pharmacy.offers = tuple(pharmacy_offers)
+            pharmacy.offers_by_name = tuple(sorted(pharmacy_offers, key=lambda offer: offer.mask.name))
+            pharmacy.offers_by_price = tuple(sorted(pharmacy_offers, key=lambda offer: offer.price))
+
+        # (opening times, closing times, whether it opens) of every pharmacy by id, for each day in DAYS
+        self.hours_of_day = []
+        for index in range(len(DAYS)):
+            hours = [pharmacy.hours[index] for pharmacy in self.pharmacies_by_id]
+            self.hours_of_day.append((
+                np.array([opens or "" for opens, _ in hours], dtype=str),
+                np.array([closes or "" for _, closes in hours], dtype=str),
+                np.array([opens is not None and closes is not None for opens, closes in hours], dtype=np.bool_),
+            ))
+
+        # price of every offer, with the position of its pharmacy in pharmacies_by_name
+        self.offer_prices = np.array([offer.price for pharmacy in self.pharmacies_by_name for offer in pharmacy.offers], dtype=np.float64)
+        self.offer_positions = np.repeat(np.arange(len(self.pharmacies_by_name), dtype=np.int64),
+                                         [len(pharmacy.offers) for pharmacy in self.pharmacies_by_name])
+
+    @classmethod
+    def load(cls, using="default"):
+        """ Reads the catalog of a database alias (the version is read first, so it is never newer than the rows) """
+        version = current_catalog_version(using)
+        masks = [
+            MaskRecord(*row)
+            for row in Masks.objects.using(using).values_list("id", "name", "model", "color", "num_per_pack")
+        ]
+        hour_fields = [f"{day}_{end}" for day in DAYS for end in ("open", "close")]
+        pharmacies = []
+        for pharmacy_id, name, *hours in Pharmacies.objects.using(using).values_list("id", "name", *hour_fields):
+            pharmacies.append(PharmacyRecord(pharmacy_id, name, tuple(zip(hours[::2], hours[1::2]))))
+        pharmacies_by_id = {pharmacy.id: pharmacy for pharmacy in pharmacies}
+        masks_by_id = {mask.id: mask for mask in masks}
+        offers = [
+            OfferRecord(pharmacies_by_id[pharmacy_id], masks_by_id[mask_id], price)
+            for pharmacy_id, mask_id, price in PharmacyMasks.objects.using(using).values_list("pharmacy_id", "mask_id", "price")
+        ]
+        return cls(version, pharmacies, masks, offers)
+
+    def open_pharmacies(self, day, time):
+        """ Names of the pharmacies open on day at time, by id (see PharmacyQueryService.filter_by_day_and_time) """
+        # the views compare the stored "HH:MM" strings with str(time) ("HH:MM:SS")
+        at = str(time)
+        opens, closes, has_hours = self.hours_of_day[DAYS.index(day)]
+        is_open = has_hours & (((opens <= at) & (at <= closes)) | ((opens > closes) & ((closes >= at) | (opens <= at))))
+        return [{"name": self.pharmacies_by_id[i].name} for i in np.flatnonzero(is_open).tolist()]
+
+    def find_pharmacy(self, name):
+        """ Returns the pharmacy called name (the lowest id if several are), or None """
+        return self.pharmacy_names.get(name)
+
+    def pharmacy_masks(self, pharmacy, sort_by):
+        """ Rows of the masks sold by a pharmacy, sorted by 'name', 'price' or None (by mask id) """
+        offers = {None: pharmacy.offers, "name": pharmacy.offers_by_name, "price": pharmacy.offers_by_price}[sort_by]
+        return [offer.as_row() for offer in offers]
+
+    def count_prices(self, price_ranges):
+        """ Number of masks of every pharmacy (rows, by name) priced in each (min_price, max_price) range (columns) """
+        counts = np.zeros((len(self.pharmacies_by_name), len(price_ranges)), dtype=np.int64)
+        for i, (min_price, max_price) in enumerate(price_ranges):
+            # (an empty range, min_price > max_price, counts 0 as in SQL)
+            in_range = (self.offer_prices >= min_price) & (self.offer_prices <= max_price)
+            counts[:, i] = np.bincount(self.offer_positions[in_range], minlength=counts.shape[0])
+        return counts
+
+    def mask_counts(self, min_price, max_price):
+        """ (pharmacy, number of masks priced in [min_price, max_price]) of every pharmacy, by name """
+        return list(zip(self.pharmacies_by_name, self.count_prices([(min_price, max_price)])[:, 0].tolist()))
+
+    def mask_counts_in_ranges(self, price_ranges):
+        """ (pharmacy, [number of masks priced in each (min_price, max_price) range]) of every pharmacy, by name """
+        return list(zip(self.pharmacies_by_name, self.count_prices(price_ranges).tolist()))
+
+# alias -> CatalogSnapshot; replaced as a whole, never modified
+_snapshots = {}
+_load_lock = threading.Lock()
+
+
+def get_catalog_snapshot(using="default"):
+    """ Returns the snapshot of the current catalog version, loading it if needed
+
+    Returns None when the snapshot is turned off (CATALOG_SNAPSHOT) or the database has no
+    catalog_version table; the views then query the database.
+    """
+    if not settings.CATALOG_SNAPSHOT:
+        return None
+    version = current_catalog_version(using)
+    if version is None:
+        return None
+    snapshot = _snapshots.get(using)
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    # one thread loads the new version, the others wait for it
+    with _load_lock:
+        snapshot = _snapshots.get(using)
+        if snapshot is None or snapshot.version != version:
+            snapshot = _snapshots[using] = CatalogSnapshot.load(using)
+    return snapshot
+
+
+async def aget_catalog_snapshot(using="default"):
+    """ get_catalog_snapshot() for async views; leaves the event loop only to read the database """
+    if not settings.CATALOG_SNAPSHOT:
+        return None
+    version = await acurrent_catalog_version(using)
+    snapshot = _snapshots.get(using)
+    if snapshot is not None and version is not None and snapshot.version == version:
+        return snapshot
+    return await sync_to_async(get_catalog_snapshot)(using)
+
+
+def clear_catalog_snapshots():
+    """ Drops the snapshots of this process (e.g. after changing the catalog without bumping its version) """
+    _snapshots.clear()
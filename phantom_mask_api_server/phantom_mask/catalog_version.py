@@ -0,0 +1,71 @@
+from time import monotonic
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+
+""" Version counter of the catalog (pharmacies, masks, prices and opening hours)
+
+The counter lives in the catalog_version table (created by scripts/db_setup.py). It is bumped by
+the pharmacy ETL and by every ORM write of a catalog model, so anything derived from the catalog
+(e.g. cached responses) can be keyed by it and never needs explicit invalidation.
+
+current_catalog_version() reads the counter at most every CATALOG_VERSION_TTL seconds, so the
+catalog read paths do no database I/O in the steady state; writes made by this process are seen
+at once, writes of other processes after at most CATALOG_VERSION_TTL seconds.
+"""
+
+# saves that only change these fields don't change the catalog (purchases move cash balances)
+NON_CATALOG_FIELDS = frozenset({"cash_balance"})
+
+
+def get_catalog_version(using="default"):
+    """ Returns the current catalog version of a database alias, or None without a catalog_version table """
+    try:
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    return row[0] if row else None
+
+
+# alias -> (version, monotonic time it was read)
+_checked_versions = {}
+
+
+def current_catalog_version(using="default"):
+    """ get_catalog_version(), read again only when the last read is older than CATALOG_VERSION_TTL """
+    checked = _checked_versions.get(using)
+    if checked is not None and monotonic() - checked[1] < settings.CATALOG_VERSION_TTL:
+        return checked[0]
+    version = get_catalog_version(using)
+    _checked_versions[using] = (version, monotonic())
+    return version
+
+
+async def acurrent_catalog_version(using="default"):
+    """ current_catalog_version() for async code; only a database read leaves the event loop """
+    checked = _checked_versions.get(using)
+    if checked is not None and monotonic() - checked[1] < settings.CATALOG_VERSION_TTL:
+        return checked[0]
+    return await sync_to_async(current_catalog_version)(using)
+
+
+def forget_catalog_version():
+    """ Makes the next current_catalog_version() call read the counter """
+    _checked_versions.clear()
+
+
+def bump_catalog_version(using="default"):
+    """ Increments the catalog version, in the current transaction of the alias """
+    with connections[using].cursor() as cursor:
+        cursor.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+    # this process sees its own change as soon as it is committed
+    transaction.on_commit(forget_catalog_version, using=using)
+
+
+def catalog_changed(sender, instance=None, using="default", update_fields=None, **kwargs):
+    """ post_save / post_delete receiver of the catalog models """
+    if update_fields is not None and set(update_fields) <= NON_CATALOG_FIELDS:
+        return
+    bump_catalog_version(using)
@@ -0,0 +1,162 @@
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+""" Online backups of the SQLite database with the backup API, while the server keeps writing
+
+The copy runs in one read transaction when the database is in WAL mode (the development and
+production profiles): WAL readers don't block writers, and the copy is a consistent snapshot of
+the last commit before it started. Copying it in steps instead would gain nothing: every commit of
+another connection between two steps restarts the backup, so under steady purchases it would
+never finish.
+
+A database in rollback journal mode (the "none" profile) blocks writers while it is read, so it
+is copied STEP_PAGES pages at a time with a pause after each step, in which writers take the lock.
+A commit between two steps restarts the copy; after MAX_RESTARTS restarts the rest is copied in
+one step, so a backup always ends.
+
+Backups are switched to the rollback journal, checked with PRAGMA integrity_check and only then
+moved in place, so a backup file (or replica snapshot) is always complete.
+"""
+
+# pages copied per step of a rollback journal database (of 4 KiB: 4 MiB per step)
+STEP_PAGES = 1024
+# seconds between two steps, in which writers of the database get the lock
+STEP_PAUSE = 0.01
+# restarts (commits of other connections during the copy) before the rest is copied in one step
+MAX_RESTARTS = 10
+
+BACKUP_TIME_FORMAT = "%Y%m%d-%H%M%S"
+
+
+class BackupError(Exception):
+    """ A backup that failed its integrity check """
+
+
+class _Restarted(Exception):
+    """ Stops a stepped backup that was restarted too often """
+
+
+def online_backup(source, target, step_pages=STEP_PAGES, step_pause=STEP_PAUSE, max_restarts=MAX_RESTARTS):
+    """ Copies the source database into the connection target with the backup API
+
+    Args:
+        source (sqlite3.Connection): Connection to the database to copy.
+        target (sqlite3.Connection): Connection to the copy.
+        step_pages (int): Pages per step of a rollback journal database.
+        step_pause (float): Seconds between two steps.
+        max_restarts (int): Restarts before the rest is copied in one step.
+
+    Returns:
+        dict: steps, restarts and pages of the copy.
+    """
+    stats = {"steps": 0, "restarts": 0, "pages": 0}
+    if source.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+        source.backup(target)
+        stats["steps"] = 1
+    else:
+        remaining_before = None
+
+        def progress(status, remaining, pages):
+            nonlocal remaining_before
+            stats["steps"] += 1
+            stats["pages"] = pages
+            # a step that copied its pages but left as many to go started over (status 0 is SQLITE_OK;
+            # steps that found the database locked are retried by backup() and copied nothing)
+            if status == sqlite3.SQLITE_OK and remaining_before is not None and remaining >= remaining_before:
+                stats["restarts"] += 1
+                if stats["restarts"] > max_restarts:
+                    raise _Restarted
+            remaining_before = remaining
+            if remaining:
+                time.sleep(step_pause)
+
+        try:
+            source.backup(target, pages=step_pages, progress=progress)
+        except _Restarted:
+            source.backup(target)
+            stats["steps"] += 1
+    stats["pages"] = target.execute("PRAGMA page_count").fetchone()[0]
+    return stats
+
+
+def snapshot_database(source, target, verify=True, **options):
+    """ Copies the source database file into target atomically
+
+    Args:
+        source (str): Path of the database.
+        target (str): Path of the copy, replaced when it exists.
+        verify (bool): Run PRAGMA integrity_check on the copy before moving it in place.
+        **options: step_pages, step_pause and max_restarts of online_backup().
+
+    Returns:
+        dict: The statistics of online_backup().
+
+    Raises:
+        BackupError: If the copy fails its integrity check (target is left as it was).
+    """
+    partial = target + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(partial)
+    try:
+        stats = online_backup(src, dst, **options)
+        # a single file: immutable connections (the read replica) cannot read a WAL file
+        dst.execute("PRAGMA journal_mode = DELETE").fetchall()
+        result = dst.execute("PRAGMA integrity_check").fetchall() if verify else [("ok",)]
+    finally:
+        dst.close()
+        src.close()
+    if result != [("ok",)]:
+        os.remove(partial)
+        raise BackupError(f"Integrity check of the backup of {source} failed: {result[:5]}")
+    os.replace(partial, target)
+    return stats
+
+
+def backup_path(directory, database, moment=None):
+    """ Path of a backup of database taken at moment (UTC, defaults to now) in directory """
+    stem = os.path.splitext(os.path.basename(database))[0]
+    moment = moment or datetime.now(timezone.utc)
+    return os.path.join(directory, f"{stem}-{moment.strftime(BACKUP_TIME_FORMAT)}.db")
+
+
+def list_backups(directory, database):
+    """ Returns the backups of database in directory, oldest first """
+    stem = os.path.splitext(os.path.basename(database))[0]
+    pattern = re.compile(re.escape(stem) + r"-\d{8}-\d{6}\.db")
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names) if pattern.fullmatch(name)]
+
+
+def rotate_backups(directory, database, keep):
+    """ Removes the backups of database in directory but the keep latest; returns the removed paths """
+    backups = list_backups(directory, database)
+    removed = backups[:max(0, len(backups) - keep)]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def backup_database(database, directory, keep, **options):
+    """ Takes a verified backup of database into directory and rotates the backups
+
+    Args:
+        database (str): Path of the database.
+        directory (str): Folder of the backups (created when missing).
+        keep (int): Backups kept, the new one included.
+        **options: step_pages, step_pause and max_restarts of online_backup().
+
+    Returns:
+        tuple[str, dict, list[str]]: Path of the backup, statistics of online_backup() and removed backups.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = backup_path(directory, database)
+    stats = snapshot_database(database, path, **options)
+    return path, stats, rotate_backups(directory, database, keep)
@@ -0,0 +1,52 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+""" Read/write routing between the primary database and the read replica
+
+Only code that runs inside read_from_replica() reads from the 'replica' alias (the read-only
+views enter it, see views.ReplicaReadMixin); everything else, and every write, uses 'default'.
+"""
+
+REPLICA = "replica"
+PRIMARY_PIN_COOKIE = "pin_primary"   # set after a write, so the next requests read their own writes
+
+_read_from_replica = ContextVar("read_from_replica", default=False)
+
+
+@contextmanager
+def read_from_replica():
+    """ Routes the reads made inside the block to the replica (when one is configured) """
+    token = _read_from_replica.set(True)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+def replica_available():
+    """ True when a replica alias is configured and, for a SQLite snapshot, the snapshot exists """
+    if REPLICA not in settings.DATABASES:
+        return False
+    snapshot = getattr(settings, "REPLICA_SNAPSHOT_PATH", None)
+    return snapshot is None or os.path.exists(snapshot)
+
+
+class ReadReplicaRouter:
+    """ Sends the reads of read_from_replica() blocks to the replica and everything else to the primary """
+
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get() and replica_available():
+            return REPLICA
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
@@ -0,0 +1,164 @@
+import heapq
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from . import metrics
+
+""" Per-request performance instrumentation
+
+PerformanceMiddleware measures every request: the SQL queries and their time, the view time,
+the render time and the response size. It adds them to the response as a Server-Timing header
+(visible in the browser's network panel), writes one log line per request to the
+'phantom_mask.performance' logger, and logs requests over the thresholds in settings
+(PERFORMANCE_SLOW_REQUEST_MS, PERFORMANCE_MAX_QUERIES) as warnings with their slowest SQL.
+The same measurements feed the per-route Prometheus metrics (see metrics.py).
+
+The SQL timer is an execute wrapper installed once on every database connection (see
+PhantomMaskConfig.ready()). It reports to the RequestStats of the current request through a
+ContextVar, which also reaches the threads that run the ORM for the async views.
+"""
+
+logger = logging.getLogger("phantom_mask.performance")
+
+_current_stats = ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    """ Measurements of one request """
+
+    __slots__ = ("start", "queries", "sql_seconds", "render_seconds", "slowest_sql")
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        # min-heap of the slowest (seconds, sql) statements
+        self.slowest_sql = []
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        if len(self.slowest_sql) < settings.PERFORMANCE_SLOW_QUERIES_LOGGED:
+            heapq.heappush(self.slowest_sql, (seconds, sql))
+        elif self.slowest_sql and seconds > self.slowest_sql[0][0]:
+            heapq.heapreplace(self.slowest_sql, (seconds, sql))
+
+
+def current_stats():
+    """ Returns the RequestStats of the request being handled, or None outside a request """
+    return _current_stats.get()
+
+
+def time_query(execute, sql, params, many, context):
+    """ Execute wrapper (connection.execute_wrapper) that reports each query to the current request """
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, perf_counter() - start)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """ connection_created receiver: adds time_query to the connection's execute wrappers (once) """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+@contextmanager
+def measure_render():
+    """ Adds the time spent in the block to the render time of the current request """
+    stats = _current_stats.get()
+    if stats is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        stats.render_seconds += perf_counter() - start
+
+
+class PerformanceMiddleware:
+    """ Measures each request (see the module docstring); place it first in MIDDLEWARE """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        metrics.request_started()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.request_finished()
+            _current_stats.reset(token)
+        self.report(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        metrics.request_started()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.request_finished()
+            _current_stats.reset(token)
+        self.report(request, response, stats)
+        return response
+
+    @staticmethod
+    def report(request, response, stats):
+        """ Adds the Server-Timing header, logs the request and records its metrics """
+        total_seconds = perf_counter() - stats.start
+        # route pattern rather than path, so the metrics have one series per endpoint
+        match = request.resolver_match
+        route = f"/{match.route}" if match is not None else "unmatched"
+        metrics.record_request(route, request.method, response.status_code, total_seconds,
+                               stats.queries, stats.sql_seconds)
+
+        total_ms = total_seconds * 1000
+        sql_ms = stats.sql_seconds * 1000
+        render_ms = stats.render_seconds * 1000
+        # the view time includes its SQL; rendering happens after the view returns
+        view_ms = total_ms - render_ms
+        size = len(response.content) if not response.streaming else None
+
+        response["Server-Timing"] = (
+            f'db;dur={sql_ms:.2f};desc="{stats.queries} queries", view;dur={view_ms:.2f}, '
+            f'render;dur={render_ms:.2f}, total;dur={total_ms:.2f}'
+        )
+
+        slow = total_ms > settings.PERFORMANCE_SLOW_REQUEST_MS or stats.queries > settings.PERFORMANCE_MAX_QUERIES
+        if not slow and not logger.isEnabledFor(logging.INFO):
+            return
+        line = (
+            f"method={request.method} path={request.path} status={response.status_code} "
+            f"total_ms={total_ms:.2f} view_ms={view_ms:.2f} render_ms={render_ms:.2f} "
+            f"sql_ms={sql_ms:.2f} queries={stats.queries} bytes={size if size is not None else '-'}"
+        )
+        if slow:
+            slowest = sorted(stats.slowest_sql, reverse=True)
+            details = "".join(f"\n  {seconds * 1000:.2f} ms: {sql}" for seconds, sql in slowest)
+            logger.warning("slow %s%s", line, details)
+        else:
+            logger.info("%s", line)
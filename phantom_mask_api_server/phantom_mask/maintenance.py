@@ -0,0 +1,180 @@
+import time
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from .outbox import prune_batch
+from .transaction_rollup import compact_batch
+
+""" Background maintenance of the database, in small steps with a time budget per run
+
+python manage.py run_maintenance --interval 10 runs the jobs next to the server, each one when its
+interval has passed since its last run:
+- optimize: PRAGMA optimize, which runs ANALYZE on the tables whose statistics are stale (a
+  database that was never analyzed is analyzed once), so query plans follow the data.
+- checkpoint: copies the WAL into the database file without waiting for readers or writers
+  (PASSIVE), and truncates the WAL file once it is all copied and larger than WAL_TRUNCATE_PAGES.
+- incremental_vacuum: gives free pages back to the file system, VACUUM_STEP_PAGES at a time
+  (databases created by db_setup.py use auto_vacuum = INCREMENTAL).
+- compact_transactions: folds the transactions of closed days into daily totals per pharmacy
+  (see transaction_rollup.py), one batch per database transaction.
+- prune_outbox: deletes the outbox events that every consumer has read, once they are older than
+  OUTBOX_RETENTION (see outbox.py), one batch per database transaction.
+
+A run stops at the end of its budget: statements still running are interrupted (and rolled back)
+by a progress handler, and step-by-step jobs continue at their next run. Write steps are short
+transactions with a pause after each one, so requests never wait on maintenance for long. The
+first three jobs are for SQLite; PostgreSQL does the same with autovacuum.
+"""
+
+# pages given back to the file system per step of incremental_vacuum
+VACUUM_STEP_PAGES = 256
+# WAL pages (of 4 KiB: 16 MiB) above which a fully checkpointed WAL file is truncated
+WAL_TRUNCATE_PAGES = 4096
+# rows read per table by ANALYZE (PRAGMA analysis_limit), which keeps it to a few milliseconds
+ANALYSIS_LIMIT = 1000
+# seconds between two write steps, in which the requests take the write lock
+STEP_PAUSE = 0.01
+# SQLite virtual machine instructions between two checks of the budget
+PROGRESS_STEPS = 1000
+
+
+@contextmanager
+def interrupt_after(connection, deadline):
+    """ Interrupts the SQLite statements of the block that are still running at deadline (time.monotonic()) """
+    connection.ensure_connection()
+    connection.connection.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+    try:
+        yield
+    finally:
+        connection.connection.set_progress_handler(None, 0)
+
+
+def optimize(connection, deadline):
+    with connection.cursor() as cursor, interrupt_after(connection, deadline):
+        cursor.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+        if cursor.fetchone() is None:
+            cursor.execute("ANALYZE")
+            return "analyzed", False
+        cursor.execute("PRAGMA optimize")
+    return "optimized", False
+
+
+def checkpoint(connection, deadline):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        _, wal_pages, copied_pages = cursor.fetchone()
+        if wal_pages < 0:
+            return "not in WAL mode", False
+        if wal_pages == copied_pages and wal_pages > WAL_TRUNCATE_PAGES:
+            # needs the write lock and no reader on an older snapshot; gives up at once otherwise
+            cursor.execute("PRAGMA busy_timeout")
+            busy_timeout = cursor.fetchone()[0]
+            cursor.execute("PRAGMA busy_timeout = 0")
+            try:
+                cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                if not cursor.fetchone()[0]:
+                    return f"{copied_pages} pages copied, WAL truncated", False
+            finally:
+                cursor.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+    return f"{copied_pages} of {wal_pages} pages copied", False
+
+
+def incremental_vacuum(connection, deadline):
+    freed = 0
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA auto_vacuum")
+        if cursor.fetchone()[0] != 2:
+            return "auto_vacuum is not INCREMENTAL (VACUUM the database once after setting it)", False
+        while True:
+            cursor.execute("PRAGMA freelist_count")
+            free_pages = cursor.fetchone()[0]
+            if not free_pages or time.monotonic() >= deadline:
+                break
+            pages = min(free_pages, VACUUM_STEP_PAGES)
+            # execute() of sqlite3 runs a single step of it, which frees one page
+            connection.connection.executescript(f"PRAGMA incremental_vacuum({pages})")
+            freed += pages
+            time.sleep(STEP_PAUSE)
+    return f"{freed} pages freed", free_pages > 0
+
+
+def compact_transactions(connection, deadline):
+    folded, more = 0, True
+    while more and time.monotonic() < deadline:
+        batch, more = compact_batch(using=connection.alias)
+        folded += batch
+        if more:
+            time.sleep(STEP_PAUSE)
+    return f"{folded} transactions folded", more
+
+
+def prune_outbox(connection, deadline):
+    deleted, more = 0, True
+    while more and time.monotonic() < deadline:
+        batch, more = prune_batch(using=connection.alias)
+        deleted += batch
+        if more:
+            time.sleep(STEP_PAUSE)
+    return f"{deleted} outbox events deleted", more
+
+
+# job -> function(connection, deadline) returning (what it did, whether work is left), seconds between
+# two runs, seconds of a run, SQLite only
+JOBS = {
+    "optimize": {"run": optimize, "interval": 3600, "budget": 0.5, "sqlite_only": True},
+    "checkpoint": {"run": checkpoint, "interval": 60, "budget": 0.5, "sqlite_only": True},
+    "incremental_vacuum": {"run": incremental_vacuum, "interval": 3600, "budget": 0.5, "sqlite_only": True},
+    "compact_transactions": {"run": compact_transactions, "interval": 300, "budget": 2.0, "sqlite_only": False},
+    "prune_outbox": {"run": prune_outbox, "interval": 3600, "budget": 1.0, "sqlite_only": False},
+}
+
+
+def run_job(name, budget=None, using=DEFAULT_DB_ALIAS):
+    """ Runs a maintenance job once, within its time budget
+
+    Args:
+        name (str): Name of the job in JOBS.
+        budget (float | None): Seconds of the run (defaults to the budget of the job).
+        using (str): Database alias.
+
+    Returns:
+        tuple[str, bool]: What the job did, and whether it stopped with work left.
+    """
+    job = JOBS[name]
+    connection = connections[using]
+    if job["sqlite_only"] and connection.vendor != "sqlite":
+        return f"skipped on {connection.vendor}", False
+    deadline = time.monotonic() + (budget if budget is not None else job["budget"])
+    try:
+        return job["run"](connection, deadline)
+    except OperationalError as e:
+        if "interrupted" not in str(e):
+            raise
+        return "interrupted at the end of its budget", False
+
+
+def run_due_jobs(last_runs, names=None, budget=None, using=DEFAULT_DB_ALIAS):
+    """ Runs the jobs whose interval has passed since their last run, or that stopped with work left
+
+    Args:
+        last_runs (dict): Job -> time.monotonic() of its last run, updated in place.
+        names (list[str] | None): Jobs to consider (defaults to all of them).
+        budget (float | None): Seconds of a run (defaults to the budget of each job).
+        using (str): Database alias.
+
+    Returns:
+        list[tuple[str, str, bool, float]]: Job, result, whether work is left and seconds of each run.
+    """
+    runs = []
+    for name in names or JOBS:
+        start = time.monotonic()
+        if name in last_runs and start - last_runs[name] < JOBS[name]["interval"]:
+            continue
+        result, more = run_job(name, budget, using)
+        # a job with work left (e.g. the compaction after a load) goes on at the next check
+        if more:
+            last_runs.pop(name, None)
+        else:
+            last_runs[name] = start
+        runs.append((name, result, more, time.monotonic() - start))
+    return runs
@@ -0,0 +1,62 @@
+import os
+import shutil
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from phantom_mask.db_backup import MAX_RESTARTS, STEP_PAGES, STEP_PAUSE, BackupError, backup_database
+
+""" Takes online backups of the SQLite database into settings.BACKUP_DIR, once or on a schedule """
+
+
+class Command(BaseCommand):
+    help = ("Back up the SQLite database while the server runs, once or every --interval seconds, "
+            "keeping the latest --keep backups.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", help="database to back up (default: the default database)")
+        parser.add_argument("--output-dir", default=settings.BACKUP_DIR, help="folder of the backups (default: BACKUP_DIR)")
+        parser.add_argument("--keep", type=int, default=settings.BACKUP_RETENTION,
+                            help="backups kept (default: BACKUP_RETENTION)")
+        parser.add_argument("--interval", type=float, help="keep taking a backup every INTERVAL seconds")
+        parser.add_argument("--replica", action="store_true",
+                            help="also install each backup as the read replica snapshot (REPLICA_SNAPSHOT_PATH)")
+        parser.add_argument("--step-pages", type=int, default=STEP_PAGES,
+                            help="pages copied per step of a rollback journal database")
+        parser.add_argument("--step-pause", type=float, default=STEP_PAUSE, help="seconds between two steps")
+        parser.add_argument("--max-restarts", type=int, default=MAX_RESTARTS,
+                            help="restarts before the rest is copied in one step")
+
+    def handle(self, *args, **options):
+        if settings.DATABASE_ENGINE != "sqlite":
+            raise CommandError("Online backups are for the SQLite database; back up PostgreSQL with pg_dump or pg_basebackup.")
+        if options["keep"] < 1:
+            raise CommandError("--keep must be at least 1.")
+        if options["replica"] and settings.REPLICA_SNAPSHOT_PATH is None:
+            raise CommandError("Set REPLICA_SNAPSHOT_PATH to install the backups as read replica.")
+
+        source = options["source"] or settings.DATABASES["default"]["NAME"]
+        while True:
+            start = time.monotonic()
+            try:
+                path, stats, removed = backup_database(
+                    source, options["output_dir"], options["keep"], step_pages=options["step_pages"],
+                    step_pause=options["step_pause"], max_restarts=options["max_restarts"],
+                )
+            except BackupError as e:
+                # a scheduled run keeps the previous backups and tries again at the next interval
+                if not options["interval"]:
+                    raise CommandError(str(e))
+                self.stderr.write(str(e))
+            else:
+                if options["replica"]:
+                    # backups are verified and in rollback journal mode, as the immutable replica requires
+                    partial = settings.REPLICA_SNAPSHOT_PATH + ".partial"
+                    shutil.copyfile(path, partial)
+                    os.replace(partial, settings.REPLICA_SNAPSHOT_PATH)
+                self.stdout.write(
+                    f"Backup {path} taken in {time.monotonic() - start:.2f} s ({stats['pages']} pages, "
+                    f"{stats['steps']} steps, {stats['restarts']} restarts); {len(removed)} old backups removed"
+                )
+            if not options["interval"]:
+                break
+            time.sleep(max(0.0, options["interval"] - (time.monotonic() - start)))
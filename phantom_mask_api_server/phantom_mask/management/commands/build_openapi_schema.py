@@ -0,0 +1,18 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from phantom_mask.openapi_schema import write_schema_files
+
+""" Renders the OpenAPI document served at /swagger/ into settings.OPENAPI_SCHEMA_DIR (run at build time) """
+
+
+class Command(BaseCommand):
+    help = "Render the OpenAPI document of /swagger/ into OPENAPI_SCHEMA_DIR."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output-dir", default=settings.OPENAPI_SCHEMA_DIR,
+                            help="folder of the rendered documents (default: OPENAPI_SCHEMA_DIR)")
+
+    def handle(self, *args, **options):
+        for path in write_schema_files(options["output_dir"]):
+            self.stdout.write(f"Wrote {path} ({os.path.getsize(path)} bytes)")
@@ -0,0 +1,20 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from phantom_mask.transaction_store import TransactionStore
+
+""" Rebuilds the columnar transaction store (settings.TRANSACTION_STORE_DIR) from the database """
+
+
+class Command(BaseCommand):
+    help = "Rebuild the columnar transaction store of the analytics endpoints from the transactions table."
+
+    def handle(self, *args, **options):
+        if not settings.TRANSACTION_STORE_DIR:
+            raise CommandError("Set TRANSACTION_STORE_DIR to use a transaction store.")
+
+        start = time.monotonic()
+        with connection.cursor() as cursor:
+            rows = TransactionStore(settings.TRANSACTION_STORE_DIR).rebuild(cursor)
+        self.stdout.write(f"Transaction store rebuilt with {rows} transactions in {time.monotonic() - start:.2f} s")
@@ -0,0 +1,44 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from phantom_mask.db_backup import snapshot_database
+
+""" Refreshes the SQLite snapshot that serves as read replica (settings.REPLICA_SNAPSHOT_PATH) """
+
+
+def refresh_snapshot(source, target):
+    """ Copies the source database into target atomically
+
+    The copy is made with the online backup API (see phantom_mask/db_backup.py), so writers of the
+    source are not blocked for long, and is switched to the rollback journal, because immutable
+    connections cannot read a WAL file. Connections that already have the old snapshot open keep
+    reading it until they close.
+
+    Args:
+        source (str): Path of the primary database.
+        target (str): Path of the snapshot.
+    """
+    snapshot_database(source, target, verify=False)
+
+
+class Command(BaseCommand):
+    help = "Copy the SQLite database to the read replica snapshot, once or every --interval seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, help="keep refreshing every INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        if settings.REPLICA_SNAPSHOT_PATH is None:
+            raise CommandError("Set REPLICA_SNAPSHOT_PATH to use a snapshot read replica.")
+        if options["interval"] and options["interval"] > settings.REPLICA_MAX_LAG:
+            self.stderr.write(f"--interval is longer than REPLICA_MAX_LAG ({settings.REPLICA_MAX_LAG:g} s); "
+                              "clients may read stale data after their own writes")
+
+        source = settings.DATABASES["default"]["NAME"]
+        while True:
+            start = time.monotonic()
+            refresh_snapshot(source, settings.REPLICA_SNAPSHOT_PATH)
+            self.stdout.write(f"Snapshot refreshed in {time.monotonic() - start:.2f} s")
+            if not options["interval"]:
+                break
+            time.sleep(max(0.0, options["interval"] - (time.monotonic() - start)))
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from phantom_mask.maintenance import JOBS, run_due_jobs
+
+""" Runs the maintenance jobs of the database (phantom_mask/maintenance.py), once or on a schedule """
+
+
+class Command(BaseCommand):
+    help = ("Run the database maintenance jobs once, or with --interval keep running each one "
+            "when its own interval has passed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--job", action="append", choices=sorted(JOBS), dest="jobs",
+                            help="job to run (repeatable; default: all of them)")
+        parser.add_argument("--interval", type=float, help="keep checking for due jobs every INTERVAL seconds")
+        parser.add_argument("--budget", type=float, help="seconds of a run of each job (default: the budget of the job)")
+
+    def handle(self, *args, **options):
+        last_runs = {}
+        while True:
+            for name, result, more, seconds in run_due_jobs(last_runs, options["jobs"], options["budget"]):
+                self.stdout.write(f"{name}: {result}{' (more left)' if more else ''} ({seconds * 1000:.0f} ms)")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
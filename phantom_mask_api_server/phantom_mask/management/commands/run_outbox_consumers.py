@@ -0,0 +1,35 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from phantom_mask.outbox import CONSUMERS, run_consumers
+
+""" Runs the consumers of the outbox (phantom_mask/outbox.py), once or continuously """
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Hand the new outbox events to the enabled consumers until they have caught up, or with "
+            "--interval keep doing it every INTERVAL seconds.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--consumer", action="append", choices=sorted(CONSUMERS), dest="consumers",
+                            help="consumer to run (repeatable; default: all of them)")
+        parser.add_argument("--interval", type=float, help="keep checking for new events every INTERVAL seconds")
+        parser.add_argument("--budget", type=float, help="seconds each consumer runs at most per check")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                for name, handled in run_consumers(options["consumers"], options["budget"]):
+                    self.stdout.write(f"{name}: {handled} events")
+            except Exception:
+                if not options["interval"]:
+                    raise
+                # e.g. the database is restarting: the events are handed over again on the next run
+                logger.exception("Outbox consumers failed, retrying")
+                close_old_connections()
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,226 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+from django.http import HttpResponse
+
+""" Prometheus metrics of the API server (served at /metrics in the text exposition format)
+
+Counters are sharded per thread: each thread only ever writes its own dict, so recording needs
+no lock, and a scrape sums the shards. With several gunicorn workers (METRICS_DIR set, see
+gunicorn.conf.py) every worker writes its totals to METRICS_DIR/metrics-<pid>.json in the
+background (every METRICS_FLUSH_INTERVAL seconds), and a scrape served by any worker adds up the
+files of all workers. Counters of exited workers are kept; their gauges (in-flight requests) are not.
+"""
+
+# upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name: (type, help)
+METRICS = {
+    "phantom_mask_http_requests_total": ("counter", "HTTP requests by route, method and status."),
+    "phantom_mask_http_errors_total": ("counter", "HTTP requests answered with a 5xx status, by route."),
+    "phantom_mask_http_request_duration_seconds": ("histogram", "HTTP request latency by route."),
+    "phantom_mask_http_requests_in_flight": ("gauge", "HTTP requests being handled."),
+    "phantom_mask_db_queries_total": ("counter", "SQL queries by route."),
+    "phantom_mask_db_query_duration_seconds_total": ("counter", "Time spent in SQL queries by route."),
+    "phantom_mask_cache_requests_total": ("counter", "Cache lookups by cache and result (hit or miss)."),
+    "phantom_mask_cache_hit_ratio": ("gauge", "Share of cache lookups that were hits."),
+    "phantom_mask_purchases_total": ("counter", "Purchase transactions by result (commit or rollback)."),
+    "phantom_mask_single_flight_requests_total": ("counter", "Single-flight requests by view and role (computed or shared)."),
+}
+GAUGES = {name for name, (kind, _) in METRICS.items() if kind == "gauge"}
+
+
+class ShardedCounters:
+    """ Counters keyed by (metric name, labels), written without locks through per-thread shards """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+
+    def inc(self, key, amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # list.append is atomic; the shard is only written by this thread from now on
+            self._shards.append(shard)
+        shard[key] = shard.get(key, 0) + amount
+
+    def totals(self):
+        """ Returns the sum of all shards """
+        totals = {}
+        for shard in list(self._shards):
+            # dict() copies the shard atomically (under the GIL) even while its thread writes it
+            for key, value in dict(shard).items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+
+_counters = ShardedCounters()
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def record_request(route, method, status, seconds, queries, sql_seconds):
+    """ Records a finished request """
+    labels = _labels(route=route)
+    _counters.inc(("phantom_mask_http_requests_total", _labels(route=route, method=method, status=str(status))))
+    if status >= 500:
+        _counters.inc(("phantom_mask_http_errors_total", labels))
+    # buckets are stored per bound (not cumulative) and accumulated when rendered
+    bucket = bisect_left(LATENCY_BUCKETS, seconds)
+    le = str(LATENCY_BUCKETS[bucket]) if bucket < len(LATENCY_BUCKETS) else "+Inf"
+    _counters.inc(("phantom_mask_http_request_duration_seconds_bucket", labels + (("le", le),)))
+    _counters.inc(("phantom_mask_http_request_duration_seconds_sum", labels), seconds)
+    _counters.inc(("phantom_mask_http_request_duration_seconds_count", labels))
+    _counters.inc(("phantom_mask_db_queries_total", labels), queries)
+    _counters.inc(("phantom_mask_db_query_duration_seconds_total", labels), sql_seconds)
+    _start_flusher()
+
+
+def request_started():
+    _counters.inc(("phantom_mask_http_requests_in_flight", ()))
+
+
+def request_finished():
+    _counters.inc(("phantom_mask_http_requests_in_flight", ()), -1)
+
+
+def record_cache_lookup(cache, hit):
+    _counters.inc(("phantom_mask_cache_requests_total", _labels(cache=cache, result="hit" if hit else "miss")))
+
+
+def record_purchase(committed):
+    _counters.inc(("phantom_mask_purchases_total", _labels(result="commit" if committed else "rollback")))
+
+
+def record_single_flight(view, shared):
+    _counters.inc(("phantom_mask_single_flight_requests_total", _labels(view=view, role="shared" if shared else "computed")))
+
+
+def _metrics_file(pid):
+    return os.path.join(settings.METRICS_DIR, f"metrics-{pid}.json")
+
+
+def flush():
+    """ Writes the totals of this process to METRICS_DIR (atomically, readers never see a partial file) """
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = _metrics_file(os.getpid())
+    # the flush thread and a scrape may flush at the same time
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump([[name, labels, value] for (name, labels), value in _counters.totals().items()], f)
+    os.replace(temp_path, path)
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def _start_flusher():
+    """ Starts the background flush thread of this process (once per worker, after the fork) """
+    global _flusher_pid
+    if not settings.METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_periodically, name="metrics-flush", daemon=True).start()
+        atexit.register(flush)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """ Returns the totals of all worker processes (or of this process without METRICS_DIR) """
+    if not settings.METRICS_DIR:
+        return _counters.totals()
+
+    flush()
+    totals = {}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, "metrics-*.json")):
+        pid = int(os.path.basename(path)[len("metrics-"):-len(".json")])
+        alive = _pid_alive(pid)
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            continue   # removed or replaced meanwhile
+        for name, labels, value in entries:
+            if name in GAUGES and not alive:
+                continue
+            key = (name, tuple(tuple(label) for label in labels))
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def render(totals):
+    """ Renders the totals in the Prometheus text exposition format """
+    by_name = {}
+    for (name, labels), value in totals.items():
+        by_name.setdefault(name, {})[labels] = value
+
+    # cache hit ratios are derived from the lookup counters
+    lookups = {}
+    for labels, value in by_name.get("phantom_mask_cache_requests_total", {}).items():
+        labels = dict(labels)
+        hits, total = lookups.get(labels["cache"], (0, 0))
+        lookups[labels["cache"]] = (hits + (value if labels["result"] == "hit" else 0), total + value)
+    by_name["phantom_mask_cache_hit_ratio"] = {
+        _labels(cache=cache): hits / total for cache, (hits, total) in lookups.items() if total
+    }
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind != "histogram":
+            for labels, value in sorted(by_name.get(name, {}).items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            continue
+
+        buckets = by_name.get(f"{name}_bucket", {})
+        for labels, count in sorted(by_name.get(f"{name}_count", {}).items()):
+            cumulative = 0
+            for le in [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]:
+                cumulative += buckets.get(labels + (("le", le),), 0)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {by_name[f'{name}_sum'][labels]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """ GET /metrics: Prometheus scrape endpoint """
+    return HttpResponse(render(collect()), content_type="text/plain; version=0.0.4; charset=utf-8")
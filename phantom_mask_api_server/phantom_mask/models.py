@@ -59,3 +59,41 @@ class Transactions(models.Model):
     class Meta:
         managed = False
         db_table = 'transactions'
+
+
+class TransactionDailyTotals(models.Model):
+    day = models.DateField()
+    pharmacy_id = models.IntegerField()
+    transaction_amount = models.FloatField()
+    product_count = models.IntegerField()
+    mask_count = models.IntegerField()
+
+    class Meta:
+        managed = False
+        db_table = 'transaction_daily_totals'
+        unique_together = (('day', 'pharmacy_id'),)
+
+class TransactionRollupWatermark(models.Model):
+    last_transaction_id = models.IntegerField()
+
+    class Meta:
+        managed = False
+        db_table = 'transaction_rollup_watermark'
+
+class OutboxEvents(models.Model):
+    topic = models.TextField()
+    payload = models.TextField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'outbox_events'
+
+class OutboxOffsets(models.Model):
+    consumer = models.TextField(primary_key=True)
+    last_event_id = models.IntegerField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'outbox_offsets'
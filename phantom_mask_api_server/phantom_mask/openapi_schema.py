@@ -0,0 +1,117 @@
+import os
+import threading
+from django.conf import settings
+from rest_framework import permissions, views
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.response import Response
+
+""" OpenAPI (Swagger 2.0) document of the API, served at /swagger/
+
+The document only depends on the code, so it is rendered once at build time (python manage.py
+build_openapi_schema) into settings.OPENAPI_SCHEMA_DIR, and the view serves those files; drf_yasg
+is not imported by the workers. Without the files, the first request renders the document in the
+process (importing drf_yasg then) and the process keeps it.
+
+The document has no host or schemes: clients use those of the server that serves it.
+"""
+
+API_INFO = {
+    "title": "Phantom Mask API Documentation",
+    "default_version": "v1",
+    "description": "Phantom Mask is an API server designed to provide access to pharmacy-related information, providing several services that enable users to query pharmacy details.",
+}
+
+# format -> file of OPENAPI_SCHEMA_DIR (the formats of drf_yasg's spec renderers)
+SCHEMA_FILES = {
+    "yaml": "swagger.yaml",
+    "json": "swagger.json",
+    "openapi": "swagger.json",
+}
+
+_documents = None
+_documents_lock = threading.Lock()
+
+
+class SchemaDocuments(dict):
+    """ Rendered document by format """
+
+
+def render_schema_documents():
+    """ Generates the document with drf_yasg and renders it in every format of SCHEMA_FILES """
+    from drf_yasg import openapi
+    from drf_yasg.generators import OpenAPISchemaGenerator
+    from drf_yasg.renderers import OpenAPIRenderer, SwaggerJSONRenderer, SwaggerYAMLRenderer
+
+    schema = OpenAPISchemaGenerator(openapi.Info(**API_INFO), version=API_INFO["default_version"]).get_schema(
+        request=None, public=True
+    )
+    renderers = {renderer.format: renderer() for renderer in (SwaggerYAMLRenderer, SwaggerJSONRenderer, OpenAPIRenderer)}
+    return SchemaDocuments({format: renderers[format].render(schema) for format in SCHEMA_FILES})
+
+
+def write_schema_files(directory):
+    """ Writes the document in every format into directory; returns the paths written """
+    documents = render_schema_documents()
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for format, file_name in SCHEMA_FILES.items():
+        path = os.path.join(directory, file_name)
+        if path not in paths:
+            with open(path, "wb") as f:
+                f.write(documents[format])
+            paths.append(path)
+    return paths
+
+
+def get_schema_documents():
+    """ Returns the documents of OPENAPI_SCHEMA_DIR, or renders them when the files are missing """
+    global _documents
+    if _documents is None:
+        with _documents_lock:
+            if _documents is None:
+                try:
+                    documents = SchemaDocuments()
+                    for format, file_name in SCHEMA_FILES.items():
+                        with open(os.path.join(settings.OPENAPI_SCHEMA_DIR, file_name), "rb") as f:
+                            documents[format] = f.read()
+                except FileNotFoundError:
+                    documents = render_schema_documents()
+                _documents = documents
+    return _documents
+
+
+class _SchemaRenderer(BaseRenderer):
+    """ Renderer of one format of the documents (errors are rendered as JSON, as by drf_yasg) """
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, SchemaDocuments):
+            return data[self.format]
+        return JSONRenderer().render(data, accepted_media_type, renderer_context)
+
+
+class YAMLSchemaRenderer(_SchemaRenderer):
+    media_type = "application/yaml"
+    format = "yaml"
+
+
+class JSONSchemaRenderer(_SchemaRenderer):
+    media_type = "application/json"
+    format = "json"
+
+
+class OpenAPISchemaRenderer(_SchemaRenderer):
+    media_type = "application/openapi+json"
+    format = "openapi"
+
+
+class OpenAPISchemaView(views.APIView):
+    """ Serves the OpenAPI document; the format is negotiated as by drf_yasg (?format=, then Accept) """
+
+    # not part of the document itself
+    schema = None
+    permission_classes = (permissions.AllowAny,)
+    renderer_classes = (YAMLSchemaRenderer, JSONSchemaRenderer, OpenAPISchemaRenderer)
+
+    def get(self, request):
+        return Response(get_schema_documents())
@@ -0,0 +1,274 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.db.transaction import TransactionManagementError
+from django.db.models import Min
+from django.utils.timezone import now
+from .models import OutboxEvents, OutboxOffsets
+from .transaction_store import get_transaction_store
+
+""" Transactional outbox of the purchases and cancellations, and the consumers that tail it
+
+The purchase and cancel views write an event into outbox_events in their own database
+transaction (publish), so an event exists exactly when the change it describes was committed, and
+the request itself does nothing more. Derived data (exports, rollups, caches, indexes) is then
+updated by consumers, each running in batches in a separate process (python manage.py
+run_outbox_consumers --interval 1).
+
+A consumer reads the events after its offset (outbox_offsets) in id order, handles a batch and
+then moves its offset past it, in a short update of its own: a consumer that fails or is stopped in
+between gets the same events again (at-least-once delivery), so handlers have to be idempotent,
+e.g. by keeping the last event id they applied. Events are read outside of any long transaction,
+so consumers never hold the SQLite write lock while they work.
+
+Ids are given in insertion order, but on PostgreSQL a transaction can commit after one that got a
+higher id. read_events stops at a missing id until the event after it is OUTBOX_GAP_TIMEOUT seconds
+old: by then the missing id belongs to a transaction that was rolled back, not to one still
+committing. SQLite serializes writers, so its ids commit in order. Events consumed by every
+consumer are deleted by the prune_outbox maintenance job after OUTBOX_RETENTION seconds.
+"""
+
+TOPICS = ("purchase", "cancellation")
+# events read per batch of a consumer
+BATCH_SIZE = 500
+# events deleted per database transaction of prune_outbox
+PRUNE_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxEvent:
+    __slots__ = ("id", "topic", "payload", "created_at")
+
+    def __init__(self, id, topic, payload, created_at):
+        self.id = id
+        self.topic = topic
+        self.payload = payload
+        self.created_at = created_at
+
+
+def publish(topic, payload, using=None):
+    """ Writes an event into the outbox, in the database transaction of the change it describes
+
+    Args:
+        topic (str): One of TOPICS.
+        payload (dict): JSON serializable content of the event.
+        using (str | None): Database alias (defaults to the one of the model).
+    """
+    using = using or router.db_for_write(OutboxEvents)
+    if not transaction.get_connection(using).in_atomic_block:
+        raise TransactionManagementError("Outbox events are published in the transaction of their change.")
+    OutboxEvents.objects.using(using).create(topic=topic, payload=json.dumps(payload), created_at=now())
+
+
+def publish_transaction(topic, record, num_per_pack, transaction_id=None, using=None):
+    """ Publishes a purchase or cancellation of a transaction
+
+    Args:
+        topic (str): "purchase" or "cancellation".
+        record (Transactions): The transaction (deleted, for a cancellation).
+        num_per_pack (int): Masks per pack of its mask.
+        transaction_id (int | None): Its id, when it was deleted (delete() sets it to None).
+        using (str | None): Database alias.
+    """
+    publish(topic, {
+        "transaction_id": transaction_id or record.id,
+        "user_id": record.user_id,
+        "pharmacy_id": record.pharmacy_id,
+        "mask_id": record.mask_id,
+        "transaction_amount": record.transaction_amount,
+        "mask_count": num_per_pack,
+        "transaction_date": record.transaction_date.isoformat(),
+    }, using)
+
+
+def read_events(after_id=0, limit=BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """ The committed events after an id, in id order, up to the first id that may still be committing
+
+    Args:
+        after_id (int): Id of the last event already read (0 for the start of the outbox).
+        limit (int): Events read at most.
+        using (str): Database alias.
+
+    Returns:
+        list[OutboxEvent]: The events, without gaps except for ids older than OUTBOX_GAP_TIMEOUT.
+    """
+    rows = OutboxEvents.objects.using(using).filter(id__gt=after_id).order_by("id")[:limit]
+    settled = now() - timedelta(seconds=settings.OUTBOX_GAP_TIMEOUT)
+    events = []
+    # (the first event of the outbox has no gap before it: older events may have been pruned)
+    previous_id = after_id or None
+    for row in rows:
+        if previous_id is not None and row.id != previous_id + 1 and row.created_at > settled:
+            break
+        events.append(OutboxEvent(row.id, row.topic, json.loads(row.payload), row.created_at))
+        previous_id = row.id
+    return events
+
+
+class Consumer:
+    """ Handler of outbox events with its own offset; subclasses set name and implement handle """
+
+    name = None
+    # topics handled (the others are skipped), None for all of them
+    topics = None
+    batch_size = BATCH_SIZE
+
+    def enabled(self):
+        """ Whether the consumer runs (e.g. only when it is configured) """
+        return True
+
+    def handle(self, events):
+        """ Applies a batch of events; raising leaves the offset before them, so they come again
+
+        Args:
+            events (list[OutboxEvent]): Events of the topics of the consumer, in id order.
+        """
+        raise NotImplementedError
+
+
+class JsonLinesExport(Consumer):
+    """ Appends the events to OUTBOX_EXPORT_PATH, one JSON object per line """
+
+    name = "export"
+
+    def enabled(self):
+        return bool(settings.OUTBOX_EXPORT_PATH)
+
+    def handle(self, events):
+        with open(settings.OUTBOX_EXPORT_PATH, "a", encoding="utf-8") as file:
+            for event in events:
+                file.write(json.dumps({
+                    "id": event.id, "topic": event.topic,
+                    "created_at": event.created_at.isoformat(), **event.payload,
+                }) + "\n")
+            # on disk before the offset moves past them
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class TransactionStoreUpdate(Consumer):
+    """ Applies the purchases and cancellations to the transaction store (see transaction_store.py)
+
+    Appends skip the transactions already in the store and cancellations only clear a flag, so
+    events handled twice change nothing.
+    """
+
+    name = "transaction_store"
+
+    def enabled(self):
+        return get_transaction_store() is not None
+
+    def handle(self, events):
+        # a batch takes the lock of the store twice, and writes at most one new generation; applying
+        # its purchases before its cancellations ends the same as the event order, as a cancellation
+        # comes after its purchase and appends skip the transactions already in the store
+        purchases = [event.payload for event in events if event.topic == "purchase"]
+        store = get_transaction_store()
+        store.append_many([
+            (
+                payload["transaction_id"], int(datetime.fromisoformat(payload["transaction_date"]).timestamp()),
+                payload["user_id"], payload["pharmacy_id"], payload["mask_id"], payload["transaction_amount"],
+                payload["mask_count"],
+            )
+            for payload in purchases
+        ])
+        store.cancel_many([event.payload["transaction_id"] for event in events if event.topic == "cancellation"])
+
+
+# consumer name -> Consumer, run by run_outbox_consumers
+CONSUMERS = {}
+
+
+def register_consumer(consumer):
+    """ Adds a consumer to CONSUMERS (its name is its key in outbox_offsets) """
+    CONSUMERS[consumer.name] = consumer
+    return consumer
+
+
+register_consumer(JsonLinesExport())
+register_consumer(TransactionStoreUpdate())
+
+
+def consume(consumer, using=DEFAULT_DB_ALIAS):
+    """ Hands the next batch of events to a consumer and moves its offset past them
+
+    Args:
+        consumer (Consumer): The consumer.
+        using (str): Database alias.
+
+    Returns:
+        tuple[int, bool]: Events handled, and whether more events may be waiting.
+    """
+    offset, _ = OutboxOffsets.objects.using(using).get_or_create(
+        consumer=consumer.name, defaults={"last_event_id": 0, "updated_at": now()}
+    )
+    events = read_events(offset.last_event_id, consumer.batch_size, using)
+    if not events:
+        return 0, False
+    handled = [event for event in events if consumer.topics is None or event.topic in consumer.topics]
+    if handled:
+        consumer.handle(handled)
+
+    # only from the offset read above: a second process running the same consumer doesn't move it back
+    moved = OutboxOffsets.objects.using(using).filter(
+        consumer=consumer.name, last_event_id=offset.last_event_id
+    ).update(last_event_id=events[-1].id, updated_at=now())
+    if not moved:
+        logger.warning("Offset of outbox consumer %s was moved by another process", consumer.name)
+    return len(handled), len(events) == consumer.batch_size
+
+
+def run_consumers(names=None, budget=None, using=DEFAULT_DB_ALIAS):
+    """ Runs the enabled consumers until they have caught up (or until the end of the budget)
+
+    Args:
+        names (list[str] | None): Consumers to run (defaults to all of them).
+        budget (float | None): Seconds each consumer runs at most.
+        using (str): Database alias.
+
+    Returns:
+        list[tuple[str, int]]: Consumer and events it handled, for the consumers that got some.
+    """
+    runs = []
+    for name in names or CONSUMERS:
+        consumer = CONSUMERS[name]
+        if not consumer.enabled():
+            continue
+        deadline = time.monotonic() + budget if budget else None
+        handled, more = 0, True
+        while more and (deadline is None or time.monotonic() < deadline):
+            batch, more = consume(consumer, using)
+            handled += batch
+        if handled:
+            runs.append((name, handled))
+    return runs
+
+
+def prune_batch(batch_size=PRUNE_BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """ Deletes the oldest events older than OUTBOX_RETENTION that every consumer has read
+
+    Consumers that never ran don't hold events back.
+
+    Args:
+        batch_size (int): Events deleted at most.
+        using (str): Database alias.
+
+    Returns:
+        tuple[int, bool]: Events deleted, and whether some may be left to delete.
+    """
+    events = OutboxEvents.objects.using(using).filter(
+        created_at__lt=now() - timedelta(seconds=settings.OUTBOX_RETENTION)
+    )
+    consumed = OutboxOffsets.objects.using(using).aggregate(offset=Min("last_event_id"))["offset"]
+    if consumed is not None:
+        events = events.filter(id__lte=consumed)
+    with transaction.atomic(using=using):
+        ids = list(events.order_by("id").values_list("id", flat=True)[:batch_size])
+        if ids:
+            OutboxEvents.objects.using(using).filter(id__in=ids).delete()
+    return len(ids), len(ids) == batch_size
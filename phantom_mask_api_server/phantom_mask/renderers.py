@@ -0,0 +1,53 @@
+import re
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from .instrumentation import measure_render
+
+""" orjson-based JSON renderer
+
+ORJSONRenderer produces the same bytes as DRF's JSONRenderer with the default settings (compact
+separators, UTF-8 output, U+2028/U+2029 escaped), several times faster. Values orjson doesn't
+encode the same way (datetimes, decimals, lazy strings, ...) go through DRF's JSONEncoder.
+Floats in exponent notation are written differently (1e-07 vs 1e-7), so output that may contain
+one is rendered again by JSONRenderer. The one remaining difference: orjson writes NaN and
+infinity as null, where JSONRenderer raises ValueError.
+"""
+
+# orjson leaves the JavaScript line terminators as they are; JSONRenderer escapes them
+LINE_SEPARATOR = "\u2028".encode("utf-8")
+PARAGRAPH_SEPARATOR = "\u2029".encode("utf-8")
+# a digit followed by an exponent (false positives inside strings only cost the slow path)
+EXPONENT = re.compile(rb"\de[-\d]")
+
+
+class ORJSONRenderer(JSONRenderer):
+    """ JSONRenderer that encodes with orjson """
+
+    # datetimes are passed to the DRF encoder (ISO 8601 with milliseconds and a 'Z' suffix)
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # counted as render time by the performance middleware
+        with measure_render():
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type, renderer_context):
+        if data is None:
+            return b""
+
+        renderer_context = renderer_context or {}
+        # indented output (browsable API, ?indent=) and non-default settings keep the json module
+        if (self.get_indent(accepted_media_type, renderer_context) is not None
+                or self.ensure_ascii or not self.compact or self.encoder_class is not JSONEncoder):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except (orjson.JSONEncodeError, TypeError):
+            # integers beyond 64 bits, unsupported types, ...: let JSONRenderer handle (or reject) them
+            return super().render(data, accepted_media_type, renderer_context)
+        if EXPONENT.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        return ret.replace(LINE_SEPARATOR, b"\\u2028").replace(PARAGRAPH_SEPARATOR, b"\\u2029")
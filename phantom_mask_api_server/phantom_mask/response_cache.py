@@ -0,0 +1,100 @@
+import hashlib
+from urllib.parse import urlencode
+from django.core.cache import caches
+from django.db import router
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from . import metrics
+from .catalog_version import acurrent_catalog_version, current_catalog_version
+from .models import Pharmacies
+
+""" Response cache of the catalog endpoints, keyed by (view, normalized query parameters, catalog version)
+
+Entries never need invalidation: a catalog change bumps the version, so new requests use new keys
+and the old entries age out of the cache (LRU / TTL of the 'responses' cache in settings.CACHES).
+Every response carries a strong ETag, and a matching If-None-Match gets 304 Not Modified.
+"""
+
+RESPONSE_CACHE = "responses"
+
+
+def cache_key(view_name, request, version):
+    """ Builds the cache key of a request; parameter order and repeated keys don't matter """
+    params = sorted((key, value) for key in request.GET for value in request.GET.getlist(key))
+    # the rendered format depends on content negotiation
+    variant = f"{request.META.get('HTTP_ACCEPT', '')}\n{urlencode(params)}"
+    digest = hashlib.blake2b(variant.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{view_name}:{version}:{digest}"
+
+
+def make_etag(version, content):
+    """ Strong ETag of a response body at a catalog version """
+    return f'"{version}-{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    return bool(if_none_match) and (etag in parse_etags(if_none_match) or if_none_match.strip() == "*")
+
+
+class CatalogCacheMixin:
+    """ Serves GET requests of a catalog view from the response cache
+
+    Place it after ReplicaReadMixin, so the catalog version is read from the database that serves the view.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self._async_cached_dispatch(request, *args, **kwargs)
+
+        version = current_catalog_version(router.db_for_read(Pharmacies))
+        if version is None:
+            return super().dispatch(request, *args, **kwargs)
+        key = cache_key(type(self).__name__, request, version)
+        entry = caches[RESPONSE_CACHE].get(key)
+        metrics.record_cache_lookup(RESPONSE_CACHE, entry is not None)
+        if entry is None:
+            response = super().dispatch(request, *args, **kwargs)
+            entry = self._cache_entry(response, version)
+            if entry is None:
+                return response
+            caches[RESPONSE_CACHE].set(key, entry)
+        return self._cached_response(request, entry)
+
+    async def _async_cached_dispatch(self, request, *args, **kwargs):
+        version = await acurrent_catalog_version(router.db_for_read(Pharmacies))
+        if version is None:
+            return await super().dispatch(request, *args, **kwargs)
+        key = cache_key(type(self).__name__, request, version)
+        entry = await caches[RESPONSE_CACHE].aget(key)
+        metrics.record_cache_lookup(RESPONSE_CACHE, entry is not None)
+        if entry is None:
+            response = await super().dispatch(request, *args, **kwargs)
+            entry = self._cache_entry(response, version)
+            if entry is None:
+                return response
+            await caches[RESPONSE_CACHE].aset(key, entry)
+        return self._cached_response(request, entry)
+
+    @staticmethod
+    def _cache_entry(response, version):
+        """ Renders a response and returns its (etag, content type, body) entry, or None if it is not cacheable """
+        if response.status_code != 200:
+            return None
+        if hasattr(response, "render"):
+            response.render()
+        content = response.content
+        return make_etag(version, content), response["Content-Type"], content
+
+    @staticmethod
+    def _cached_response(request, entry):
+        etag, content_type, content = entry
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response["ETag"] = etag
+        response["Vary"] = "Accept"
+        return response
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer
+from .outbox import BATCH_SIZE, read_events
+
+""" Server-sent events stream of the sales of the day per pharmacy (/api/transactions/amounts/stream/)
+
+Each process keeps one SalesStream for all its viewers: a single task tails the outbox (see
+outbox.py) and folds the purchases and cancellations of the day into totals per pharmacy, and every
+SALES_STREAM_SNAPSHOT_INTERVAL seconds it aggregates the transactions of the day again, in one
+query. Each change is encoded once and queued to every viewer, so the number of viewers costs no
+queries. The stream sends:
+    event: snapshot   the totals of every pharmacy with sales on the day, when a viewer connects,
+                      periodically (to resync viewers that missed changes) and when the day changes
+    event: delta      what the last events added to the totals of each pharmacy they changed
+The id of each message is the id of the last outbox event it includes. A viewer that is too slow
+to keep up gets the next snapshot instead of the changes it didn't read.
+
+The day is the current day of TIME_ZONE, and the totals have the fields of the amounts endpoint.
+It needs the ASGI server (SERVER_MODE=asgi): a WSGI worker would hold a thread per viewer.
+"""
+
+# messages waiting per viewer before it is resynced with a snapshot
+QUEUE_SIZE = 100
+# seconds without messages after which a comment keeps the connection open through proxies
+KEEPALIVE_INTERVAL = 15
+
+logger = logging.getLogger(__name__)
+
+
+def pharmacy_totals(totals):
+    """ Totals per pharmacy ([amount, products, masks]) in the fields of the amounts endpoint """
+    return {
+        str(pharmacy_id): {
+            "total_transaction_amount": round(amount, 2),
+            "total_mask_product_count": product_count,
+            "total_mask_count": mask_count,
+        }
+        for pharmacy_id, (amount, product_count, mask_count) in totals.items()
+    }
+
+
+class SalesTotals:
+    """ Totals per pharmacy of the sales of a day, up to an outbox event """
+
+    def __init__(self, day, last_event_id, totals):
+        self.day = day
+        self.last_event_id = last_event_id
+        # pharmacy id -> [amount, products, masks]
+        self.totals = totals
+
+    def apply(self, events):
+        """ Adds the purchases of the day and takes out its cancellations
+
+        Args:
+            events (list[outbox.OutboxEvent]): The outbox events after last_event_id, in id order.
+
+        Returns:
+            dict: Pharmacy id -> [amount, products, masks] changes (empty when the day didn't change).
+        """
+        changes = {}
+        for event in events:
+            payload = event.payload
+            sign = {"purchase": 1, "cancellation": -1}.get(event.topic)
+            if sign and timezone.localdate(datetime.fromisoformat(payload["transaction_date"])) == self.day:
+                for totals in (self.totals, changes):
+                    pharmacy = totals.setdefault(payload["pharmacy_id"], [0.0, 0, 0])
+                    pharmacy[0] += sign * payload["transaction_amount"]
+                    pharmacy[1] += sign
+                    pharmacy[2] += sign * payload["mask_count"]
+            self.last_event_id = event.id
+        return changes
+
+    def message(self, kind, totals):
+        """ A server-sent event of totals per pharmacy, encoded """
+        data = json.dumps({"day": self.day.isoformat(), "pharmacies": pharmacy_totals(totals)}, separators=(",", ":"))
+        return f"event: {kind}\nid: {self.last_event_id}\ndata: {data}\n\n".encode()
+
+    def snapshot(self):
+        return self.message("snapshot", self.totals)
+
+
+def load_sales_totals(day=None, using=DEFAULT_DB_ALIAS):
+    """ Aggregates the transactions of a day per pharmacy, with the last outbox event they include
+
+    Args:
+        day (datetime.date | None): The day (defaults to the current one).
+        using (str): Database alias.
+
+    Returns:
+        SalesTotals: The totals.
+    """
+    day = day or timezone.localdate()
+    connection = connections[using]
+    start, end = (
+        connection.ops.adapt_datetimefield_value(timezone.make_aware(datetime.combine(d, datetime.min.time())))
+        for d in (day, day + timedelta(days=1))
+    )
+    # one statement, so both parts are read from the same snapshot of the database
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT NULL, NULL, NULL, NULL, MAX(id) FROM outbox_events
+            UNION ALL
+            SELECT t.pharmacy_id, SUM(t.transaction_amount), COUNT(*), SUM(m.num_per_pack), NULL
+            FROM transactions t JOIN masks m ON m.id = t.mask_id
+            WHERE t.transaction_date >= %s AND t.transaction_date < %s
+            GROUP BY t.pharmacy_id
+        """, [start, end])
+        rows = cursor.fetchall()
+    last_event_id = next((row[4] for row in rows if row[0] is None), None) or 0
+    totals = {
+        pharmacy_id: [float(amount), int(product_count), int(mask_count)]
+        for pharmacy_id, amount, product_count, mask_count, _ in rows if pharmacy_id is not None
+    }
+    return SalesTotals(day, last_event_id, totals)
+
+
+class SalesStream:
+    """ The totals of the day of one database, followed by one task and shared by all viewers """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.viewers = set()
+        self.sales = None
+        self.task = None
+
+    def subscribe(self):
+        """ Adds a viewer; returns its queue of messages, which starts with a snapshot """
+        queue = asyncio.Queue(QUEUE_SIZE)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        # (before the first totals are loaded, run() sends the first snapshot)
+        if self.sales is not None:
+            queue.put_nowait(self.sales.snapshot())
+        self.viewers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        """ Removes a viewer; the last one stops the task """
+        self.viewers.discard(queue)
+        if not self.viewers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+            self.sales = None
+
+    def broadcast(self, message):
+        for queue in self.viewers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # it missed changes: a snapshot replaces them
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.sales.snapshot())
+
+    def load(self):
+        return load_sales_totals(using=self.using)
+
+    def poll(self):
+        return read_events(self.sales.last_event_id, using=self.using)
+
+    async def run(self):
+        """ Follows the outbox and resyncs the viewers with a snapshot now and then """
+        snapshot_at = 0
+        while True:
+            try:
+                if time.monotonic() >= snapshot_at or timezone.localdate() != self.sales.day:
+                    self.sales = await sync_to_async(self.load)()
+                    snapshot_at = time.monotonic() + settings.SALES_STREAM_SNAPSHOT_INTERVAL
+                    self.broadcast(self.sales.snapshot())
+                else:
+                    events = await sync_to_async(self.poll)()
+                    changes = self.sales.apply(events)
+                    if changes:
+                        self.broadcast(self.sales.message("delta", changes))
+                    # a full batch: more events are waiting
+                    if len(events) == BATCH_SIZE:
+                        continue
+            except Exception:
+                logger.exception("Sales stream failed, retrying")
+                await sync_to_async(close_old_connections)()
+            await asyncio.sleep(settings.SALES_STREAM_POLL_INTERVAL)
+
+
+# database alias -> SalesStream of the process
+_streams = {}
+
+
+def stream_response(using=DEFAULT_DB_ALIAS):
+    """ Response that streams the totals of the day per pharmacy to one viewer (ASGI only) """
+    stream = _streams.setdefault(using, SalesStream(using))
+
+    async def messages():
+        queue = stream.subscribe()
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            # also when the client went away: Django cancels the response
+            stream.unsubscribe(queue)
+
+    return StreamingHttpResponse(messages(), content_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # nginx would buffer the stream otherwise
+        "X-Accel-Buffering": "no",
+    })
+
+
+class EventStreamRenderer(BaseRenderer):
+    """ Lets clients ask for text/event-stream (the stream itself is not rendered) """
+
+    media_type = "text/event-stream"
+    format = "event-stream"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
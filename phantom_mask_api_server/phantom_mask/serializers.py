@@ -20,7 +20,7 @@ class PharmacyMasksSerializer(serializers.ModelSerializer):
     model = serializers.CharField(source='mask.model', read_only=True)
     color = serializers.CharField(source='mask.color', read_only=True)
     num_per_pack = serializers.IntegerField(source='mask.num_per_pack', read_only=True)
-    pharmacy_name = serializers.CharField(source='pharmacies.name', read_only=True)
+    pharmacy_name = serializers.CharField(source='pharmacy.name', read_only=True)
     mask_name = serializers.CharField(source='mask.name', read_only=True)
 
     class Meta:
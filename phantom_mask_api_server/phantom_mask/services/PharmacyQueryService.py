@@ -1,13 +1,44 @@
 from datetime import datetime
 from rest_framework.exceptions import ValidationError
-from django.db.models import Q, F
+from django.db.models import Count, Q, F
 from ..models import Pharmacies
+import operator
+
+# comparison operators of the mask count condition (e.g. 'gt5')
+MASK_COUNT_CONDITIONS = {"gt": operator.gt, "lt": operator.lt, "gte": operator.ge, "lte": operator.le}
+
+# price ranges of one multi-range mask count comparison (each one is a COUNT in the SQL query)
+MAX_PRICE_RANGES = 20
 
 class PharmacyQueryService:
     """
     This class is responsible for querying pharmacy data.
     """
 
+    def parse_day_and_time(day, time):
+        """ Validates the day and time parameters.
+
+        Args:
+            day: The day of the week (e.g., 'mon', 'tue', etc.).
+            time: The time in HH:MM format (24-hour format).
+
+        Returns:
+            The lowercase day and the time as a datetime.time.
+        """
+        # validate day
+        valid_days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+        day = day.lower()
+        if day not in valid_days:
+            raise ValidationError({"error": "Invalid day provided. Please use a valid day of the week."})
+        
+        # validate time
+        try:
+            time = datetime.strptime(time, "%H:%M").time()
+        except ValueError:
+            raise ValidationError({"error": "Invalid time format. Please use HH:MM (24-hour format)."})
+
+        return day, time
+
     def filter_by_day_and_time(queryset, day, time):
         """ Filters the queryset based on the provided day and time.
         Args:
@@ -19,17 +50,7 @@ class PharmacyQueryService:
             A filtered queryset based on the provided day and time.
         """
         if day and time:
-            # validate day
-            valid_days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
-            day = day.lower()
-            if day not in valid_days:
-                raise ValidationError({"error": "Invalid day provided. Please use a valid day of the week."})
-            
-            # validate time
-            try:
-                time = datetime.strptime(time, "%H:%M").time()
-            except ValueError:
-                raise ValidationError({"error": "Invalid time format. Please use HH:MM (24-hour format)."})
+            day, time = PharmacyQueryService.parse_day_and_time(day, time)
             # set query columns
             open_field = f"{day}_open"
             close_field = f"{day}_close"
@@ -45,27 +66,80 @@ class PharmacyQueryService:
 
             return queryset.filter(standard_case | cross_day_case)
         
-    def filter_by_price_range(queryset, min_price, max_price):
-        """ Filters the queryset based on the provided price range.
+    def count_masks_in_price_range(queryset, min_price, max_price):
+        """ Annotates the number of masks of each pharmacy within the provided price range.
 
         Args:
-            queryset: The queryset to filter.
+            queryset: The queryset of pharmacies to annotate.
             min_price: The minimum price.
             max_price: The maximum price.
 
         Returns:
-            A filtered queryset based on the provided price range.
+            The queryset annotated with mask_count (0 for pharmacies without a mask in the range).
         """
-        if min_price < 0 or max_price < 0:
-            raise ValidationError({"error": "Price values must be non-negative."})
-        
-        queryset = Pharmacies.objects.filter( # filter by price range
+        PharmacyQueryService.validate_price_range(min_price, max_price)
+
+        # a filtered count over the LEFT JOIN keeps the pharmacies without a matching mask
+        return queryset.annotate(mask_count=Count("pharmacy_masks", filter=Q(
             pharmacy_masks__price__gte=min_price,
-            pharmacy_masks__price__lte=max_price
-        )
+            pharmacy_masks__price__lte=max_price,
+        )))
 
-        return queryset
+    def count_masks_in_price_ranges(queryset, price_ranges):
+        """ Annotates the number of masks of each pharmacy within each of the provided price ranges.
+
+        Args:
+            queryset: The queryset of pharmacies to annotate.
+            price_ranges: The (min_price, max_price) ranges, see parse_price_ranges.
+
+        Returns:
+            The queryset annotated with mask_count_0, mask_count_1, ... (one per range), all in one query.
+        """
+        return queryset.annotate(**{
+            f"mask_count_{i}": Count("pharmacy_masks", filter=Q(
+                pharmacy_masks__price__gte=min_price,
+                pharmacy_masks__price__lte=max_price,
+            ))
+            for i, (min_price, max_price) in enumerate(price_ranges)
+        })
+
+    def parse_price_ranges(price_ranges):
+        """ Parses the price ranges of the multi-range mask count comparison.
+
+        Args:
+            price_ranges: Comma-separated 'min-max' ranges (e.g. '0-10,10-20,20-'); a missing
+                minimum is 0 and a missing maximum is unbounded, both ends are inclusive.
+
+        Returns:
+            A list of (min_price, max_price) tuples.
+        """
+        ranges = []
+        for price_range in price_ranges.split(","):
+            min_price, separator, max_price = price_range.strip().partition("-")
+            try:
+                if not separator:
+                    raise ValueError
+                min_price = float(min_price) if min_price else 0.0
+                max_price = float(max_price) if max_price else float("inf")
+            except ValueError:
+                raise ValidationError({"error": "Invalid price range. Use comma-separated 'min-max' ranges (e.g. '0-10,10-20')."})
+            PharmacyQueryService.validate_price_range(min_price, max_price)
+            ranges.append((min_price, max_price))
+
+        if len(ranges) > MAX_PRICE_RANGES:
+            raise ValidationError({"error": f"At most {MAX_PRICE_RANGES} price ranges can be compared at once."})
+        return ranges
     
+    def validate_price_range(min_price, max_price):
+        """ Validates the price range of the mask count comparison.
+
+        Args:
+            min_price: The minimum price.
+            max_price: The maximum price.
+        """
+        if min_price < 0 or max_price < 0:
+            raise ValidationError({"error": "Price values must be non-negative."})
+
     def filter_by_mask_count(queryset, comp, x):
         """ Filters the queryset based on the provided mask count condition.
         
@@ -76,13 +150,24 @@ class PharmacyQueryService:
 
         """
 
-        if comp in ["gt", "lt", "gte", "lte"]:
-            filter_arg = f"mask_count__{comp}"
-            queryset = queryset.filter(**{filter_arg: x})
-        else:
-            raise ValidationError({"error": "Invalid condition. Use 'gt', 'lt', 'gte' or 'lte' followed by a number."})
+        PharmacyQueryService.validate_mask_count_condition(comp)
+        filter_arg = f"mask_count__{comp}"
+        queryset = queryset.filter(**{filter_arg: x})
         
         return queryset
+
+    def validate_mask_count_condition(comp):
+        """ Validates the comparison operator of the mask count condition.
+
+        Args:
+            comp: The comparison operator ('gt', 'lt', 'gte', 'lte').
+
+        Returns:
+            The comparison as a function of (mask count, x).
+        """
+        if comp not in MASK_COUNT_CONDITIONS:
+            raise ValidationError({"error": "Invalid condition. Use 'gt', 'lt', 'gte' or 'lte' followed by a number."})
+        return MASK_COUNT_CONDITIONS[comp]
     
     def get_pharmacy_masks(queryset, pharmacy_name, sort_by):
         """
@@ -102,13 +187,28 @@ class PharmacyQueryService:
         else:
             raise ValidationError({"error": "Pharmacy not found."})
         
-        if sort_by:
-            if sort_by == "name":
-                queryset = queryset.order_by("mask__name")
-            elif sort_by == "price":
-                queryset = queryset.order_by("price")
-            else:
-                raise ValidationError({"error": "Invalid sort_by parameter. Use 'name' or 'price'."})
+        # ties (and the unsorted list) are ordered by mask id, as in the catalog snapshot
+        if PharmacyQueryService.validate_sort_by(sort_by) == "name":
+            queryset = queryset.order_by("mask__name")
+        elif sort_by == "price":
+            queryset = queryset.order_by("price", "mask_id")
+        else:
+            queryset = queryset.order_by("mask_id")
             
         return queryset
+
+    def validate_sort_by(sort_by):
+        """ Validates the sort_by parameter of the pharmacy masks list.
+
+        Args:
+            sort_by: 'name', 'price', or empty for no sorting.
+
+        Returns:
+            'name', 'price' or None.
+        """
+        if not sort_by:
+            return None
+        if sort_by not in ("name", "price"):
+            raise ValidationError({"error": "Invalid sort_by parameter. Use 'name' or 'price'."})
+        return sort_by
         
\ No newline at end of file
@@ -1,7 +1,11 @@
-from datetime import datetime
+from datetime import datetime, time, timedelta
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 from ..models import Users
 
+# user ids looked up with an IN list at most (SQLite limits the parameters of a query); all names are read beyond
+MAX_USER_IDS_IN_LIST = 500
+
 class UserQueryService:
     """
     Service for querying user information.
@@ -20,6 +24,27 @@ class UserQueryService:
             A filtered queryset based on the provided date range.
         """
 
+        start_date, end_date = UserQueryService.parse_date_range(start_date, end_date)
+        
+        # filter the queryset based on the date range
+        queryset = Users.objects.filter(
+            transactions__transaction_date__date__gte=start_date,
+            transactions__transaction_date__date__lte=end_date
+        )
+
+        return queryset
+    
+    def parse_date_range(start_date, end_date):
+        """
+        Validates the date range of the active users.
+
+        Args:
+            start_date: The start date in YYYY-MM-DD format.
+            end_date: The end date in YYYY-MM-DD format.
+
+        Returns:
+            The start and end dates as datetime.date.
+        """
         # validate date format and range
         if start_date and end_date:
             try:
@@ -33,15 +58,43 @@ class UserQueryService:
         
         else:
             raise ValidationError({"error": "Please provide both start and end dates."})
-        
-        # filter the queryset based on the date range
-        queryset = Users.objects.filter(
-            transactions__transaction_date__date__gte=start_date,
-            transactions__transaction_date__date__lte=end_date
-        )
 
+        return start_date, end_date
+
+    def day_bounds(start_date, end_date):
+        """
+        Converts a range of days to timestamps of the transaction store.
+
+        Args:
+            start_date: The first day (datetime.date), or None.
+            end_date: The last day (datetime.date), or None.
+
+        Returns:
+            The first second of start_date and the first second after end_date (epoch seconds in
+            the current time zone, like the __date lookups), None where a date is None.
+        """
+        def first_second(day):
+            return int(timezone.make_aware(datetime.combine(day, time.min)).timestamp())
+
+        start = first_second(start_date) if start_date else None
+        end = first_second(end_date + timedelta(days=1)) if end_date else None
+        return start, end
+
+    def get_user_names(user_ids):
+        """
+        Retrieves the names of users in one query.
+
+        Args:
+            user_ids: The ids of the users.
+
+        Returns:
+            A queryset of (id, name) tuples, including all users when there are many ids.
+        """
+        queryset = Users.objects.values_list("id", "name")
+        if len(user_ids) <= MAX_USER_IDS_IN_LIST:
+            queryset = queryset.filter(id__in=user_ids)
         return queryset
-    
+
     def limit(queryset, limit):
         """
         Limits the queryset to the specified number of results.
@@ -53,7 +106,16 @@ class UserQueryService:
         Returns:
             A limited queryset based on the provided limit.
         """
-        if limit <= 0:
-            raise ValidationError({"error": "Limit must be a positive integer."})
+        UserQueryService.validate_limit(limit)
         
-        return queryset[:limit]
\ No newline at end of file
+        return queryset[:limit]
+
+    def validate_limit(limit):
+        """
+        Validates the number of users to return.
+
+        Args:
+            limit: The maximum number of results to return.
+        """
+        if limit <= 0:
+            raise ValidationError({"error": "Limit must be a positive integer."})
\ No newline at end of file
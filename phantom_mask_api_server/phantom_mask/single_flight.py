@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from . import metrics
+from .db_routers import PRIMARY_PIN_COOKIE
+from .response_cache import cache_key
+
+""" Single-flight of identical concurrent requests (analytics and search endpoints)
+
+The first GET request of a key (view, normalized query parameters, Accept, database served from)
+computes the response; identical requests that arrive while it runs wait for it and get a copy of
+the same rendered response, so a burst of refreshes costs one computation. Nothing is kept once the
+computation has finished: this is not a cache, and later requests compute again.
+
+With SINGLE_FLIGHT_CACHE set, the processes also coordinate through that cache (it must be shared
+by the workers): the computing process holds a lock entry (cache.add) and publishes the rendered
+response under a key of its own, which the other processes poll. The lock expires after
+SINGLE_FLIGHT_TIMEOUT seconds, and a request that waited that long computes its own response.
+cache.add is atomic with memcached, Redis and the database cache; with the file cache two
+processes may occasionally both compute, which only costs the duplicate work.
+"""
+
+# seconds between two polls of the cache by a process that waits for another one
+POLL_INTERVAL = 0.02
+
+# key -> Future of the (status, headers, content) entry being computed in this process
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _join_flight(key):
+    """ Returns (future, True) when the caller computes the key, (future, False) when it waits for it """
+    with _flights_lock:
+        future = _flights.get(key)
+        if future is not None:
+            return future, False
+        future = _flights[key] = Future()
+        # a running future can't be cancelled, so a waiter that disconnects doesn't cancel the others
+        future.set_running_or_notify_cancel()
+        return future, True
+
+
+def _leave_flight(key):
+    with _flights_lock:
+        _flights.pop(key, None)
+
+
+class SingleFlightMixin:
+    """ Shares the response of an async view between identical concurrent GET requests
+
+    Place it after CatalogCacheMixin, so cache misses are coalesced too.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not settings.SINGLE_FLIGHT or not self.view_is_async or request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+        return self._single_flight_dispatch(request, *args, **kwargs)
+
+    async def _single_flight_dispatch(self, request, *args, **kwargs):
+        # pinned clients are served from the primary, the others from the replica
+        source = "primary" if request.COOKIES.get(PRIMARY_PIN_COOKIE) else "replica"
+        key = f"single-flight:{cache_key(type(self).__name__, request, source)}"
+        route = type(self).__name__
+        future, leader = _join_flight(key)
+
+        if not leader:
+            metrics.record_single_flight(route, shared=True)
+            try:
+                return self._shared_response(await asyncio.wrap_future(future))
+            except _FlightFailed:
+                # the computation failed without a response: this request tries on its own
+                return await super().dispatch(request, *args, **kwargs)
+
+        metrics.record_single_flight(route, shared=False)
+        response = None
+        try:
+            if settings.SINGLE_FLIGHT_CACHE:
+                response, entry = await self._cross_process_dispatch(key, request, *args, **kwargs)
+            else:
+                response = await super().dispatch(request, *args, **kwargs)
+                entry = self._flight_entry(response)
+            future.set_result(entry)
+        finally:
+            _leave_flight(key)
+            if not future.done():
+                future.set_exception(_FlightFailed())
+        return response if response is not None else self._shared_response(entry)
+
+    async def _cross_process_dispatch(self, key, request, *args, **kwargs):
+        """ Returns (response or None, entry), computed here or by another process """
+        cache = caches[settings.SINGLE_FLIGHT_CACHE]
+        lock_key = f"{key}:lock"
+        deadline = time.monotonic() + settings.SINGLE_FLIGHT_TIMEOUT
+        while True:
+            token = uuid.uuid4().hex
+            if await cache.aadd(lock_key, token, timeout=settings.SINGLE_FLIGHT_TIMEOUT):
+                try:
+                    response = await super().dispatch(request, *args, **kwargs)
+                    entry = self._flight_entry(response)
+                    # published before the lock is released, so a waiter that sees the lock gone finds it
+                    await cache.aset(f"{key}:{token}", entry, timeout=settings.SINGLE_FLIGHT_TIMEOUT)
+                finally:
+                    await cache.adelete(lock_key)
+                return response, entry
+
+            holder = await cache.aget(lock_key)
+            while holder is not None:
+                if time.monotonic() >= deadline:
+                    # the other process is stuck or gone: compute without waiting any longer
+                    response = await super().dispatch(request, *args, **kwargs)
+                    return response, self._flight_entry(response)
+                await asyncio.sleep(POLL_INTERVAL)
+                entry = await cache.aget(f"{key}:{holder}")
+                if entry is not None:
+                    return None, entry
+                current = await cache.aget(lock_key)
+                if current != holder:
+                    entry = await cache.aget(f"{key}:{holder}")
+                    if entry is not None:
+                        return None, entry
+                    holder = current
+            # the lock was released without a response (the other request failed): take it
+
+    @staticmethod
+    def _flight_entry(response):
+        """ Renders a response and returns its (status, headers, content) entry """
+        if hasattr(response, "render"):
+            response.render()
+        return response.status_code, list(response.items()), response.content
+
+    @staticmethod
+    def _shared_response(entry):
+        status, headers, content = entry
+        response = HttpResponse(content, status=status)
+        for header, value in headers:
+            response[header] = value
+        return response
+
+
+class _FlightFailed(Exception):
+    """ The request that computed a key raised instead of returning a response """
@@ -0,0 +1,151 @@
+from datetime import datetime, time, timedelta
+from django.db import connections, router, transaction
+from django.db.models import Exists, F
+from django.utils import timezone
+from .models import TransactionDailyTotals, TransactionRollupWatermark, Transactions
+
+""" Daily totals per pharmacy of the transactions, compacted in the background
+
+The compact_transactions maintenance job (see maintenance.py) folds the transactions of closed days
+into one row per day and pharmacy (transaction_daily_totals), in id order, and records the last
+folded id in transaction_rollup_watermark. The transactions themselves are kept: the other
+endpoints read them one by one. The amounts endpoint, when it has no transaction store (the
+default with PostgreSQL), adds the transactions after the watermark to the daily totals in one
+statement, so it reads both from the same snapshot.
+
+Folding stops at the first transaction of the current day: purchases of today are still being
+committed, and on PostgreSQL a purchase can commit after one with a higher id. Cancellations of
+folded transactions are subtracted from their day in the transaction of the cancellation. The ETL
+reloads the transactions as a whole, so it empties the totals (db_backend.reset_transaction_rollup)
+and they are compacted again from the start.
+"""
+
+# transactions folded per database transaction of the compaction
+BATCH_SIZE = 250
+
+
+def compact_batch(batch_size=BATCH_SIZE, using=None):
+    """ Folds the next transactions of closed days into the daily totals, in one database transaction
+
+    Args:
+        batch_size (int): Transactions read at most.
+        using (str | None): Database alias (defaults to the one of the model).
+
+    Returns:
+        tuple[int, bool]: Transactions folded, and whether transactions of closed days are left.
+    """
+    using = using or router.db_for_write(TransactionDailyTotals)
+    cutoff = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+    with transaction.atomic(using=using):
+        watermark = TransactionRollupWatermark.objects.using(using).select_for_update().get(id=1)
+        # locked, so a cancellation of one of them waits for the totals it has to subtract from
+        rows = list(
+            Transactions.objects.using(using).select_for_update(of=("self",))
+            .filter(id__gt=watermark.last_transaction_id).order_by("id")
+            .values_list("id", "transaction_date", "pharmacy_id", "transaction_amount", "mask__num_per_pack")[:batch_size]
+        )
+
+        totals = {}
+        folded = 0
+        last_id = watermark.last_transaction_id
+        for transaction_id, transaction_date, pharmacy_id, amount, num_per_pack in rows:
+            if transaction_date >= cutoff:
+                break
+            day_totals = totals.setdefault((timezone.localtime(transaction_date).date(), pharmacy_id), [0.0, 0, 0])
+            day_totals[0] += amount
+            day_totals[1] += 1
+            day_totals[2] += num_per_pack
+            folded += 1
+            last_id = transaction_id
+        if not folded:
+            return 0, False
+
+        # added to the totals of the day when it has some (ON CONFLICT works the same on both databases)
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            cursor.executemany("""
+                INSERT INTO transaction_daily_totals (day, pharmacy_id, transaction_amount, product_count, mask_count)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (day, pharmacy_id) DO UPDATE SET
+                    transaction_amount = transaction_daily_totals.transaction_amount + excluded.transaction_amount,
+                    product_count = transaction_daily_totals.product_count + excluded.product_count,
+                    mask_count = transaction_daily_totals.mask_count + excluded.mask_count
+            """, [
+                (connection.ops.adapt_datefield_value(day), pharmacy_id, amount, product_count, mask_count)
+                for (day, pharmacy_id), (amount, product_count, mask_count) in totals.items()
+            ])
+        watermark.last_transaction_id = last_id
+        watermark.save(update_fields=["last_transaction_id"])
+    return folded, folded == len(rows) and len(rows) == batch_size
+
+
+def subtract_cancellation(record, transaction_id, num_per_pack, using=None):
+    """ Takes a deleted transaction out of its daily totals, if it was folded into them
+
+    Call it in the database transaction of the deletion, after it: on PostgreSQL, the deletion
+    waits for a compaction that is folding the transaction, and this then sees its watermark.
+
+    Args:
+        record (Transactions): The deleted transaction.
+        transaction_id (int): Its id (delete() sets the id of the instance to None).
+        num_per_pack (int): Masks per pack of its mask.
+        using (str | None): Database alias (defaults to the one of the model).
+    """
+    using = using or router.db_for_write(TransactionDailyTotals)
+    folded = TransactionRollupWatermark.objects.using(using).filter(id=1, last_transaction_id__gte=transaction_id)
+    TransactionDailyTotals.objects.using(using).filter(
+        Exists(folded), day=timezone.localtime(record.transaction_date).date(), pharmacy_id=record.pharmacy_id
+    ).update(
+        transaction_amount=F("transaction_amount") - record.transaction_amount,
+        product_count=F("product_count") - 1,
+        mask_count=F("mask_count") - num_per_pack,
+    )
+
+
+def transaction_totals(start_date=None, end_date=None, using=None):
+    """ Total amount, number of transactions and number of masks of a range of days
+
+    Args:
+        start_date (datetime.date | None): The first day.
+        end_date (datetime.date | None): The last day.
+        using (str | None): Database alias (defaults to the one the router reads the model from).
+
+    Returns:
+        tuple[float | None, int, int | None]: The totals, None (amount and masks) without transactions.
+    """
+    using = using or router.db_for_read(TransactionDailyTotals)
+    connection = connections[using]
+    day_conditions, transaction_conditions, day_params, transaction_params = [], [], [], []
+    if start_date:
+        day_conditions.append("day >= %s")
+        day_params.append(connection.ops.adapt_datefield_value(start_date))
+        transaction_conditions.append("t.transaction_date >= %s")
+        transaction_params.append(connection.ops.adapt_datetimefield_value(
+            timezone.make_aware(datetime.combine(start_date, time.min))
+        ))
+    if end_date:
+        day_conditions.append("day <= %s")
+        day_params.append(connection.ops.adapt_datefield_value(end_date))
+        transaction_conditions.append("t.transaction_date < %s")
+        transaction_params.append(connection.ops.adapt_datetimefield_value(
+            timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+        ))
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT SUM(amount), SUM(product_count), SUM(mask_count) FROM (
+                SELECT transaction_amount AS amount, product_count, mask_count
+                FROM transaction_daily_totals
+                WHERE {" AND ".join(day_conditions) or "1 = 1"}
+                UNION ALL
+                SELECT t.transaction_amount, 1, m.num_per_pack
+                FROM transactions t JOIN masks m ON m.id = t.mask_id
+                WHERE t.id > (SELECT last_transaction_id FROM transaction_rollup_watermark WHERE id = 1)
+                    {"".join(" AND " + condition for condition in transaction_conditions)}
+            ) totals
+        """, day_params + transaction_params)
+        amount, product_count, mask_count = cursor.fetchone()
+    # cancellations leave days with no transactions behind; PostgreSQL sums integers as numeric
+    if not product_count:
+        return None, 0, None
+    return float(amount), int(product_count), int(mask_count)
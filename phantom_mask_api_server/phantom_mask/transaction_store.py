@@ -0,0 +1,420 @@
+import os
+import shutil
+import threading
+from datetime import timezone
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:     # Windows: appends are only serialized within the process
+    fcntl = None
+
+""" Columnar, memory-mapped store of the transactions, for the analytics endpoints
+
+Each column is a .npy file of a fixed capacity, mapped read-only by every worker process, so the
+workers share one copy of the data through the page cache and a query is a few vectorized passes
+over the columns instead of a GROUP BY in the database. The store is append-only: purchases append
+a row and cancellations clear its live flag, both applied from the outbox by the transaction_store
+consumer (see outbox.py), so the store follows the database within the interval of the consumers.
+
+Layout of the store folder:
+    generation.npy   number of the current generation (int64, updated in place)
+    <generation>/    one .npy file per column (see COLUMNS) and rows.npy, the number of rows in use
+
+A generation is never resized: when it is full, or when the ETL rebuilds the store from the
+database, a new generation is written and generation.npy is switched to it. Readers check
+generation.npy and rows.npy on every query, which are plain memory reads of the mapped files.
+Writers (processes of the API and the ETL) take a lock on the folder. The rows are kept in id order,
+so a transaction is found with a binary search.
+
+A rebuild reads the transactions table without the lock. Meanwhile the writers also record their
+appends and cancellations in journal.txt, which the rebuild replays on the new generation before
+switching to it.
+
+Appends and cancellations are written to the shared mappings without msync: other processes see
+them at once and the kernel writes them back later, so only a crash of the machine can lose the
+latest ones. The store is a copy of the transactions table; rebuild it after such a crash (python
+manage.py rebuild_transaction_store, or any run of the users ETL).
+"""
+
+# column -> dtype of the .npy file
+COLUMNS = {
+    "id": np.int64,
+    "timestamp": np.int64,      # transaction date, seconds since the epoch (UTC)
+    "user_id": np.int64,
+    "pharmacy_id": np.int64,
+    "mask_id": np.int64,
+    "amount": np.float64,
+    "mask_count": np.int32,     # num_per_pack of the mask
+    "live": np.bool_,           # False once the transaction was cancelled
+}
+
+# rows of a new generation at least; a full generation is copied into one twice as large
+MIN_CAPACITY = 1024
+
+# rows of the transactions table with the num_per_pack of their mask, in COLUMNS order (without live)
+SOURCE_QUERY = """
+    SELECT t.id, t.transaction_date, t.user_id, t.pharmacy_id, t.mask_id, t.transaction_amount, m.num_per_pack
+    FROM transactions t JOIN masks m ON m.id = t.mask_id
+    ORDER BY t.id
+"""
+
+
+def epoch_seconds(dates):
+    """ Seconds since the epoch of transaction dates as read from the database
+
+    Args:
+        dates (list): datetime objects (naive ones are UTC) or SQLite text ('YYYY-MM-DD HH:MM:SS[.ffffff]').
+
+    Returns:
+        numpy.ndarray: int64 seconds, rounded down.
+    """
+    dates = [
+        date.astimezone(timezone.utc).replace(tzinfo=None) if getattr(date, "tzinfo", None) else date
+        for date in dates
+    ]
+    return np.array(dates, dtype="datetime64[us]").astype(np.int64) // 1_000_000
+
+
+class TransactionStore:
+    """ Store in a folder; one instance per process and folder (see get_transaction_store) """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._generation_map = None
+        # (generation, columns, row count) of the mapped generation, replaced as a whole
+        self._mapped = (None, None, None)
+        # the same for writing, only used with the lock held
+        self._writable = (None, None, None)
+        self._thread_lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.directory, "generation.npy"))
+
+    def columns_mapped(self):
+        return self._generation_map is not None
+
+    # reading
+
+    def columns(self):
+        """ Returns the columns (read-only arrays, without the unused capacity) of the current generation """
+        if self._generation_map is None:
+            self._generation_map = np.load(os.path.join(self.directory, "generation.npy"), mmap_mode="r")
+        while True:
+            generation = int(self._generation_map[0])
+            if generation != self._mapped[0]:
+                try:
+                    self._map_generation(generation)
+                except FileNotFoundError:
+                    continue    # replaced by a newer generation meanwhile
+            _, columns, rows = self._mapped
+            # rows are counted after they were written, so the first `rows` rows are complete
+            rows = int(rows[0])
+            return {name: column[:rows] for name, column in columns.items()}
+
+    def _map_generation(self, generation):
+        path = os.path.join(self.directory, str(generation))
+        columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+        self._mapped = (generation, columns, np.load(os.path.join(path, "rows.npy"), mmap_mode="r"))
+
+    @staticmethod
+    def _select(columns, start, end):
+        """ Mask of the live transactions with start <= timestamp < end (None is unbounded) """
+        selected = columns["live"]
+        if start is not None:
+            selected = selected & (columns["timestamp"] >= start)
+        if end is not None:
+            selected = selected & (columns["timestamp"] < end)
+        return selected
+
+    def totals(self, start=None, end=None):
+        """ Totals of the transactions in [start, end)
+
+        Args:
+            start (int | None): First second of the range (epoch seconds), or None.
+            end (int | None): First second after the range, or None.
+
+        Returns:
+            tuple: (total amount, number of transactions, number of masks); the sums are None
+                without transactions, as with SQL's SUM.
+        """
+        columns = self.columns()
+        selected = self._select(columns, start, end)
+        count = int(np.count_nonzero(selected))
+        if not count:
+            return None, 0, None
+        amount = float(columns["amount"][selected].sum())
+        return amount, count, int(columns["mask_count"][selected].sum(dtype=np.int64))
+
+    def top_users(self, start=None, end=None, limit=None):
+        """ Users by total transaction amount in [start, end)
+
+        Args:
+            start (int | None): First second of the range (epoch seconds), or None.
+            end (int | None): First second after the range, or None.
+            limit (int | None): Maximum number of users.
+
+        Returns:
+            list[tuple[int, float]]: (user id, total rounded to 2 decimals) of the users with at least
+                one transaction, by descending total and then by user id.
+        """
+        columns = self.columns()
+        selected = self._select(columns, start, end)
+        users = columns["user_id"][selected]
+        if not users.size:
+            return []
+        totals = np.bincount(users, weights=columns["amount"][selected])
+        user_ids = np.flatnonzero(np.bincount(users, minlength=totals.size))
+        totals = np.round(totals[user_ids], 2)
+        if limit is not None and limit < totals.size:
+            # only the users with at least the limit-th largest total need to be sorted
+            threshold = np.partition(totals, totals.size - limit)[totals.size - limit]
+            candidates = np.flatnonzero(totals >= threshold)
+            user_ids, totals = user_ids[candidates], totals[candidates]
+        # user_ids are ascending, so the stable sort orders equal totals by user id
+        order = np.argsort(-totals, kind="stable")[:limit]
+        return list(zip(user_ids[order].tolist(), totals[order].tolist()))
+
+    # writing
+
+    def _locked(self):
+        return _StoreLock(self._thread_lock, self.directory, "lock")
+
+    def _write_generation(self, columns, rows, capacity):
+        """ Writes a new generation with the first `rows` rows of columns and switches to it """
+        os.makedirs(self.directory, exist_ok=True)
+        generation_path = os.path.join(self.directory, "generation.npy")
+        current = int(np.load(generation_path)[0]) if os.path.exists(generation_path) else 0
+        generation = current + 1
+        path = os.path.join(self.directory, str(generation))
+        shutil.rmtree(path, ignore_errors=True)     # left over by an interrupted write
+        os.makedirs(path)
+
+        for name, dtype in COLUMNS.items():
+            column = np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode="w+", dtype=dtype, shape=(capacity,))
+            column[:rows] = columns[name][:rows]
+            column.flush()
+        np.save(os.path.join(path, "rows.npy"), np.array([rows], dtype=np.int64))
+
+        if os.path.exists(generation_path):
+            generation_map = np.load(generation_path, mmap_mode="r+")
+            generation_map[0] = generation
+            generation_map.flush()
+        else:
+            np.save(generation_path, np.array([generation], dtype=np.int64))
+        # readers that still map the old generation keep reading it until they check again
+        shutil.rmtree(os.path.join(self.directory, str(current)), ignore_errors=True)
+
+    def rebuild(self, cursor):
+        """ Replaces the content of the store with the transactions table
+
+        The table is read without the lock, so purchases and cancellations go on meanwhile; the ones
+        written to the store during the read are journaled and replayed on the new generation.
+
+        Args:
+            cursor: DB-API cursor of the database (sqlite3, db_backend.PostgresCursor or Django's).
+
+        Returns:
+            int: Number of transactions in the store.
+        """
+        # one rebuild at a time, as they share the journal
+        with _StoreLock(self._rebuild_lock, self.directory, "rebuild.lock"):
+            journal_path = os.path.join(self.directory, "journal.txt")
+            with self._locked():
+                open(journal_path, "w").close()
+            try:
+                cursor.execute(SOURCE_QUERY)
+                rows = cursor.fetchall()
+                data = list(zip(*rows)) if rows else [[]] * (len(COLUMNS) - 1)
+                columns = {
+                    name: np.array(values, dtype=COLUMNS[name])
+                    for name, values in zip(COLUMNS, data)
+                    if name != "timestamp"
+                }
+                columns["timestamp"] = epoch_seconds(data[1])
+                columns["live"] = np.ones(len(rows), dtype=np.bool_)
+                with self._locked():
+                    with open(journal_path, encoding="utf-8") as journal:
+                        columns = replay_journal(columns, journal)
+                    row_count = columns["id"].size
+                    self._write_generation(columns, row_count, max(MIN_CAPACITY, 2 * row_count))
+            finally:
+                with self._locked():
+                    os.remove(journal_path)
+        return row_count
+
+    def _journal(self, line):
+        """ Records a write for the rebuild in progress, if any (call with the lock held) """
+        path = os.path.join(self.directory, "journal.txt")
+        if os.path.exists(path):
+            with open(path, "a", encoding="utf-8") as journal:
+                journal.write(line)
+
+    def append(self, transaction_id, timestamp, user_id, pharmacy_id, mask_id, amount, mask_count):
+        """ Appends a committed transaction (once; a transaction already in the store is skipped) """
+        self.append_many([(transaction_id, timestamp, user_id, pharmacy_id, mask_id, amount, mask_count)])
+
+    def append_many(self, rows):
+        """ Appends committed transactions (once each; the ones already in the store are skipped)
+
+        Args:
+            rows (list[tuple]): (id, timestamp, user id, pharmacy id, mask id, amount, mask count) of each
+                transaction, in any order.
+        """
+        if not rows:
+            return
+        new = {name: np.array([row[i] for row in rows], dtype=dtype) for i, (name, dtype) in enumerate(COLUMNS.items())
+               if name != "live"}
+        new["live"] = np.ones(len(rows), dtype=np.bool_)
+        # sorted by id, once each
+        _, first = np.unique(new["id"], return_index=True)
+        new = {name: column[first] for name, column in new.items()}
+
+        with self._locked():
+            for row in rows:
+                self._journal("append {} {} {} {} {} {!r} {}\n".format(*row[:5], float(row[5]), row[6]))
+            columns, row_count = self._open_for_write()
+            rows_in_use = int(row_count[0])
+            ids = columns["id"][:rows_in_use]
+            positions = np.searchsorted(ids, new["id"])
+            found = positions < rows_in_use
+            found[found] = ids[positions[found]] == new["id"][found]
+            new = {name: column[~found] for name, column in new.items()}
+            positions = positions[~found]
+            if not positions.size:
+                return
+
+            capacity = columns["id"].shape[0]
+            total = rows_in_use + positions.size
+            if positions[0] < rows_in_use:
+                # some committed after a transaction with a larger id (concurrent purchases on PostgreSQL):
+                # all of them are inserted in one new generation, so the ids stay sorted
+                self._write_generation(
+                    {name: np.insert(column[:rows_in_use], positions, new[name]) for name, column in columns.items()},
+                    total, capacity if total <= capacity else max(2 * capacity, total),
+                )
+                return
+            if total > capacity:
+                self._write_generation(columns, rows_in_use, max(2 * capacity, total))
+                columns, row_count = self._open_for_write()
+
+            for name, column in columns.items():
+                column[rows_in_use:total] = new[name]
+            # the row count is written last, so readers never see a partial row
+            row_count[0] = total
+
+    def cancel(self, transaction_id):
+        """ Marks a committed cancellation (nothing happens when the transaction isn't in the store) """
+        self.cancel_many([transaction_id])
+
+    def cancel_many(self, transaction_ids):
+        """ Marks committed cancellations (the transactions that aren't in the store are skipped) """
+        if not transaction_ids:
+            return
+        with self._locked():
+            for transaction_id in transaction_ids:
+                self._journal(f"cancel {transaction_id}\n")
+            columns, row_count = self._open_for_write()
+            ids = columns["id"][:int(row_count[0])]
+            if ids.size:
+                cancelled = np.array(transaction_ids, dtype=np.int64)
+                positions = np.searchsorted(ids, cancelled).clip(max=ids.size - 1)
+                columns["live"][positions[ids[positions] == cancelled]] = False
+
+    def _open_for_write(self):
+        """ Returns the writable columns and row count of the current generation (call with the lock held) """
+        generation = int(np.load(os.path.join(self.directory, "generation.npy"))[0])
+        if self._writable[0] != generation:
+            path = os.path.join(self.directory, str(generation))
+            columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r+") for name in COLUMNS}
+            self._writable = (generation, columns, np.load(os.path.join(path, "rows.npy"), mmap_mode="r+"))
+        return self._writable[1:]
+
+
+def replay_journal(columns, journal):
+    """ Applies the appends and cancellations of a journal to columns read from the database
+
+    Args:
+        columns (dict): Column name -> array, sorted by id.
+        journal (iterable[str]): Lines written by TransactionStore._journal.
+
+    Returns:
+        dict: The columns with the journaled transactions that weren't read, still sorted by id.
+    """
+    appends, cancellations = [], []
+    for line in journal:
+        operation, *values = line.split()
+        if operation == "append":
+            appends.append(values)
+        else:
+            cancellations.append(int(values[0]))
+    if appends:
+        appended = {
+            name: np.array([float(row[i]) if name == "amount" else int(row[i]) for row in appends], dtype=COLUMNS[name])
+            for i, name in enumerate(COLUMNS) if name != "live"
+        }
+        appended["live"] = np.ones(len(appends), dtype=np.bool_)
+        # the transactions committed before the read are in the table already
+        _, first = np.unique(appended["id"], return_index=True)
+        new = first[~np.isin(appended["id"][first], columns["id"])]
+        columns = {name: np.concatenate([column, appended[name][new]]) for name, column in columns.items()}
+        order = np.argsort(columns["id"], kind="stable")
+        columns = {name: column[order] for name, column in columns.items()}
+    ids = columns["id"]
+    if cancellations and ids.size:
+        cancelled = np.array(cancellations, dtype=np.int64)
+        positions = np.searchsorted(ids, cancelled).clip(max=ids.size - 1)
+        columns["live"][positions[ids[positions] == cancelled]] = False
+    return columns
+
+
+class _StoreLock:
+    """ Lock of the writers of a store: a thread lock, and a file lock between processes """
+
+    def __init__(self, thread_lock, directory, name):
+        self.thread_lock = thread_lock
+        self.directory = directory
+        self.name = name
+        self.file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            if fcntl is not None:
+                os.makedirs(self.directory, exist_ok=True)
+                self.file = open(os.path.join(self.directory, self.name), "w")
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.file is not None:
+            self.file.close()   # releases the file lock
+            self.file = None
+        self.thread_lock.release()
+
+
+# folder -> TransactionStore of this process
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_transaction_store():
+    """ Returns the store of settings.TRANSACTION_STORE_DIR, or None when it isn't set or built yet
+
+    The analytics views query the database instead then.
+    """
+    directory = settings.TRANSACTION_STORE_DIR
+    if not directory:
+        return None
+    store = _stores.get(directory)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(directory, TransactionStore(directory))
+    # a store mapped once stays in use (a rebuild switches it to a new generation)
+    return store if store.columns_mapped() or store.exists() else None
+
@@ -8,6 +8,7 @@ urlpatterns = [
     path("pharmacies/compare-masks/", views.PharmaciesCompareMaskListView.as_view(), name="pharmacies-compare-mask-list-view"),
     path("transactions/active-users/", views.ActiveTransactionsUserListView.as_view(), name="freq-transactions-user-list-view"),
     path("transactions/amounts/", views.MaskTransactionsView.as_view(), name="mask-transactions-view"),
+    path("transactions/amounts/stream/", views.SalesStreamView.as_view(), name="sales-stream-view"),
     path("search/", views.SearchView.as_view(), name="search-view"),
     path("purchase/masks/", views.PurchaseMaskView.as_view(), name="purchase-mask-view"),
     path("cancel-transactions/latest/", views.CancelLatestTransactionView.as_view(), name="cancel-latest-transaction-view"),
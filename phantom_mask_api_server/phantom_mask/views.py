@@ -1,18 +1,62 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from rest_framework import generics, views
+from rest_framework import views
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from .models import Pharmacies, Masks, PharmacyMasks, Transactions, Users
-from django.db.models import Count, Sum
+from django.db.models import F, Sum
 from django.db.models.functions import Round
-from django.db import transaction
+from django.db import router, transaction
 from . import serializers
 from datetime import datetime
 from django.utils.timezone import now
+from django.core.handlers.asgi import ASGIRequest
 import re
-from .utils.StringRelevance import StringRelevance as sr
 from .services.PharmacyQueryService import PharmacyQueryService
 from .services.UserQueryService import UserQueryService
+from .db_routers import PRIMARY_PIN_COOKIE, read_from_replica, replica_available
+from .async_views import AsyncAPIView, AsyncListAPIView
+from .response_cache import CatalogCacheMixin
+from .single_flight import SingleFlightMixin
+from .catalog_snapshot import aget_catalog_snapshot
+from .outbox import publish_transaction
+from .transaction_store import get_transaction_store
+from .sales_stream import EventStreamRenderer, stream_response
+from . import metrics
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ReplicaReadMixin:
+    """ Serves the view from the read replica, unless the client wrote recently (read-your-writes). """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.COOKIES.get(PRIMARY_PIN_COOKIE):
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self._dispatch_on_replica(request, *args, **kwargs)
+        with read_from_replica():
+            return super().dispatch(request, *args, **kwargs)
+
+    async def _dispatch_on_replica(self, request, *args, **kwargs):
+        # the replica has to stay selected until the async handler has finished
+        with read_from_replica():
+            return await super().dispatch(request, *args, **kwargs)
+
+class PrimaryPinMixin:
+    """ Pins the client to the primary for REPLICA_MAX_LAG seconds after a successful write.
+
+    Pinned clients also skip the transaction store, which the outbox consumers update a moment
+    after the write.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if response.status_code < 400 and (replica_available() or get_transaction_store() is not None):
+            response.set_cookie(PRIMARY_PIN_COOKIE, "1", max_age=settings.REPLICA_MAX_LAG, httponly=True, samesite="Lax")
+        return response
 
 class APIRootView(views.APIView):
     """ API root view. """
@@ -26,10 +70,30 @@ class APIRootView(views.APIView):
         }
         return Response(data)
 
-class PharmacyOpenListView(generics.ListAPIView):
+class PharmacyOpenListView(ReplicaReadMixin, CatalogCacheMixin, AsyncListAPIView):
     """ List all pharmacies that are open at a given time on a given day. """
 
     serializer_class = serializers.PharmaciesNameSerializer
+    fast_fields = {"name": "name"}
+
+    async def get(self, request, *args, **kwargs):
+        # answered from the in-memory catalog when there is one (see catalog_snapshot.py)
+        snapshot = await aget_catalog_snapshot(router.db_for_read(Pharmacies))
+        if snapshot is None:
+            return await super().get(request, *args, **kwargs)
+        day, time = PharmacyQueryService.parse_day_and_time(*self.get_day_and_time())
+        # (goes through every pharmacy: off the event loop)
+        return Response(await sync_to_async(snapshot.open_pharmacies)(day, time))
+
+    def get_day_and_time(self):
+        # get query parameters
+        day = self.request.query_params.get("day")
+        time = self.request.query_params.get("time")
+
+        if not day or not time:
+            raise ValidationError({"error": "Both day and time parameters are required."})
+
+        return day, time
     
     def get_queryset(self):
         """
@@ -37,14 +101,9 @@ class PharmacyOpenListView(generics.ListAPIView):
             day: day of the week (mon, tue, wed, thu, fri, sat, sun).
             time: time in HH:MM (24-hour format).
         """
-        # get query parameters
-        day = self.request.query_params.get("day")
-        time = self.request.query_params.get("time")
+        day, time = self.get_day_and_time()
 
-        if not day or not time:
-            raise ValidationError({"error": "Both day and time parameters are required."})
-
-        queryset = Pharmacies.objects.all()
+        queryset = Pharmacies.objects.order_by("id")
         
         try:
             queryset = PharmacyQueryService.filter_by_day_and_time(queryset, day, time)
@@ -53,9 +112,29 @@ class PharmacyOpenListView(generics.ListAPIView):
         
         return queryset
     
-class PharmacyMasksListView(generics.ListAPIView):
+class PharmacyMasksListView(ReplicaReadMixin, CatalogCacheMixin, AsyncListAPIView):
     """ List all masks sold by a given pharmacy, sorted by mask name or price."""
     serializer_class = serializers.PharmacyMasksSerializer
+    # joined in SQL, same fields and order as the serializer
+    fast_fields = {
+        "pharmacy_name": "pharmacy__name",
+        "mask_name": "mask__name",
+        "model": "mask__model",
+        "color": "mask__color",
+        "num_per_pack": "mask__num_per_pack",
+        "price": "price",
+    }
+
+    async def get(self, request, *args, **kwargs):
+        # answered from the in-memory catalog when there is one (see catalog_snapshot.py)
+        snapshot = await aget_catalog_snapshot(router.db_for_read(Pharmacies))
+        if snapshot is None:
+            return await super().get(request, *args, **kwargs)
+        pharmacy = snapshot.find_pharmacy(request.query_params.get("pharmacy"))
+        if pharmacy is None:
+            raise ValidationError({"error": "Pharmacy not found."})
+        sort_by = PharmacyQueryService.validate_sort_by(request.query_params.get("sort_by"))
+        return Response(snapshot.pharmacy_masks(pharmacy, sort_by))
 
     def get_queryset(self):
         """
@@ -76,10 +155,67 @@ class PharmacyMasksListView(generics.ListAPIView):
 
         return queryset
     
-class PharmaciesCompareMaskListView(generics.ListAPIView):
-    """ List all pharmacies with more or less than x mask products within a price range. """
+class PharmaciesCompareMaskListView(ReplicaReadMixin, CatalogCacheMixin, AsyncListAPIView):
+    """ List all pharmacies with more or less than x mask products within a price range.
+
+    With the ranges parameter, list the number of mask products of every pharmacy in each of several price ranges instead.
+    """
 
     serializer_class = serializers.PharmaciesMaskCountSerializer
+    fast_fields = {"name": "name", "mask_count": "mask_count"}
+
+    async def get(self, request, *args, **kwargs):
+        price_ranges = self.get_price_ranges()
+        # answered from the in-memory catalog when there is one (see catalog_snapshot.py)
+        snapshot = await aget_catalog_snapshot(router.db_for_read(Pharmacies))
+        if snapshot is None:
+            if price_ranges:
+                return await self.get_range_counts(price_ranges)
+            return await super().get(request, *args, **kwargs)
+        # (goes through every pharmacy: off the event loop)
+        return Response(await sync_to_async(self.get_snapshot_rows)(snapshot, price_ranges))
+
+    def get_snapshot_rows(self, snapshot, price_ranges):
+        if price_ranges:
+            counts = snapshot.mask_counts_in_ranges(price_ranges)
+            return [{"name": pharmacy.name, "mask_counts": range_counts} for pharmacy, range_counts in counts]
+
+        min_price, max_price, comp, x = self.get_price_filter()
+        PharmacyQueryService.validate_price_range(min_price, max_price)
+        counts = snapshot.mask_counts(min_price, max_price)
+        if comp and x:
+            condition = PharmacyQueryService.validate_mask_count_condition(comp)
+            counts = [(pharmacy, count) for pharmacy, count in counts if condition(count, int(x))]
+        return [{"name": pharmacy.name, "mask_count": count} for pharmacy, count in counts]
+
+    async def get_range_counts(self, price_ranges):
+        queryset = PharmacyQueryService.count_masks_in_price_ranges(Pharmacies.objects.order_by("name", "id"), price_ranges)
+        rows = queryset.values_list("name", *(f"mask_count_{i}" for i in range(len(price_ranges))))
+        return Response([{"name": name, "mask_counts": list(range_counts)} async for name, *range_counts in rows])
+
+    def get_price_ranges(self):
+        price_ranges = self.request.query_params.get("ranges")
+        if not price_ranges:
+            return None
+        if any(self.request.query_params.get(param) for param in ("min", "max", "cond")):
+            raise ValidationError({"error": "Use either ranges or min, max and cond."})
+        return PharmacyQueryService.parse_price_ranges(price_ranges)
+
+    def get_price_filter(self):
+        # get query parameters
+        min_price = self.request.query_params.get("min")
+        max_price = self.request.query_params.get("max")
+        cond = self.request.query_params.get("cond")
+        r = re.match(r"([A-Za-z]+)(\d+)", cond or "")
+        comp, x = r.groups() if r else (None, None)
+
+        try:
+            min_price = float(min_price) if min_price else 0.0
+            max_price = float(max_price) if max_price else float("inf")
+        except ValueError as e:
+            raise ValidationError({"error": str(e)})
+
+        return min_price, max_price, comp, x
 
     def get_queryset(self):
         """
@@ -87,26 +223,15 @@ class PharmaciesCompareMaskListView(generics.ListAPIView):
             min: minimum price of the masks.
             max: maximum price of the masks.
             cond: comparison operator + number (e.g., 'gt5', 'lt10').
+            ranges: price ranges to count the masks in instead (e.g., '0-10,10-20,20-').
         """
-        queryset = Pharmacies.objects.all()
+        queryset = Pharmacies.objects.order_by("name", "id")
 
-        # get query parameters
-        min_price = self.request.query_params.get("min")
-        max_price = self.request.query_params.get("max")
-        cond = self.request.query_params.get("cond")
-        r = re.match(r"([A-Za-z]+)(\d+)", cond)
-        comp, x = r.groups() if r else (None, None)
-
-        min_price = float(min_price) if min_price else 0.0
-        max_price = float(max_price) if max_price else float("inf")
+        min_price, max_price, comp, x = self.get_price_filter()
 
         try:
-            # query the number of masks in the price range
-            queryset = PharmacyQueryService.filter_by_price_range(
-                queryset, min_price, max_price
-            ).annotate( # join with pharmacy_masks table
-                mask_count=Count("pharmacy_masks__mask", distinct=True)
-            ).all()
+            # count the masks in the price range, pharmacies without any included
+            queryset = PharmacyQueryService.count_masks_in_price_range(queryset, min_price, max_price)
 
             if comp and x:
                 # filter by condition
@@ -119,10 +244,37 @@ class PharmaciesCompareMaskListView(generics.ListAPIView):
 
         return queryset
 
-class ActiveTransactionsUserListView(generics.ListAPIView):
+class ActiveTransactionsUserListView(ReplicaReadMixin, SingleFlightMixin, AsyncListAPIView):
     """ List the top x users by total transaction amount of masks within a date range. """
     
     serializer_class = serializers.TransactionsUserSerializer
+    fast_fields = {"name": "name", "total_transaction_amount": "total_transaction_amount"}
+
+    async def get(self, request, *args, **kwargs):
+        # answered from the columnar transaction store when there is one (see transaction_store.py),
+        # except to clients that just wrote, as the store follows the outbox
+        # (the store's files and full passes over its columns are read off the event loop)
+        store = None if request.COOKIES.get(PRIMARY_PIN_COOKIE) else await sync_to_async(get_transaction_store)()
+        if store is None:
+            return await super().get(request, *args, **kwargs)
+        start_date, end_date = UserQueryService.parse_date_range(request.query_params.get("start"), request.query_params.get("end"))
+        x = request.query_params.get("x")
+
+        try:
+            limit = int(x) if x else None
+        except ValueError as e:
+            raise ValidationError({"error": str(e)})
+        if limit is not None:
+            UserQueryService.validate_limit(limit)
+
+        top_users = await sync_to_async(store.top_users)(*UserQueryService.day_bounds(start_date, end_date), limit)
+
+        user_ids = [user_id for user_id, _ in top_users]
+        names = {user_id: name async for user_id, name in UserQueryService.get_user_names(user_ids)}
+        return Response([
+            {"name": names[user_id], "total_transaction_amount": total}
+            for user_id, total in top_users if user_id in names
+        ])
     
     def get_queryset(self):
         """
@@ -144,8 +296,8 @@ class ActiveTransactionsUserListView(generics.ListAPIView):
                 queryset, start_date, end_date
             ).annotate( # join with transactions table
                 total_transaction_amount=Round(Sum("transactions__transaction_amount"), 2)  
-            ).order_by( # descending order
-                "-total_transaction_amount"
+            ).order_by( # descending order (ties by id, as in the transaction store)
+                "-total_transaction_amount", "id"
             )
             
             # limit the number of users returned
@@ -155,12 +307,12 @@ class ActiveTransactionsUserListView(generics.ListAPIView):
 
         return queryset
     
-class MaskTransactionsView(views.APIView):
+class MaskTransactionsView(ReplicaReadMixin, SingleFlightMixin, AsyncAPIView):
     """ Find the total number of masks and dollar value of transactions within a date range. """
         
     serializer_class = serializers.TransactionsAmountSerializer
     
-    def get(self, request):
+    async def get(self, request):
         """
         query parameters:
             start: start date (YYYY-MM-DD).
@@ -188,15 +340,32 @@ class MaskTransactionsView(views.APIView):
             except ValueError:
                 raise ValidationError({"error": "Invalid end date format. Use YYYY-MM-DD."})
             
-        queryset = Transactions.objects.filter(**filters).aggregate(
-            total_transaction_amount=Round(Sum("transaction_amount"), 2),
-            total_mask_product_count=Count("id"),
-            total_mask_count=Sum("mask__num_per_pack")
-        )
+        # answered from the columnar transaction store when there is one (see transaction_store.py),
+        # except to clients that just wrote, as the store follows the outbox
+        # (the store's files and full passes over its columns are read off the event loop)
+        store = None if request.COOKIES.get(PRIMARY_PIN_COOKIE) else await sync_to_async(get_transaction_store)()
+        if store is not None:
+            total_amount, product_count, mask_count = await sync_to_async(store.totals)(*UserQueryService.day_bounds(
+                filters.get("transaction_date__date__gte"), filters.get("transaction_date__date__lte")
+            ))
+            return Response({
+                "total_transaction_amount": round(total_amount, 2) if total_amount is not None else None,
+                "total_mask_product_count": product_count,
+                "total_mask_count": mask_count,
+            })
 
-        return Response(queryset)
+        # otherwise from the daily totals of the transactions and the transactions after them
+        from .transaction_rollup import transaction_totals
+        total_amount, product_count, mask_count = await sync_to_async(transaction_totals)(
+            filters.get("transaction_date__date__gte"), filters.get("transaction_date__date__lte")
+        )
+        return Response({
+            "total_transaction_amount": round(total_amount, 2) if total_amount is not None else None,
+            "total_mask_product_count": product_count,
+            "total_mask_count": mask_count,
+        })
     
-class SearchView(views.APIView):
+class SearchView(ReplicaReadMixin, CatalogCacheMixin, SingleFlightMixin, AsyncAPIView):
     """ Search for pharmacies or masks by name, ranked by relevance to the search term. """
 
     # define the search models
@@ -213,7 +382,7 @@ class SearchView(views.APIView):
         }
     }
 
-    def get(self, request):
+    async def get(self, request):
         """
         query parameters:
             type: type of search (pharmacy or mask).
@@ -229,11 +398,23 @@ class SearchView(views.APIView):
         if search_type not in self.search_models:
             return Response({"error": "Invalid search type. Use 'pharmacy' or 'mask'."})
 
-        # calculate relevance for each object in the model
+        # calculate relevance for each object in the model (only the compared field is fetched)
+        search_model = self.search_models[search_type]
+        values = search_model["model"].objects.order_by("id").values_list(   # stable order of ties
+            search_model["compared_field"], flat=True
+        )
+        values = [value async for value in values]
+        # (one scoring per row in Python: off the event loop)
+        return Response(await sync_to_async(self.rank)(search_term, values))
+
+    @staticmethod
+    def rank(search_term, values):
+        """ Distinct values by relevance to the search term, as rows of the search model's serializer """
+        # imported on first use: jaro and Levenshtein are only needed by the search
+        from .utils.StringRelevance import StringRelevance as sr
+
         results = []
-        for obj in self.search_models[search_type]["model"].objects.all():
-            # get the compared field value
-            compared_field_value = getattr(obj, self.search_models[search_type]["compared_field"])
+        for compared_field_value in values:
             # calculate relevance using StringRelevance class
             relevance = sr(search_term, compared_field_value).get_relevance()
             # append the result to the list if not existing
@@ -249,12 +430,21 @@ class SearchView(views.APIView):
         # sort results by relevance
         results = sorted(results, key=lambda x: x["relevance"])
 
-        serializer_class = self.search_models[search_type]["serializer"]
-        serializer = serializer_class(results, many=True)
-    
-        return Response(serializer.data)
+        # same output as search_model["serializer"]
+        return [{"name": result["name"]} for result in results]
+
+class SalesStreamView(AsyncAPIView):
+    """ Stream the total amount, product count and mask count of the day per pharmacy (server-sent events). """
+
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer]
 
-class PurchaseMaskView(views.APIView):
+    async def get(self, request):
+        # under WSGI, Django reads an async stream to its end before sending it
+        if not isinstance(request._request, ASGIRequest):
+            return Response({"error": "The sales stream needs the ASGI server (SERVER_MODE=asgi)."}, status=501)
+        return stream_response()
+
+class PurchaseMaskView(PrimaryPinMixin, views.APIView):
     """ Purchase a mask from a pharmacy. """
     
     def post(self, request):
@@ -264,6 +454,7 @@ class PurchaseMaskView(views.APIView):
 
         data = serializer.validated_data
 
+        committed = False
         try:
             with transaction.atomic():
                 # get the pharmacy, mask, and user objects
@@ -275,27 +466,26 @@ class PurchaseMaskView(views.APIView):
                 # calculate total cost
                 total_cost = round(pharmacy_mask.price * data["quantity"], 2)
 
-                # check if the cash balance of the user is enough
-                if user.cash_balance < total_cost:
+                # update the cash balance of the user and pharmacy, on the current balances (a concurrent
+                # purchase may have changed them since they were read); the user's only if it is enough
+                if not Users.objects.filter(id=user.id, cash_balance__gte=total_cost).update(
+                    cash_balance=F("cash_balance") - total_cost
+                ):
                     raise ValidationError({"error": "User does not have enough balance."})
-
-                # update the cash balance of the user and pharmacy
-                user.cash_balance -= total_cost
-                pharmacy.cash_balance += total_cost
-                user.save()
-                pharmacy.save()
+                Pharmacies.objects.filter(id=pharmacy.id).update(cash_balance=F("cash_balance") + total_cost)
 
                 # create a transaction record
-                Transactions.objects.create(
+                record = Transactions.objects.create(
                     user=user,
                     pharmacy=pharmacy,
                     mask=mask,
                     transaction_amount=total_cost,
                     transaction_date=now().replace(microsecond=0)
                 )
+                # derived data (the transaction store, the export) is updated by the outbox consumers
+                publish_transaction("purchase", record, mask.num_per_pack)
 
-                # return the response
-                return Response({
+                response = Response({
                     "message": "Thank you! Have a nice day!",
                     "user": user.name,
                     "pharmacy": pharmacy.name,
@@ -304,6 +494,10 @@ class PurchaseMaskView(views.APIView):
                     "total_cost": total_cost,
                     "transaction_date": now().replace(microsecond=0)
                 })
+
+            # return the response (the transaction is committed)
+            committed = True
+            return response
             
         # handle exceptions
         except Pharmacies.DoesNotExist:
@@ -317,11 +511,15 @@ class PurchaseMaskView(views.APIView):
         except ValidationError as e:
             return Response(e.detail, status=400)
         except Exception as e:
-            import traceback
-            traceback.print_exc()  # Print the stack trace for debugging
+            logger.exception("Purchase failed")
             return Response({"error": str(e)}, status=500)
+        finally:
+            metrics.record_purchase(committed)
 
-class CancelLatestTransactionView(views.APIView):
+class TransactionAlreadyCancelled(Exception):
+    """ The transaction was deleted by a concurrent cancellation """
+
+class CancelLatestTransactionView(PrimaryPinMixin, views.APIView):
     """ Cancel the latest transaction. """
 
     # (Simply delete a record. Needs to be refactored in a more robust way for production.)
@@ -331,30 +529,35 @@ class CancelLatestTransactionView(views.APIView):
         It will revert the transaction and restore user and pharmacy balance.
         """
         try:
-            # get the latest transaction
-            latest_transaction = Transactions.objects.order_by('-transaction_date').first()
-
-            if not latest_transaction:
-                raise ValidationError("No transactions found.")
-
-            # Ensure this is a valid transaction for cancellation (e.g., not already cancelled)
-
-            user = latest_transaction.user
-            pharmacy = latest_transaction.pharmacy
-            mask = latest_transaction.mask
-            total_cost = latest_transaction.transaction_amount
-
             with transaction.atomic():
-                # Revert user balance
-                user.cash_balance += total_cost
-                user.save()
-
-                # Revert pharmacy balance
-                pharmacy.cash_balance -= total_cost
-                pharmacy.save()
-
-                # Delete the transaction record
-                latest_transaction.delete()
+                # read in the transaction of the cancellation, so concurrent cancellations don't both refund
+                # it (the row is locked on PostgreSQL; SQLite's IMMEDIATE transactions run one at a time)
+                latest_transaction = Transactions.objects.select_related(
+                    "user", "pharmacy", "mask"
+                ).select_for_update(of=("self",)).order_by('-transaction_date').first()
+
+                if not latest_transaction:
+                    raise ValidationError("No transactions found.")
+
+                user = latest_transaction.user
+                pharmacy = latest_transaction.pharmacy
+                mask = latest_transaction.mask
+                total_cost = latest_transaction.transaction_amount
+                transaction_id = latest_transaction.id
+
+                # Delete the transaction record; only the request that deleted it reverts it
+                if Transactions.objects.filter(id=transaction_id).delete()[0] != 1:
+                    raise TransactionAlreadyCancelled()
+
+                # Revert user and pharmacy balance (on the current balances)
+                Users.objects.filter(id=user.id).update(cash_balance=F("cash_balance") + total_cost)
+                Pharmacies.objects.filter(id=pharmacy.id).update(cash_balance=F("cash_balance") - total_cost)
+
+                # the daily totals are corrected here, in the same transaction as the compaction's
+                # watermark (see transaction_rollup.py); the rest by the outbox consumers
+                from .transaction_rollup import subtract_cancellation
+                subtract_cancellation(latest_transaction, transaction_id, mask.num_per_pack)
+                publish_transaction("cancellation", latest_transaction, mask.num_per_pack, transaction_id)
 
             # Return the success response with details
             response_data = {
@@ -366,5 +569,7 @@ class CancelLatestTransactionView(views.APIView):
             }
             return Response(response_data, status=200)
 
+        except TransactionAlreadyCancelled:
+            return Response({"error": "The latest transaction was cancelled by another request."}, status=409)
         except Exception as e:
             return Response({"error": str(e)}, status=500)
\ No newline at end of file
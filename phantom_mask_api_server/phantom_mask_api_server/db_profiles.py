@@ -0,0 +1,116 @@
+""" SQLite performance profiles applied to every new database connection
+
+A profile is a set of PRAGMAs plus the connection settings that go with them. The server picks
+one with the DATABASE_PROFILE environment variable (see settings.py) and PhantomMaskConfig.ready()
+applies its PRAGMAs through the connection_created signal; the ETL scripts use the bulk profile.
+
+This module has no Django imports, so the scripts can use it without setting Django up.
+"""
+
+MiB = 1024 * 1024
+
+PROFILES = {
+    # plain SQLite defaults: rollback journal, no busy timeout, a new connection per request
+    # (the journal mode is stored in the database file, so it is set back explicitly)
+    "none": {
+        "pragmas": {"journal_mode": "DELETE"},
+        "conn_max_age": 0,
+        "options": {},
+    },
+    # local development: WAL so the ETL and the server can run side by side, modest memory use
+    "development": {
+        "pragmas": {
+            "busy_timeout": 5000,
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -16 * 1024,      # negative values are KiB: 16 MiB page cache
+            "mmap_size": 64 * MiB,
+            "temp_store": "MEMORY",
+        },
+        "conn_max_age": 60,
+        # take the write lock when a transaction starts, so busy_timeout applies to it
+        "options": {"transaction_mode": "IMMEDIATE"},
+    },
+    # server: persistent connections, a larger page cache and the whole database memory-mapped
+    "production": {
+        "pragmas": {
+            "busy_timeout": 10000,
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -64 * 1024,
+            "mmap_size": 1024 * MiB,
+            "temp_store": "MEMORY",
+        },
+        "conn_max_age": 600,
+        "options": {"transaction_mode": "IMMEDIATE"},
+    },
+    # read replica snapshot (opened read-only and immutable): caching only, nothing to write
+    "snapshot": {
+        "pragmas": {
+            "query_only": 1,
+            "cache_size": -64 * 1024,
+            "mmap_size": 1024 * MiB,
+            "temp_store": "MEMORY",
+        },
+        "conn_max_age": 0,
+        "options": {},
+    },
+    # ETL loads: no fsync (a failed load is rerun from its checkpoint) and a large page cache
+    "bulk": {
+        "pragmas": {
+            "busy_timeout": 60000,
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "cache_size": -256 * 1024,
+            "mmap_size": 1024 * MiB,
+            "temp_store": "MEMORY",
+        },
+        "conn_max_age": 0,
+        "options": {},
+    },
+}
+
+
+def get_profile(name):
+    """ Returns the profile called name
+
+    Raises:
+        ValueError: If there is no such profile.
+    """
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown database profile '{name}', expected one of: {', '.join(PROFILES)}")
+
+
+def apply_pragmas(conn, pragmas):
+    """ Runs the PRAGMAs on a DB-API connection (sqlite3 or Django's connection wrapper)
+
+    busy_timeout comes first, so switching the journal mode waits for other connections.
+
+    Args:
+        conn: Connection with a cursor() method.
+        pragmas (dict): PRAGMA names and values.
+    """
+    cursor = conn.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+            # PRAGMA journal_mode returns a row that has to be consumed
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def read_pragmas(conn, names):
+    """ Returns the current value of each PRAGMA in names """
+    cursor = conn.cursor()
+    try:
+        values = {}
+        for name in names:
+            cursor.execute(f"PRAGMA {name}")
+            row = cursor.fetchone()
+            values[name] = row[0] if row else None
+        return values
+    finally:
+        cursor.close()
@@ -13,6 +13,10 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
+from .db_profiles import get_profile
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -25,7 +29,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-%sv@98n$i*4o0r622ce-p4-rla=ee@jx8ce0yw0$jes=dp7vlw'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# (DEBUG also keeps every SQL query in memory; DJANGO_DEBUG=1/0 overrides the default)
+DEBUG = os.environ.get('DJANGO_DEBUG', '0' if os.environ.get('ENV') == 'production' else '1') == '1'
 
 # allowed hosts in production
 ALLOWED_HOSTS = ['localhost', 'phantom-mask-production-b908.up.railway.app', '0.0.0.0', '127.0.0.1']
@@ -53,6 +58,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so it measures the whole request (see phantom_mask/instrumentation.py)
+    'phantom_mask.instrumentation.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,21 +94,195 @@ WSGI_APPLICATION = 'phantom_mask_api_server.wsgi.application'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
 
-# set up SQLite database path
+# DATABASE_ENGINE selects the database: 'sqlite' (default) or 'postgresql'
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+# set up SQLite database path (DATABASE_PATH overrides it, e.g. for load tests)
 if os.environ.get('ENV') == 'production':
+    DATABASE_PATH = os.environ.get('DATABASE_PATH', os.path.join('/app/db', 'phantom_mask_db.db'))  # persistent storage path
+else:
+    DATABASE_PATH = os.environ.get('DATABASE_PATH', os.path.join(BASE_DIR, 'db', 'phantom_mask_db.db'))  # local development path
+
+# SQLite performance profile (PRAGMAs and persistent connections), see db_profiles.py
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'production' if os.environ.get('ENV') == 'production' else 'development')
+_database_profile = get_profile(DATABASE_PROFILE)
+
+if DATABASE_ENGINE == 'postgresql':
+    # PostgreSQL with a psycopg connection pool per process (CONN_MAX_AGE must stay 0 with a pool)
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': os.path.join('/app/db', 'phantom_mask_db.db'),  # persistent storage path
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'phantom_mask'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10)),
+                    'timeout': float(os.environ.get('POSTGRES_POOL_TIMEOUT', 10)),
+                },
+            },
+            'TEST': {
+                'NAME': os.environ.get('POSTGRES_TEST_DB', 'test_phantom_mask'),
+            },
         }
     }
-else:
+elif DATABASE_ENGINE == 'sqlite':
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': os.path.join(BASE_DIR, 'db', 'phantom_mask_db.db'),  # local development path
+            'NAME': DATABASE_PATH,
+            'CONN_MAX_AGE': _database_profile['conn_max_age'],
+            'CONN_HEALTH_CHECKS': _database_profile['conn_max_age'] > 0,
+            'OPTIONS': _database_profile['options'],
         }
     }
+else:
+    raise ImproperlyConfigured(f"Unknown DATABASE_ENGINE '{DATABASE_ENGINE}', expected 'sqlite' or 'postgresql'")
+
+# read replica of the read-only views (see phantom_mask/db_routers.py):
+# a streaming replica on PostgreSQL, a periodically refreshed snapshot file on SQLite
+# (python manage.py refresh_replica_snapshot --interval 30)
+REPLICA_SNAPSHOT_PATH = None
+if DATABASE_ENGINE == 'postgresql' and os.environ.get('POSTGRES_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['POSTGRES_REPLICA_HOST'],
+        'PORT': os.environ.get('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+elif DATABASE_ENGINE == 'sqlite' and os.environ.get('REPLICA_SNAPSHOT_PATH'):
+    REPLICA_SNAPSHOT_PATH = os.environ['REPLICA_SNAPSHOT_PATH']
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        # read-only and immutable: no locks, no journal, never blocked by writers
+        'NAME': f'file:{REPLICA_SNAPSHOT_PATH}?mode=ro&immutable=1',
+        'PROFILE': 'snapshot',
+        # reopened for every request, so a refreshed snapshot is used right away
+        'CONN_MAX_AGE': 0,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# seconds the replica may lag behind; clients read from the primary for this long after a write
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 30))
+
+DATABASE_ROUTERS = ['phantom_mask.db_routers.ReadReplicaRouter']
+
+# columnar copy of the transactions for the analytics endpoints (see phantom_mask/transaction_store.py),
+# built by the users ETL; next to the SQLite database by default, to be set with PostgreSQL ('' turns it off)
+TRANSACTION_STORE_DIR = os.environ.get(
+    'TRANSACTION_STORE_DIR', os.path.splitext(DATABASE_PATH)[0] + '_transactions' if DATABASE_ENGINE == 'sqlite' else ''
+)
+
+# online backups of the SQLite database (python manage.py backup_database --interval 3600, see
+# phantom_mask/db_backup.py): folder of the backups and number of backups kept
+BACKUP_DIR = os.environ.get('BACKUP_DIR', os.path.join(os.path.dirname(DATABASE_PATH), 'backups'))
+BACKUP_RETENTION = int(os.environ.get('BACKUP_RETENTION', 7))
+
+# outbox of the purchases and cancellations (see phantom_mask/outbox.py): seconds after which a
+# missing event id is taken as rolled back, seconds consumed events are kept, and the JSON Lines
+# file of the export consumer ('' turns it off)
+OUTBOX_GAP_TIMEOUT = float(os.environ.get('OUTBOX_GAP_TIMEOUT', 10))
+OUTBOX_RETENTION = float(os.environ.get('OUTBOX_RETENTION', 86400))
+OUTBOX_EXPORT_PATH = os.environ.get('OUTBOX_EXPORT_PATH', '')
+
+# server-sent events of the sales of the day (see phantom_mask/sales_stream.py): seconds between two
+# reads of the outbox, and between two aggregations of the day that resync the viewers
+SALES_STREAM_POLL_INTERVAL = float(os.environ.get('SALES_STREAM_POLL_INTERVAL', 0.5))
+SALES_STREAM_SNAPSHOT_INTERVAL = float(os.environ.get('SALES_STREAM_SNAPSHOT_INTERVAL', 60))
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# 'responses' holds the rendered catalog responses (see phantom_mask/response_cache.py):
+# locmem is per process with LRU eviction; RESPONSE_CACHE_DIR switches to a file cache shared by the workers
+RESPONSE_CACHE_OPTIONS = {
+    'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 600)),   # TTL in seconds
+    'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000))},
+}
+if os.environ.get('RESPONSE_CACHE_DIR'):
+    RESPONSE_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['RESPONSE_CACHE_DIR'],
+        **RESPONSE_CACHE_OPTIONS,
+    }
+else:
+    RESPONSE_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'phantom-mask-responses',
+        **RESPONSE_CACHE_OPTIONS,
+    }
+
+# seconds between two reads of the catalog version (see phantom_mask/catalog_version.py): catalog
+# changes made by other processes (the ETL, other workers) are seen after at most this long
+CATALOG_VERSION_TTL = float(os.environ.get('CATALOG_VERSION_TTL', 1))
+# serve the catalog endpoints from an in-process snapshot of the catalog (phantom_mask/catalog_snapshot.py)
+CATALOG_SNAPSHOT = os.environ.get('CATALOG_SNAPSHOT', '1') == '1'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': RESPONSE_CACHE,
+}
+
+# identical concurrent requests of the analytics and search endpoints share one computation
+# (see phantom_mask/single_flight.py); SINGLE_FLIGHT_CACHE names a cache of CACHES shared by the
+# workers (e.g. 'responses' with RESPONSE_CACHE_DIR) to share it between processes too
+SINGLE_FLIGHT = os.environ.get('SINGLE_FLIGHT', '1') == '1'
+SINGLE_FLIGHT_CACHE = os.environ.get('SINGLE_FLIGHT_CACHE', '')
+# seconds a request waits for another process before computing its own response
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', 30))
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+# JSON is encoded with orjson (same bytes as DRF's JSONRenderer, see phantom_mask/renderers.py)
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'phantom_mask.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+
+
+# Performance instrumentation (Server-Timing header and a log line per request)
+PERFORMANCE_INSTRUMENTATION = os.environ.get('PERFORMANCE_INSTRUMENTATION', '1') == '1'
+# requests slower than this, or with more queries, are logged as warnings with their slowest SQL
+PERFORMANCE_SLOW_REQUEST_MS = float(os.environ.get('PERFORMANCE_SLOW_REQUEST_MS', 500))
+PERFORMANCE_MAX_QUERIES = int(os.environ.get('PERFORMANCE_MAX_QUERIES', 20))
+PERFORMANCE_SLOW_QUERIES_LOGGED = 3
+
+# Prometheus metrics at /metrics (see phantom_mask/metrics.py); with several worker processes,
+# METRICS_DIR is the folder where each worker writes its counters (gunicorn.conf.py sets it)
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+
+# Logging
+# https://docs.djangoproject.com/en/5.1/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '{asctime} {levelname} {name} {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        # PERFORMANCE_LOG_LEVEL=WARNING keeps only the slow requests
+        'phantom_mask.performance': {
+            'handlers': ['console'],
+            'level': os.environ.get('PERFORMANCE_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
 
 
 
@@ -142,6 +323,10 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
+# OpenAPI document of /swagger/, rendered at build time by `python manage.py build_openapi_schema`
+# (see phantom_mask/openapi_schema.py)
+OPENAPI_SCHEMA_DIR = os.environ.get('OPENAPI_SCHEMA_DIR', os.path.join(BASE_DIR, 'openapi'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -15,26 +15,16 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path, include
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 from django.conf import settings
 from django.conf.urls.static import static
-
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Phantom Mask API Documentation",
-        default_version='v1',
-        description="Phantom Mask is an API server designed to provide access to pharmacy-related information, providing several services that enable users to query pharmacy details.",
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from phantom_mask.metrics import metrics_view
+from phantom_mask.openapi_schema import OpenAPISchemaView
 
 
 urlpatterns = [
     path("api/", include("phantom_mask.urls")),
-    path("swagger/", schema_view.as_view(), name="swagger-schema"),
+    path("swagger/", OpenAPISchemaView.as_view(), name="swagger-schema"),
+    path("metrics", metrics_view, name="metrics"),
 ]
 
 # urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
@@ -0,0 +1,224 @@
+import os
+import sqlite3
+import sys
+
+# the PRAGMA profiles live in the Django project package, next to the settings that use them
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+from phantom_mask_api_server.db_profiles import PROFILES, apply_pragmas, get_profile  # noqa: E402
+
+""" Database connections of the scripts: a SQLite file or a PostgreSQL server
+
+The scripts are written against the sqlite3 API (qmark placeholders, chained execute().fetchone()).
+PostgreSQL connections are wrapped so the same SQL runs on both; bulk inserts go through
+insert_rows(), which uses COPY on PostgreSQL and executemany() on SQLite.
+
+The PostgreSQL server is configured with the same environment variables as settings.py
+(DATABASE_ENGINE=postgresql, POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT).
+"""
+
+# tables with an id column generated by the database
+ID_TABLES = ["users", "pharmacies", "masks", "transactions", "pharmacy_masks"]
+
+
+def is_postgres(database):
+    """ True when database is a PostgreSQL URL or conninfo string rather than a SQLite path """
+    return database.startswith(("postgresql://", "postgres://")) or "dbname=" in database
+
+
+def default_database():
+    """ Returns the database of the environment: a PostgreSQL conninfo string when
+    DATABASE_ENGINE=postgresql, otherwise the SQLite path (DATABASE_PATH or db/phantom_mask_db.db) """
+    if os.environ.get("DATABASE_ENGINE") == "postgresql":
+        from psycopg.conninfo import make_conninfo
+        return make_conninfo(
+            dbname=os.environ.get("POSTGRES_DB", "phantom_mask"),
+            user=os.environ.get("POSTGRES_USER", "postgres"),
+            password=os.environ.get("POSTGRES_PASSWORD", ""),
+            host=os.environ.get("POSTGRES_HOST", "localhost"),
+            port=os.environ.get("POSTGRES_PORT", "5432"),
+        )
+    return os.environ.get("DATABASE_PATH", "db/phantom_mask_db.db")
+
+
+class PostgresCursor:
+    """ psycopg cursor with the parts of the sqlite3 cursor API used by the scripts """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @staticmethod
+    def _sql(sql):
+        # qmark placeholders to psycopg's format placeholders (literal % signs are escaped)
+        return sql.replace("%", "%%").replace("?", "%s")
+
+    def execute(self, sql, params=()):
+        if params:
+            self.cursor.execute(self._sql(sql), params)
+        else:
+            self.cursor.execute(sql)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self.cursor.executemany(self._sql(sql), list(seq_of_params))
+        return self
+
+    def copy_rows(self, table, columns, rows):
+        """ Bulk-loads rows with COPY ... FROM STDIN """
+        with self.cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def close(self):
+        self.cursor.close()
+
+
+class PostgresConnection:
+    """ psycopg connection with the parts of the sqlite3 connection API used by the scripts """
+
+    def __init__(self, conninfo):
+        import psycopg
+        self.conn = psycopg.connect(conninfo)
+        # raw dates are naive UTC timestamps, as in the SQLite database
+        self.conn.execute("SET TIME ZONE 'UTC'")
+
+    def cursor(self):
+        return PostgresCursor(self.conn.cursor())
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+def connect(database, profile="bulk"):
+    """ Opens a connection to a SQLite file or a PostgreSQL server
+
+    Args:
+        database (str): SQLite path, or PostgreSQL URL / conninfo string.
+        profile (str): PRAGMA profile of db_profiles.py for SQLite; the ETL scripts use "bulk"
+            (WAL, no fsync, large page cache).
+
+    Returns:
+        sqlite3.Connection | PostgresConnection: The configured connection.
+    """
+    if is_postgres(database):
+        return PostgresConnection(database)
+    conn = sqlite3.connect(database)
+    apply_pragmas(conn, get_profile(profile)["pragmas"])
+    return conn
+
+
+def insert_rows(cursor, table, columns, rows):
+    """ Bulk-inserts rows: COPY on PostgreSQL, a single executemany() on SQLite """
+    if isinstance(cursor, PostgresCursor):
+        cursor.copy_rows(table, columns, rows)
+    else:
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+        )
+
+
+def bump_catalog_version(cursor):
+    """ Marks the catalog (pharmacies, masks, prices, opening hours) as changed, so cached responses expire """
+    cursor.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+
+
+def default_transaction_store(database):
+    """ Returns the folder of the columnar transaction store of a database, as in settings.py:
+    TRANSACTION_STORE_DIR, otherwise next to a SQLite file (None for PostgreSQL) """
+    if "TRANSACTION_STORE_DIR" in os.environ:
+        return os.environ["TRANSACTION_STORE_DIR"] or None
+    if is_postgres(database):
+        return None
+    return os.path.splitext(database)[0] + "_transactions"
+
+
+def rebuild_transaction_store(conn, directory):
+    """ Rebuilds the columnar transaction store (phantom_mask/transaction_store.py) from the committed transactions
+
+    Args:
+        conn (sqlite3.Connection | PostgresConnection): Database connection.
+        directory (str | None): Folder of the store; nothing is done when None.
+    """
+    if not directory:
+        return
+    from phantom_mask.transaction_store import TransactionStore
+    rows = TransactionStore(directory).rebuild(conn.cursor())
+    conn.commit()   # ends the read transaction of PostgreSQL
+    print(f"Transaction store {directory} rebuilt with {rows} transactions")
+
+
+def reset_transaction_rollup(conn):
+    """ Empties the daily totals of the transactions (phantom_mask/transaction_rollup.py) after a load
+
+    The ETL inserts, changes and deletes transactions of any day, so the totals are compacted again
+    from the first transaction by the maintenance jobs.
+
+    Args:
+        conn (sqlite3.Connection | PostgresConnection): Database connection.
+    """
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM transaction_daily_totals")
+    cursor.execute("UPDATE transaction_rollup_watermark SET last_transaction_id = 0 WHERE id = 1")
+    conn.commit()
+
+
+def reserve_ids(cursor, table, count):
+    """ Takes count ids of a table that no other insert gets, for rows inserted with explicit ids
+
+    PostgreSQL hands out the values of the id sequence. SQLite moves the AUTOINCREMENT counter of the
+    table (sqlite_sequence) past them, which also takes the write lock until the caller commits.
+
+    Args:
+        cursor (sqlite3.Cursor | PostgresCursor): Cursor of the transaction that inserts the rows.
+        table (str): One of ID_TABLES.
+        count (int): Number of ids.
+
+    Returns:
+        list[int]: The ids, in increasing order.
+    """
+    if not count:
+        return []
+    if isinstance(cursor, PostgresCursor):
+        return [row[0] for row in cursor.execute(
+            f"SELECT nextval(pg_get_serial_sequence('{table}', 'id')) FROM generate_series(1, ?) ORDER BY 1", (count,)
+        ).fetchall()]
+    cursor.execute(f"""
+        INSERT INTO sqlite_sequence (name, seq) SELECT ?, (SELECT COALESCE(MAX(id), 0) FROM {table})
+        WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+    """, (table, table))
+    last = cursor.execute("UPDATE sqlite_sequence SET seq = seq + ? WHERE name = ? RETURNING seq", (count, table)).fetchone()[0]
+    return list(range(last - count + 1, last + 1))
+
+
+def sync_id_sequences(cursor):
+    """ Moves the PostgreSQL id sequences past rows inserted with explicit ids (no-op on SQLite) """
+    if not isinstance(cursor, PostgresCursor):
+        return
+    for table in ID_TABLES:
+        cursor.execute(f"""
+            SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table}
+        """)
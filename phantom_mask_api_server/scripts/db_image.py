@@ -0,0 +1,249 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from db_backend import connect, default_database, default_transaction_store, rebuild_transaction_store
+from db_setup import SCHEMA, setup_database
+from etl_pipeline import run_pipeline
+
+try:
+    import fcntl
+except ImportError:     # Windows: images are always copied
+    fcntl = None
+
+""" Prebuilt SQLite database image: built once (e.g. in the Docker build), installed in seconds at start
+
+build: loads the raw data into a new database (db_setup.py schema and indexes, ETL pipeline,
+columnar transaction store), runs ANALYZE and VACUUM, checks its integrity and writes
+manifest.json with the SHA-256 of every file of the image.
+
+install: puts the image in place of the server's database when there is none yet. The files are
+cloned (copy-on-write) where the file system supports it, otherwise copied, and the copies are
+checked against the manifest. The installed database records the manifest of its image
+(<database>.image.json), so later starts see that it matches and do nothing; no ETL runs at start.
+A database that was not installed from this image holds live data and is never replaced
+without --force. The image also seeds the read replica snapshot (REPLICA_SNAPSHOT_PATH) when
+there is none.
+
+Usage (from phantom_mask_api_server/):
+    python scripts/db_image.py build --output db_image
+    python scripts/db_image.py install --image db_image
+"""
+
+DATABASE_FILE = "phantom_mask_db.db"
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+# ioctl of Linux that clones a file (shares its blocks until one side writes them)
+FICLONE = 0x40049409
+
+
+def default_image_dir():
+    return os.environ.get("DATABASE_IMAGE_DIR", "db_image")
+
+
+def file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def image_files(directory):
+    """ Returns the files of an image folder, as paths relative to it (the store's lock file excluded) """
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.relpath(os.path.join(root, name), directory)
+            if name != "lock" and path != MANIFEST_FILE:
+                files.append(path.replace(os.sep, "/"))
+    return sorted(files)
+
+
+def build_image(output, pharmacies_data, users_data, workers=None):
+    """ Builds a database image from the raw data into output (replaced as a whole at the end)
+
+    Args:
+        output (str): Folder of the image.
+        pharmacies_data (str): Path of the raw pharmacy data.
+        users_data (str): Path of the raw user data.
+        workers (int | None): Worker processes of the ETL pipeline (defaults to the number of CPUs).
+
+    Returns:
+        dict: The manifest of the image.
+    """
+    partial = output.rstrip("/\\") + ".partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    database = os.path.join(partial, DATABASE_FILE)
+
+    setup_database(database)
+    conn = connect(database, "bulk")
+    try:
+        for dataset, data in (("pharmacies", pharmacies_data), ("users", users_data)):
+            stats = run_pipeline(dataset, data, conn, workers, restart=True)
+            print(f"Loaded {dataset}: " + ", ".join(f"{key} {stats[key]}" for key in sorted(stats)))
+        rebuild_transaction_store(conn, store_dir(database))
+
+        # statistics for the query planner, then a compact single file (no WAL) with its pages in order
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute("PRAGMA journal_mode = DELETE").fetchall()
+        conn.execute("VACUUM")
+        result = conn.execute("PRAGMA integrity_check").fetchall()
+        if result != [("ok",)]:
+            raise SystemExit(f"Integrity check of the image failed: {result}")
+    finally:
+        conn.close()
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "schema_sha256": hashlib.sha256(SCHEMA.encode("utf-8")).hexdigest(),
+        "sources": {os.path.basename(path): file_sha256(path) for path in (pharmacies_data, users_data)},
+        "files": {
+            path: {"size": os.path.getsize(os.path.join(partial, path)), "sha256": file_sha256(os.path.join(partial, path))}
+            for path in image_files(partial)
+        },
+    }
+    # identifies the image: same data and schema, same id
+    manifest["image_id"] = hashlib.sha256(
+        json.dumps([manifest["schema_sha256"], manifest["files"]], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    with open(os.path.join(partial, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(output, ignore_errors=True)
+    os.replace(partial, output)
+    return manifest
+
+
+def store_dir(database):
+    """ Folder of the transaction store that goes with a database file of an image """
+    return os.path.splitext(database)[0] + "_transactions"
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def clone_file(source, target):
+    """ Copies source to target, sharing its blocks (copy-on-write) when the file system can; returns True then """
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return True
+            except OSError:
+                pass
+        shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+        return False
+
+
+def copy_checked(image, path, target, manifest):
+    """ Copies a file of the image to target and checks the copy against the manifest """
+    clone_file(os.path.join(image, path), target)
+    expected = manifest["files"][path]
+    if os.path.getsize(target) != expected["size"] or file_sha256(target) != expected["sha256"]:
+        os.remove(target)
+        raise SystemExit(f"{path} of the image {image} doesn't match its manifest; rebuild the image")
+
+
+def install_image(image, database, transaction_store=None, replica=None, force=False):
+    """ Installs the image as the database, unless a database is already in place
+
+    Args:
+        image (str): Folder of the image.
+        database (str): Path of the server's SQLite database.
+        transaction_store (str | None): Folder of the server's transaction store (None: not installed).
+        replica (str | None): Path of the read replica snapshot, seeded when missing (None: no replica).
+        force (bool): Replace a database that was not installed from this image.
+
+    Returns:
+        str: "installed", "current" (the database was installed from this image) or "kept" (another database).
+    """
+    manifest = load_manifest(os.path.join(image, MANIFEST_FILE))
+    if manifest is None:
+        raise SystemExit(f"No database image in {image}; build it with: python scripts/db_image.py build")
+    marker = database + ".image.json"
+
+    if os.path.exists(database) and not force:
+        installed = load_manifest(marker)
+        if installed is not None and installed.get("image_id") == manifest["image_id"]:
+            return "current"
+        return "kept"
+
+    os.makedirs(os.path.dirname(database) or ".", exist_ok=True)
+    if transaction_store:
+        image_store = os.path.basename(store_dir(DATABASE_FILE))
+        partial_store = transaction_store.rstrip("/\\") + ".partial"
+        shutil.rmtree(partial_store, ignore_errors=True)
+        for path in manifest["files"]:
+            if path.startswith(image_store + "/"):
+                target = os.path.join(partial_store, *path.split("/")[1:])
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                copy_checked(image, path, target, manifest)
+        shutil.rmtree(transaction_store, ignore_errors=True)
+        os.replace(partial_store, transaction_store)
+
+    # the database comes last: once it is in place, the install is complete
+    partial = database + ".partial"
+    copy_checked(image, DATABASE_FILE, partial, manifest)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    with open(marker, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(partial, database)
+
+    if replica and (force or not os.path.exists(replica)):
+        # the image is in rollback journal mode, as the immutable snapshot connections require
+        copy_checked(image, DATABASE_FILE, replica + ".partial", manifest)
+        os.replace(replica + ".partial", replica)
+    return "installed"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a prebuilt SQLite database image, or install it.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="build the image from the raw data")
+    build.add_argument("--output", default=default_image_dir(), help="folder of the image (defaults to DATABASE_IMAGE_DIR or db_image)")
+    build.add_argument("--pharmacies", default="data/pharmacies.json", help="path of the raw pharmacy data")
+    build.add_argument("--users", default="data/users.json", help="path of the raw user data")
+    build.add_argument("--workers", type=int, default=None, help="worker processes of the ETL pipeline")
+
+    install = subparsers.add_parser("install", help="install the image when the server has no database yet")
+    install.add_argument("--image", default=default_image_dir(), help="folder of the image (defaults to DATABASE_IMAGE_DIR or db_image)")
+    install.add_argument("--db", default=default_database(), help="SQLite path of the server (defaults to DATABASE_PATH)")
+    install.add_argument("--replica", default=os.environ.get("REPLICA_SNAPSHOT_PATH"),
+                         help="read replica snapshot to seed (defaults to REPLICA_SNAPSHOT_PATH)")
+    install.add_argument("--force", action="store_true", help="replace a database that was not installed from this image")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    if args.command == "build":
+        manifest = build_image(args.output, args.pharmacies, args.users, args.workers)
+        size = sum(entry["size"] for entry in manifest["files"].values())
+        print(f"Image {args.output} built in {time.monotonic() - start:.1f} s ({size / 1e6:.1f} MB, id {manifest['image_id'][:12]})")
+        return
+
+    if os.environ.get("DATABASE_ENGINE", "sqlite") != "sqlite":
+        print("DATABASE_ENGINE is not sqlite; the database image is not used")
+        return
+    result = install_image(args.image, args.db, default_transaction_store(args.db), args.replica, args.force)
+    if result == "installed":
+        print(f"Database image {args.image} installed at {args.db} in {time.monotonic() - start:.2f} s")
+    elif result == "current":
+        print(f"{args.db} is up to date with the image {args.image}")
+    else:
+        print(f"{args.db} was not installed from the image {args.image} and is kept (--force replaces it)")
+
+
+if __name__ == "__main__":
+    main()
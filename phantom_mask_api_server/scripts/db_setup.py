@@ -1,14 +1,7 @@
+import argparse
 import sqlite3
 import os
-
-# Create a folder for the database if it doesn't exist
-folder_name = "db"
-if not os.path.exists(folder_name):
-    os.makedirs(folder_name)
-
-# SQLite connection 
-conn = sqlite3.connect(f"{folder_name}/phantom_mask_db.db")
-cursor = conn.cursor()
+from db_backend import PostgresConnection, default_database, is_postgres
 
 
 # cursor.executescript("""
@@ -19,8 +12,8 @@ cursor = conn.cursor()
 # # DROP TABLE IF EXISTS users;
 # # """)
 
-# create tables (users, pharmacies, masks, transactions, pharmacy_masks)
-cursor.executescript("""
+# create tables (users, pharmacies, masks, transactions, pharmacy_masks, etl_checkpoints, catalog_version, etl_record_hashes)
+SCHEMA = """
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT NOT NULL,
@@ -69,7 +62,123 @@ CREATE TABLE IF NOT EXISTS pharmacy_masks (
     FOREIGN KEY (mask_id) REFERENCES masks(id),
     FOREIGN KEY (pharmacy_id) REFERENCES pharmacies(id)
 );
-""")
 
-conn.commit()
-conn.close()
\ No newline at end of file
+CREATE TABLE IF NOT EXISTS etl_checkpoints (
+    source TEXT PRIMARY KEY,
+    byte_offset INTEGER NOT NULL,
+    records INTEGER NOT NULL,
+    file_size INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    updated_at DATETIME NOT NULL
+);
+
+-- single row counter of catalog changes (pharmacies, masks, prices, opening hours), keys the response cache
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT INTO catalog_version (id, version) VALUES (1, 1) ON CONFLICT DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS etl_record_hashes (
+    entity TEXT NOT NULL,
+    natural_key TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (entity, natural_key)
+);
+
+-- daily totals per pharmacy of the transactions up to last_transaction_id, compacted by the maintenance
+-- jobs (see phantom_mask/transaction_rollup.py); the ETL empties them when it reloads the transactions
+CREATE TABLE IF NOT EXISTS transaction_daily_totals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    day DATE NOT NULL,
+    pharmacy_id INTEGER NOT NULL,
+    transaction_amount REAL NOT NULL,
+    product_count INTEGER NOT NULL,
+    mask_count INTEGER NOT NULL,
+    UNIQUE (day, pharmacy_id)
+);
+
+CREATE TABLE IF NOT EXISTS transaction_rollup_watermark (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_transaction_id INTEGER NOT NULL
+);
+INSERT INTO transaction_rollup_watermark (id, last_transaction_id) VALUES (1, 0) ON CONFLICT DO NOTHING;
+
+-- changes of the transactions, written in the database transaction of each purchase and cancellation
+-- and read in id order by the consumers of phantom_mask/outbox.py, which record how far they got
+CREATE TABLE IF NOT EXISTS outbox_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at DATETIME NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS outbox_offsets (
+    consumer TEXT PRIMARY KEY,
+    last_event_id INTEGER NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+
+-- natural keys used by the incremental (upsert) ETL mode
+CREATE UNIQUE INDEX IF NOT EXISTS pharmacies_name_idx ON pharmacies (name);
+CREATE UNIQUE INDEX IF NOT EXISTS users_name_idx ON users (name);
+CREATE UNIQUE INDEX IF NOT EXISTS pharmacy_masks_pharmacy_mask_idx ON pharmacy_masks (pharmacy_id, mask_id);
+CREATE INDEX IF NOT EXISTS transactions_user_date_idx ON transactions (user_id, transaction_date);
+-- the sales of the day (see phantom_mask/sales_stream.py)
+CREATE INDEX IF NOT EXISTS transactions_date_idx ON transactions (transaction_date);
+CREATE INDEX IF NOT EXISTS etl_record_hashes_row_idx ON etl_record_hashes (entity, row_id);
+"""
+
+
+# PostgreSQL types of the SQLite column definitions above; ids stay assignable by the ETL
+POSTGRES_TYPES = [
+    ("INTEGER PRIMARY KEY AUTOINCREMENT", "BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY"),
+    ("INTEGER", "BIGINT"),
+    ("REAL", "DOUBLE PRECISION"),
+    ("DATETIME", "TIMESTAMPTZ"),
+]
+
+
+def postgres_schema():
+    """ Returns SCHEMA translated to PostgreSQL """
+    schema = SCHEMA
+    for sqlite_type, postgres_type in POSTGRES_TYPES:
+        schema = schema.replace(sqlite_type, postgres_type)
+    return schema
+
+
+def setup_database(database):
+    """ Creates all tables if they don't exist
+
+    Args:
+        database (str): SQLite path (its folder is created too), or PostgreSQL URL / conninfo string.
+    """
+    if is_postgres(database):
+        conn = PostgresConnection(database)
+        conn.execute(postgres_schema())
+        conn.commit()
+        conn.close()
+        return
+
+    # Create a folder for the database if it doesn't exist
+    folder_name = os.path.dirname(database)
+    if folder_name and not os.path.exists(folder_name):
+        os.makedirs(folder_name)
+
+    # SQLite connection 
+    conn = sqlite3.connect(database)
+    cursor = conn.cursor()
+    # free pages are given back to the file system by the maintenance jobs (PRAGMA incremental_vacuum);
+    # this only applies to a new database (an existing one has to be rebuilt with VACUUM first)
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.executescript(SCHEMA)
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the tables of the database.")
+    parser.add_argument("--db", default=default_database(),
+                        help="SQLite path or PostgreSQL URL (defaults to the DATABASE_* environment variables)")
+    setup_database(parser.parse_args().db)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+from collections import Counter
+from json_stream import iter_json_array
+
+""" Change detection helpers for incremental (upsert) ETL runs """
+
+
+def content_hash(content):
+    """ Returns a stable hash of a JSON-serializable record
+
+    Args:
+        content (object): The fields of a record that should trigger an update when they change.
+
+    Returns:
+        str: Hex digest of the canonical JSON form of content.
+    """
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ChangeTracker:
+    """
+    Compares records against the hashes stored by previous runs (etl_record_hashes)
+    and keeps track of the records seen in the current run, so that records removed
+    from the raw data can be deleted at the end.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.stats = Counter()
+        # keys seen in this run; a temp table keeps memory flat for large inputs
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS etl_seen (
+                entity TEXT NOT NULL,
+                natural_key TEXT NOT NULL,
+                PRIMARY KEY (entity, natural_key)
+            )
+        """)
+        cursor.execute("DELETE FROM etl_seen")
+
+    def check(self, entity, natural_key, content):
+        """ Marks a record as seen and compares it with its stored hash
+
+        Args:
+            entity (str): Record type (e.g. "pharmacy", "user", "transaction").
+            natural_key (str): Identifier of the record in the raw data.
+            content (object): The fields of the record to hash.
+
+        Returns:
+            tuple[int | None, str | None]: The stored row id of the record (None when it is new)
+                and the new hash when the record changed (None when it is unchanged).
+        """
+        self.cursor.execute("""
+            INSERT INTO etl_seen (entity, natural_key) VALUES (?, ?) ON CONFLICT DO NOTHING
+        """, (entity, natural_key))
+
+        new_hash = content_hash(content)
+        stored = self.cursor.execute("""
+            SELECT row_id, content_hash FROM etl_record_hashes WHERE entity = ? AND natural_key = ?
+        """, (entity, natural_key)).fetchone()
+
+        if stored is None:
+            self.stats[f"{entity}_inserted"] += 1
+            return None, new_hash
+        row_id, stored_hash = stored
+        if stored_hash == new_hash:
+            self.stats[f"{entity}_unchanged"] += 1
+            return row_id, None
+        self.stats[f"{entity}_updated"] += 1
+        return row_id, new_hash
+
+    def save(self, entity, natural_key, row_id, new_hash):
+        """ Stores the hash and row id of an inserted or updated record """
+        self.cursor.execute("""
+            INSERT INTO etl_record_hashes (entity, natural_key, row_id, content_hash)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (entity, natural_key) DO UPDATE SET
+                row_id = excluded.row_id, content_hash = excluded.content_hash
+        """, (entity, natural_key, row_id, new_hash))
+
+    def pop_unseen(self, entity):
+        """ Removes the stored hashes of records that were not seen in this run
+
+        Returns:
+            list[int]: Row ids of the records that disappeared from the raw data.
+        """
+        unseen = self.cursor.execute("""
+            SELECT h.natural_key, h.row_id FROM etl_record_hashes h
+            WHERE h.entity = ? AND NOT EXISTS (
+                SELECT 1 FROM etl_seen s WHERE s.entity = h.entity AND s.natural_key = h.natural_key
+            )
+        """, (entity,)).fetchall()
+        self.cursor.executemany("""
+            DELETE FROM etl_record_hashes WHERE entity = ? AND natural_key = ?
+        """, [(entity, natural_key) for natural_key, _ in unseen])
+        self.stats[f"{entity}_deleted"] += len(unseen)
+        return [row_id for _, row_id in unseen]
+
+    def report(self):
+        """ Prints the number of inserted, updated, unchanged and deleted records per entity """
+        for key in sorted(self.stats):
+            print(f"{key}: {self.stats[key]}")
+
+
+def incremental_load(conn, path, load_record, chunk_size=1000):
+    """ Streams the records of path into load_record, committing every chunk_size records
+
+    Returns:
+        int: Number of records processed.
+    """
+    processed = 0
+    for record, _ in iter_json_array(path):
+        load_record(record)
+        processed += 1
+        if processed % chunk_size == 0:
+            conn.commit()
+    conn.commit()
+    return processed
+
+
+def occurrence_keys(parts_list):
+    """ Builds natural keys for records that have no identifier of their own
+
+    Identical records get an occurrence suffix (0, 1, ...) so duplicates stay distinct.
+
+    Args:
+        parts_list (list[tuple[str, ...]]): The identifying fields of each record, in order.
+
+    Returns:
+        list[str]: One natural key per record.
+    """
+    seen = Counter()
+    keys = []
+    for parts in parts_list:
+        keys.append("\x1f".join((*parts, str(seen[parts]))))
+        seen[parts] += 1
+    return keys
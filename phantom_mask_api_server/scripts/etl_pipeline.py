@@ -0,0 +1,238 @@
+import argparse
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from db_backend import (PROFILES, bump_catalog_version, connect, default_database, default_transaction_store, insert_rows,
+                        rebuild_transaction_store, reserve_ids, reset_transaction_rollup)
+from json_stream import clear_source, iter_json_array, get_checkpoint, save_checkpoint
+from pharmacies_etl_script import parse_opening_hours, parse_mask_name
+
+""" Parallel ETL pipeline: a reader that shards the raw data, a process pool that parses and
+validates the shards into compact row tuples, and a single writer that bulk-inserts them in order (COPY on PostgreSQL) """
+
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+PHARMACY_COLUMNS = ["id", "name", "cash_balance"] + [f"{day.lower()}_{end}" for day in DAYS for end in ("open", "close")]
+
+
+def read_shards(path, shard_size, offset=0):
+    """ Yields (records, end_offset) shards of a top-level JSON array """
+    shard = []
+    for record, end_offset in iter_json_array(path, offset):
+        shard.append(record)
+        if len(shard) == shard_size:
+            yield shard, end_offset
+            shard = []
+    if shard:
+        yield shard, end_offset
+
+
+def parse_mask(mask_name):
+    """ Returns (mask_name, model, color, num_per_pack) or raises ValueError """
+    parsed = parse_mask_name(mask_name)
+    if parsed is None:
+        raise ValueError(f"Invalid mask name: {mask_name}")
+    return (mask_name, *parsed)
+
+
+def transform_pharmacies(shard):
+    """ Parses a shard of raw pharmacy records (runs in a worker process)
+
+    Returns:
+        tuple[list[tuple], list[str]]: Rows of (name, cash_balance, opening hours (14 values),
+            masks as (mask_name, model, color, num_per_pack, price)) and rejection messages.
+    """
+    rows, rejected = [], []
+    for pharmacy in shard:
+        try:
+            hours = parse_opening_hours(pharmacy["openingHours"])
+            rows.append((
+                pharmacy["name"],
+                float(pharmacy["cashBalance"]),
+                tuple(time for day in DAYS for time in hours[day]),
+                tuple((*parse_mask(mask["name"]), float(mask["price"])) for mask in pharmacy["masks"]),
+            ))
+        except (KeyError, TypeError, ValueError) as e:
+            rejected.append(f"pharmacy {pharmacy.get('name') if isinstance(pharmacy, dict) else pharmacy!r}: {e!r}")
+    return rows, rejected
+
+
+def transform_users(shard):
+    """ Parses a shard of raw user records (runs in a worker process)
+
+    Returns:
+        tuple[list[tuple], list[str]]: Rows of (name, cash_balance, purchase histories as
+            (pharmacy_name, mask_name, model, color, num_per_pack, amount, date)) and rejection messages.
+    """
+    rows, rejected = [], []
+    for user in shard:
+        try:
+            histories = []
+            for transaction in user["purchaseHistories"]:
+                # validate the date format but keep the original string
+                datetime.strptime(transaction["transactionDate"], "%Y-%m-%d %H:%M:%S")
+                histories.append((
+                    transaction["pharmacyName"],
+                    *parse_mask(transaction["maskName"]),
+                    float(transaction["transactionAmount"]),
+                    transaction["transactionDate"],
+                ))
+            rows.append((user["name"], float(user["cashBalance"]), tuple(histories)))
+        except (KeyError, TypeError, ValueError) as e:
+            rejected.append(f"user {user.get('name') if isinstance(user, dict) else user!r}: {e!r}")
+    return rows, rejected
+
+
+class Writer:
+    """ Single writer that assigns ids and bulk-inserts transformed rows (runs in the parent process) """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.stats = Counter()
+        self.mask_ids = dict(self.cursor.execute("SELECT name, id FROM masks"))
+        self.pharmacy_ids = None   # loaded on the first users shard
+
+    def _new_masks(self, masks):
+        """ Assigns ids to the masks that are not in the database yet and returns their rows """
+        new_masks = {}
+        for mask_name, model, color, num_per_pack in masks:
+            if mask_name not in self.mask_ids:
+                new_masks[mask_name] = (model, color, num_per_pack)
+        mask_ids = reserve_ids(self.cursor, "masks", len(new_masks))
+        self.mask_ids.update(zip(new_masks, mask_ids))
+        return [(mask_id, *new_masks[mask_name], mask_name) for mask_name, mask_id in zip(new_masks, mask_ids)]
+
+    def write_pharmacies(self, rows):
+        new_masks = self._new_masks(mask[:4] for *_, masks in rows for mask in masks)
+        pharmacy_rows, pharmacy_mask_rows = [], []
+        for pharmacy_id, (name, cash_balance, hours, masks) in zip(reserve_ids(self.cursor, "pharmacies", len(rows)), rows):
+            pharmacy_rows.append((pharmacy_id, name, cash_balance, *hours))
+            for mask_name, model, color, num_per_pack, price in masks:
+                pharmacy_mask_rows.append((self.mask_ids[mask_name], pharmacy_id, price))
+
+        insert_rows(self.cursor, "pharmacies", PHARMACY_COLUMNS, pharmacy_rows)
+        insert_rows(self.cursor, "masks", ["id", "model", "color", "num_per_pack", "name"], new_masks)
+        insert_rows(self.cursor, "pharmacy_masks", ["mask_id", "pharmacy_id", "price"], pharmacy_mask_rows)
+        self.stats.update(pharmacies=len(pharmacy_rows), masks=len(new_masks), pharmacy_masks=len(pharmacy_mask_rows))
+
+    def write_users(self, rows):
+        if self.pharmacy_ids is None:
+            self.pharmacy_ids = dict(self.cursor.execute("SELECT name, id FROM pharmacies"))
+        user_rows, transaction_rows = [], []
+        for user_id, (name, cash_balance, histories) in zip(reserve_ids(self.cursor, "users", len(rows)), rows):
+            user_rows.append((user_id, name, cash_balance))
+            for pharmacy_name, mask_name, model, color, num_per_pack, amount, date in histories:
+                pharmacy_id = self.pharmacy_ids.get(pharmacy_name)
+                mask_id = self.mask_ids.get(mask_name)
+                if pharmacy_id is None or mask_id is None:
+                    print(f"{name}, Pharmacy or mask not found: {pharmacy_name}, {mask_name}")
+                    self.stats["skipped_transactions"] += 1
+                    continue
+                transaction_rows.append((user_id, pharmacy_id, mask_id, amount, date))
+
+        insert_rows(self.cursor, "users", ["id", "name", "cash_balance"], user_rows)
+        insert_rows(self.cursor, "transactions",
+                    ["user_id", "pharmacy_id", "mask_id", "transaction_amount", "transaction_date"], transaction_rows)
+        self.stats.update(users=len(user_rows), transactions=len(transaction_rows))
+
+
+TRANSFORMS = {
+    "pharmacies": (transform_pharmacies, Writer.write_pharmacies),
+    "users": (transform_users, Writer.write_users),
+}
+
+
+def run_pipeline(dataset, data_path, conn, workers=None, shard_size=1000, restart=False):
+    """ Loads a raw dataset through the reader -> process pool -> writer pipeline
+
+    Shards are committed in input order together with a checkpoint, using the same
+    etl_checkpoints entries as the --stream mode of the ETL scripts.
+
+    Args:
+        dataset (str): "pharmacies" or "users" (load pharmacies first).
+        data_path (str): Path of the raw JSON file.
+        conn (sqlite3.Connection | PostgresConnection): Database connection used by the writer.
+        workers (int | None): Number of worker processes (defaults to the number of CPUs).
+        shard_size (int): Records per shard and per commit.
+        restart (bool): Delete the rows loaded before (see clear_source) and load from the beginning.
+
+    Returns:
+        Counter: Number of rows written per table and of rejected records.
+    """
+    transform, write = TRANSFORMS[dataset]
+    workers = workers or os.cpu_count() or 1
+    writer = Writer(conn)
+    file_size = os.path.getsize(data_path)
+
+    offset, records = 0, 0
+    if restart:
+        clear_source(writer.cursor, dataset)
+    checkpoint = None if restart else get_checkpoint(writer.cursor, dataset)
+    if checkpoint:
+        offset, records, checkpoint_size, completed = checkpoint
+        if checkpoint_size != file_size:
+            raise SystemExit(f"{data_path} changed since the last checkpoint of '{dataset}'; rerun with --restart")
+        if completed:
+            print(f"'{dataset}' is already loaded ({records} records); rerun with --restart to load it again")
+            return writer.stats
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()   # (future, shard length, end offset) in input order
+        shards = read_shards(data_path, shard_size, offset)
+
+        def drain_one():
+            nonlocal offset, records
+            future, length, offset = pending.popleft()
+            rows, rejected = future.result()
+            for message in rejected:
+                print(f"Rejected {message}")
+            writer.stats["rejected"] += len(rejected)
+            write(writer, rows)
+            records += length
+            save_checkpoint(writer.cursor, dataset, offset, records, file_size)
+            conn.commit()
+
+        for shard, end_offset in shards:
+            # keep a bounded number of shards in flight so memory stays flat
+            if len(pending) >= 2 * workers:
+                drain_one()
+            pending.append((pool.submit(transform, shard), len(shard), end_offset))
+        while pending:
+            drain_one()
+
+    if dataset == "pharmacies":
+        bump_catalog_version(writer.cursor)
+    save_checkpoint(writer.cursor, dataset, offset, records, file_size, completed=True)
+    conn.commit()
+    return writer.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load raw data with a parallel transform stage.")
+    parser.add_argument("dataset", choices=sorted(TRANSFORMS), help="dataset to load (load pharmacies first)")
+    parser.add_argument("--data", help="path of the raw data (defaults to data/<dataset>.json)")
+    parser.add_argument("--db", default=default_database(),
+                        help="SQLite path or PostgreSQL URL (defaults to the DATABASE_* environment variables)")
+    parser.add_argument("--profile", default="bulk", choices=sorted(PROFILES), help="PRAGMA profile of the connection")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (defaults to the CPU count)")
+    parser.add_argument("--shard-size", type=int, default=1000, help="records per shard and per commit")
+    parser.add_argument("--restart", action="store_true",
+                        help="delete the rows and the checkpoint of a previous run and load from the top")
+    parser.add_argument("--transaction-store",
+                        help="folder of the columnar transaction store to rebuild (defaults to the one of the database)")
+    args = parser.parse_args()
+
+    conn = connect(args.db, args.profile)
+    stats = run_pipeline(args.dataset, args.data or f"data/{args.dataset}.json", conn,
+                         args.workers, args.shard_size, args.restart)
+    if args.dataset == "users":
+        reset_transaction_rollup(conn)
+        rebuild_transaction_store(conn, args.transaction_store or default_transaction_store(args.db))
+    conn.close()
+    for key in sorted(stats):
+        print(f"{key}: {stats[key]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import json
+import math
+import os
+import random
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+""" Generates deterministic synthetic raw data (pharmacies.json and users.json) for scale testing
+
+The files use the exact format of the sample data, including the mixed openingHours formats
+and the "Model (color) (N per pack)" mask names. Records are written one at a time, so memory
+only grows with the number of pharmacies, never with the number of users or transactions.
+"""
+
+MASK_MODELS = ["True Barrier", "MaskT", "Second Smile", "Cotton Kiss", "Masquerade"]
+MASK_COLORS = ["green", "blue", "black"]
+PACK_SIZES = [3, 6, 10]
+PRICE_PER_PIECE = (0.9, 4.9)   # price range of a single mask
+
+NAME_PARTS = (
+    ["Keystone", "Medlife", "Carepoint", "Welltrack", "Centrico", "Foundation", "Acculife", "Blink", "Cool",
+     "First", "Health", "Prime", "Sunrise", "Harbor", "Summit", "Green Cross", "Union", "Riverside"],
+    ["Pharmacy", "Drug Stores", "Rx", "Care", "Wellness", "Health Mart", "Apothecary", "Chemist", "Drug"],
+)
+FIRST_NAMES = ["Yvonne", "Ada", "Geneva", "Lester", "Violet", "Bertha", "Sherri", "Timothy", "Marilyn", "Eric",
+               "Ismael", "Robyn", "Winifred", "Willie", "Marlon", "Holly", "Wilbert", "Felipe", "Pamela", "Bonnie"]
+LAST_NAMES = ["Guerrero", "Larson", "Floyd", "Arnold", "Bush", "Guzman", "Lynch", "Schultz", "Cruz", "Underwood",
+              "Cole", "Wilson", "Steele", "Moran", "Watson", "Thompson", "Love", "Gibson", "French", "Malone"]
+
+# opening hours formats found in the sample data (ranges, lists, several periods, past midnight)
+OPENING_HOURS = [
+    "Mon - Fri 08:00 - 17:00",
+    "Mon - Fri 08:00 - 17:00 / Sat, Sun 08:00 - 12:00",
+    "Mon, Wed, Fri 08:00 - 12:00 / Tue, Thur 14:00 - 18:00",
+    "Mon - Wed 08:00 - 17:00 / Thur, Sat 20:00 - 02:00",
+    "Mon, Wed, Fri 20:00 - 02:00",
+    "Fri - Sun 20:00 - 02:00",
+    "Mon - Sun 09:00 - 21:00",
+    "Tue - Sat 10:00 - 19:30 / Sun, Mon 12:00 - 16:00",
+]
+
+
+def zipf_cum_weights(n, exponent):
+    """ Cumulative Zipf weights for n ranked items, so a few items get most of the traffic """
+    return list(accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def unique_names(rng, count, parts):
+    """ Yields count distinct names, one at a time
+
+    The combinations of parts come first, in a random order; after them a combination is numbered
+    with the position of the name, which never repeats. Only the combinations are kept in memory.
+
+    Args:
+        rng (random.Random): Generator of the dataset.
+        count (int): Number of names.
+        parts (tuple[list[str], list[str]]): Words combined into "first second".
+
+    Yields:
+        str: The names.
+    """
+    combinations = [f"{first} {second}" for first in parts[0] for second in parts[1]]
+    rng.shuffle(combinations)
+    for i in range(count):
+        name = combinations[i % len(combinations)]
+        yield name if i < len(combinations) else f"{name} {i}"
+
+
+class JsonArrayWriter:
+    """ Writes records to a JSON array file one at a time, formatted like json.dump(indent=2) """
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, record):
+        self.file.write(",\n" if self.count else "[\n")
+        self.file.write("\n".join("  " + line for line in json.dumps(record, indent=2).split("\n")))
+        self.count += 1
+
+    def close(self):
+        self.file.write("\n]" if self.count else "[]")
+        self.file.close()
+
+
+def generate(output_dir, pharmacies=20, users=20, transactions_per_user=5.0, seed=42,
+             start_date="2021-01-01", days=31, pharmacy_skew=1.1):
+    """ Writes pharmacies.json and users.json into output_dir
+
+    Args:
+        output_dir (str): Folder of the generated files.
+        pharmacies (int): Number of pharmacies.
+        users (int): Number of users.
+        transactions_per_user (float): Mean length of a purchase history; lengths are
+            log-normally distributed, so a few heavy buyers have very long histories.
+        seed (int): Random seed; the same arguments always produce the same files.
+        start_date (str): First day of the purchase histories (YYYY-MM-DD).
+        days (int): Number of days covered by the purchase histories.
+        pharmacy_skew (float): Zipf exponent of pharmacy popularity (0 is uniform).
+
+    Returns:
+        dict[str, int]: Number of generated pharmacies, users and transactions.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    mask_names = [f"{model} ({color}) ({pack} per pack)"
+                  for model in MASK_MODELS for color in MASK_COLORS for pack in PACK_SIZES]
+    pack_sizes = {name: int(name.rsplit("(", 1)[1].split()[0]) for name in mask_names}
+
+    # pharmacies: the catalog is kept in memory to draw purchases from it
+    pharmacy_names = unique_names(rng, pharmacies, NAME_PARTS)
+    catalog = []
+    writer = JsonArrayWriter(os.path.join(output_dir, "pharmacies.json"))
+    for name in pharmacy_names:
+        masks = [{"name": mask_name, "price": round(pack_sizes[mask_name] * rng.uniform(*PRICE_PER_PIECE), 2)}
+                 for mask_name in rng.sample(mask_names, rng.randint(1, 10))]
+        catalog.append((name, tuple((mask["name"], mask["price"]) for mask in masks)))
+        writer.write({
+            "name": name,
+            "cashBalance": round(rng.uniform(100, 1000), 2),
+            "openingHours": rng.choice(OPENING_HOURS),
+            "masks": masks,
+        })
+    writer.close()
+
+    # popular pharmacies get most purchases; ranks are shuffled so they are not the first records
+    popularity = list(range(pharmacies))
+    rng.shuffle(popularity)
+    cum_weights = zipf_cum_weights(pharmacies, pharmacy_skew)
+    total_weight = cum_weights[-1]
+
+    # log-normal history lengths with the requested mean (sigma controls how heavy the tail is)
+    sigma = 1.0
+    mu = math.log(max(transactions_per_user, 1e-9)) - sigma ** 2 / 2
+    first_day = datetime.strptime(start_date, "%Y-%m-%d")
+    seconds = days * 24 * 3600
+
+    transactions = 0
+    writer = JsonArrayWriter(os.path.join(output_dir, "users.json"))
+    for name in unique_names(rng, users, (FIRST_NAMES, LAST_NAMES)):
+        count = int(rng.lognormvariate(mu, sigma) + 0.5) if transactions_per_user > 0 else 0
+        dates = sorted(rng.randrange(seconds) for _ in range(count))
+        histories = []
+        for offset in dates:
+            pharmacy_name, masks = catalog[popularity[bisect(cum_weights, rng.random() * total_weight)]]
+            mask_name, price = rng.choice(masks)
+            histories.append({
+                "pharmacyName": pharmacy_name,
+                "maskName": mask_name,
+                "transactionAmount": round(price * rng.randint(1, 3), 2),
+                "transactionDate": (first_day + timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        transactions += count
+        writer.write({"name": name, "cashBalance": round(rng.uniform(100, 1000), 2), "purchaseHistories": histories})
+    writer.close()
+
+    return {"pharmacies": pharmacies, "users": users, "transactions": transactions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic raw data for scale testing.")
+    parser.add_argument("--output-dir", default="data/synthetic", help="folder of the generated files")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="size relative to the sample data (20 pharmacies, 20 users, 100 transactions)")
+    parser.add_argument("--pharmacies", type=int, help="number of pharmacies (overrides --scale)")
+    parser.add_argument("--users", type=int, help="number of users (overrides --scale)")
+    parser.add_argument("--transactions-per-user", type=float, default=5.0, help="mean purchase history length")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument("--start-date", default="2021-01-01", help="first day of the purchase histories")
+    parser.add_argument("--days", type=int, default=31, help="number of days covered by the purchase histories")
+    parser.add_argument("--pharmacy-skew", type=float, default=1.1, help="Zipf exponent of pharmacy popularity")
+    args = parser.parse_args()
+
+    counts = generate(
+        args.output_dir,
+        pharmacies=args.pharmacies or max(1, round(20 * args.scale)),
+        users=args.users or max(1, round(20 * args.scale)),
+        transactions_per_user=args.transactions_per_user,
+        seed=args.seed,
+        start_date=args.start_date,
+        days=args.days,
+        pharmacy_skew=args.pharmacy_skew,
+    )
+    print(", ".join(f"{key}: {value}" for key, value in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import codecs
+import json
+import os
+
+""" Incremental reader for JSON files whose top level is an array of records """
+
+READ_SIZE = 64 * 1024   # bytes read from disk per refill
+WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(path, offset=0, read_size=READ_SIZE):
+    """ Yields the records of a top-level JSON array one at a time
+
+    Only the current record and one read buffer are kept in memory, so peak memory
+    does not depend on the size of the file.
+
+    Args:
+        path (str): Path to a JSON file containing a top-level array.
+        offset (int): Byte offset returned with a previously yielded record;
+            reading resumes with the record that follows it (0 starts from the top).
+        read_size (int): Number of bytes read from disk per refill.
+
+    Yields:
+        tuple[object, int]: The decoded record and the byte offset right after it.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        buf = ""        # decoded text not consumed yet
+        idx = 0         # read position in buf
+        counted = 0     # chars of buf whose bytes are included in consumed
+        consumed = offset   # byte offset of buf[counted] in the file
+        eof = False
+        state = "start" if offset == 0 else "after_value"
+
+        def byte_offset():
+            # file offset of buf[idx]; only the text read since the last call is encoded
+            nonlocal consumed, counted
+            consumed += len(buf[counted:idx].encode("utf-8"))
+            counted = idx
+            return consumed
+
+        def refill():
+            nonlocal buf, idx, counted, eof
+            # drop the consumed prefix before reading more
+            byte_offset()
+            buf = buf[idx:]
+            idx = 0
+            counted = 0
+            chunk = f.read(read_size)
+            if not chunk:
+                eof = True
+                buf += text_decoder.decode(b"", final=True)
+            else:
+                buf += text_decoder.decode(chunk)
+
+        while True:
+            # skip whitespace between tokens
+            while idx < len(buf) and buf[idx] in WHITESPACE:
+                idx += 1
+            if idx >= len(buf):
+                if eof:
+                    raise ValueError(f"Unexpected end of file in {path}")
+                refill()
+                continue
+
+            char = buf[idx]
+            if state == "start":
+                if char != "[":
+                    raise ValueError(f"Expected a top-level JSON array in {path}")
+                idx += 1
+                state = "first_value"
+            elif state in ("first_value", "value"):
+                if state == "first_value" and char == "]":
+                    return
+                try:
+                    record, end = decoder.raw_decode(buf, idx)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    refill()
+                    continue
+                # a value ending exactly at the buffer end may be truncated (e.g. numbers)
+                if end == len(buf) and not eof:
+                    refill()
+                    continue
+                idx = end
+                state = "after_value"
+                yield record, byte_offset()
+            elif state == "after_value":
+                if char == ",":
+                    idx += 1
+                    state = "value"
+                elif char == "]":
+                    return
+                else:
+                    raise ValueError(f"Expected ',' or ']' at byte {byte_offset()} in {path}")
+
+
+def get_checkpoint(cursor, source):
+    """ Returns the stored checkpoint of a source as (byte_offset, records, file_size, completed) or None """
+    return cursor.execute("""
+        SELECT byte_offset, records, file_size, completed FROM etl_checkpoints WHERE source = ?
+    """, (source,)).fetchone()
+
+
+def save_checkpoint(cursor, source, byte_offset, records, file_size, completed=False):
+    """ Stores the progress of a source; call it inside the transaction of the chunk it covers """
+    cursor.execute("""
+        INSERT INTO etl_checkpoints (source, byte_offset, records, file_size, completed, updated_at)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (source) DO UPDATE SET
+            byte_offset = excluded.byte_offset, records = excluded.records,
+            file_size = excluded.file_size, completed = excluded.completed,
+            updated_at = excluded.updated_at
+    """, (source, byte_offset, records, file_size, int(completed)))
+
+
+# tables loaded for a source, children first, and the entities of the incremental ETL that refer to their rows
+SOURCE_TABLES = {
+    "pharmacies": (["pharmacy_masks", "pharmacies"], ["pharmacy"]),
+    "users": (["transactions", "users"], ["user", "transaction"]),
+}
+
+
+def clear_source(cursor, source):
+    """ Deletes the rows loaded for a source and its checkpoint, so it can be loaded again from the top
+
+    Call it inside the transaction of the first chunk, so an interrupted restart leaves the
+    previous rows in place. The masks are kept: they are shared with the purchase histories.
+    """
+    if source == "pharmacies" and cursor.execute("SELECT 1 FROM transactions LIMIT 1").fetchone():
+        raise SystemExit("Transactions refer to the loaded pharmacies; load everything again into a new database "
+                         "instead of restarting 'pharmacies'")
+    tables, entities = SOURCE_TABLES[source]
+    for table in tables:
+        cursor.execute(f"DELETE FROM {table}")
+    cursor.execute(f"DELETE FROM etl_record_hashes WHERE entity IN ({', '.join('?' * len(entities))})", entities)
+    cursor.execute("DELETE FROM etl_checkpoints WHERE source = ?", (source,))
+
+
+def stream_load(conn, source, path, load_record, chunk_size=1000, restart=False):
+    """ Streams the records of path into load_record and commits them in chunks
+
+    Every commit also stores the byte offset of the last loaded record, so an
+    interrupted load resumes from the last committed chunk.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        source (str): Checkpoint key of the load (e.g. "users").
+        path (str): JSON file with a top-level array of records.
+        load_record (Callable[[dict], None]): Inserts a single record.
+        chunk_size (int): Number of records per transaction.
+        restart (bool): Delete the rows loaded before (see clear_source) and load from the beginning.
+
+    Returns:
+        int: Number of records loaded by this call.
+    """
+    cursor = conn.cursor()
+    file_size = os.path.getsize(path)
+    offset, records = 0, 0
+
+    if restart:
+        clear_source(cursor, source)
+    checkpoint = None if restart else get_checkpoint(cursor, source)
+    if checkpoint:
+        offset, records, checkpoint_size, completed = checkpoint
+        if checkpoint_size != file_size:
+            raise SystemExit(f"{path} changed since the last checkpoint of '{source}'; rerun with --restart")
+        if completed:
+            print(f"'{source}' is already loaded ({records} records); rerun with --restart to load it again")
+            return 0
+        print(f"Resuming '{source}' after {records} records (byte {offset})")
+
+    loaded = 0
+    for record, offset in iter_json_array(path, offset):
+        load_record(record)
+        loaded += 1
+        if loaded % chunk_size == 0:
+            save_checkpoint(cursor, source, offset, records + loaded, file_size)
+            conn.commit()
+
+    save_checkpoint(cursor, source, offset, records + loaded, file_size, completed=True)
+    conn.commit()
+    return loaded
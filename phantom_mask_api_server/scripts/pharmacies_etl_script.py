@@ -1,16 +1,14 @@
+import argparse
 import json
-import sqlite3
 import re
+from db_backend import PROFILES, bump_catalog_version, connect, default_database
+from json_stream import stream_load
+from etl_incremental import ChangeTracker, incremental_load
 
-""" ETL script to extract, transform and load pharmacy data from JSON file into SQLite database """
+""" ETL script to extract, transform and load pharmacy data from JSON file into the database (SQLite or PostgreSQL) """
 
-# read json data
-with open("data/pharmacies.json", "r", encoding="utf-8") as f:
-    pharmacies_data = json.load(f)
-
-# SQLite connection
-conn = sqlite3.connect("db/phantom_mask_db.db")
-cursor = conn.cursor()
+cursor = None
+tracker = None
 
 def parse_opening_hours(opening_hours):
     """ Parses an opening hours string and converts it into a structured format
@@ -69,56 +67,161 @@ def parse_mask_name(mask_name):
     #     raise ValueError("Invalid mask name format")
 
 # insert data
-def insert_pharmacy_data():
-    for pharmacy in pharmacies_data:
-        hours = parse_opening_hours(pharmacy["openingHours"])
-        # insert pharmacy name, cash balance, and opening hours
+def insert_pharmacy(pharmacy):
+    """ Inserts a pharmacy record with its masks and returns the pharmacy id """
+    hours = parse_opening_hours(pharmacy["openingHours"])
+    # insert pharmacy name, cash balance, and opening hours
+    cursor.execute("""
+        INSERT INTO pharmacies (name, cash_balance, 
+        mon_open, mon_close, tue_open, tue_close, wed_open, wed_close, 
+        thu_open, thu_close, fri_open, fri_close, sat_open, sat_close, 
+        sun_open, sun_close)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING id
+    """, (
+        pharmacy["name"], pharmacy["cashBalance"],
+        hours["Mon"][0], hours["Mon"][1], hours["Tue"][0], hours["Tue"][1],
+        hours["Wed"][0], hours["Wed"][1], hours["Thu"][0], hours["Thu"][1],
+        hours["Fri"][0], hours["Fri"][1], hours["Sat"][0], hours["Sat"][1],
+        hours["Sun"][0], hours["Sun"][1]
+    ))
+    pharmacy_id = cursor.fetchone()[0]
+
+    for mask in pharmacy["masks"]:
+        mask_id = insert_mask(mask["name"])
         cursor.execute("""
-            INSERT INTO pharmacies (name, cash_balance, 
-            mon_open, mon_close, tue_open, tue_close, wed_open, wed_close, 
-            thu_open, thu_close, fri_open, fri_close, sat_open, sat_close, 
-            sun_open, sun_close)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            pharmacy["name"], pharmacy["cashBalance"],
-            hours["Mon"][0], hours["Mon"][1], hours["Tue"][0], hours["Tue"][1],
-            hours["Wed"][0], hours["Wed"][1], hours["Thu"][0], hours["Thu"][1],
-            hours["Fri"][0], hours["Fri"][1], hours["Sat"][0], hours["Sat"][1],
-            hours["Sun"][0], hours["Sun"][1]
-        ))
-
-def insert_masks_data():
-    for pharmacy in pharmacies_data:
-        for mask in pharmacy["masks"]:
-            model, color, num_per_pack = parse_mask_name(mask["name"])
-            cursor.execute("""
-                INSERT OR IGNORE INTO masks (model, color, num_per_pack, name)
-                VALUES (?, ?, ?, ?)
-            """, (model, color, num_per_pack, mask["name"]))
-
-def insert_pharmacy_masks_data():
-    for pharmacy in pharmacies_data:
-        pharmacy_id = cursor.execute("""
-            SELECT id FROM pharmacies WHERE name = ?""", (pharmacy["name"],)
-        ).fetchone()[0]
+            INSERT INTO pharmacy_masks (mask_id, pharmacy_id, price)
+            VALUES (?, ?, ?) """, (mask_id, pharmacy_id, mask["price"])
+        )
 
-        for mask in pharmacy["masks"]:
-            model, color, num_per_pack = parse_mask_name(mask["name"])
-            cursor.execute("""
-                SELECT id FROM masks WHERE model = ? AND color = ? AND num_per_pack = ?
-            """, (model, color, num_per_pack))
-            mask_id = cursor.fetchone()[0]
-            price = mask["price"]
-            cursor.execute("""
-                INSERT INTO pharmacy_masks (mask_id, pharmacy_id, price)
-                VALUES (?, ?, ?) """, (mask_id, pharmacy_id, price)
-            )
-            
-insert_pharmacy_data()
-insert_masks_data()
-insert_pharmacy_masks_data()
-
-conn.commit()
-conn.close()
+    return pharmacy_id
 
+mask_ids = {}   # mask name -> id, bounded by the number of distinct masks
 
+def insert_mask(mask_name):
+    """ Inserts a mask if it does not exist yet and returns its id """
+    if mask_name not in mask_ids:
+        model, color, num_per_pack = parse_mask_name(mask_name)
+        cursor.execute("""
+            INSERT INTO masks (model, color, num_per_pack, name)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (name) DO NOTHING
+        """, (model, color, num_per_pack, mask_name))
+        mask_ids[mask_name] = cursor.execute(
+            "SELECT id FROM masks WHERE name = ?", (mask_name,)
+        ).fetchone()[0]
+    return mask_ids[mask_name]
+
+def upsert_pharmacy(pharmacy):
+    """ Inserts or updates a pharmacy and its mask prices when the record changed since the last run """
+    # the cash balance is set on insert only: purchases change it in the database afterwards
+    content = {
+        "openingHours": pharmacy["openingHours"],
+        "masks": [[mask["name"], mask["price"]] for mask in pharmacy["masks"]],
+    }
+    pharmacy_id, new_hash = tracker.check("pharmacy", pharmacy["name"], content)
+    if new_hash is None:
+        return pharmacy_id
+
+    hours = parse_opening_hours(pharmacy["openingHours"])
+    pharmacy_id = cursor.execute("""
+        INSERT INTO pharmacies (name, cash_balance, 
+        mon_open, mon_close, tue_open, tue_close, wed_open, wed_close, 
+        thu_open, thu_close, fri_open, fri_close, sat_open, sat_close, 
+        sun_open, sun_close)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET
+            mon_open = excluded.mon_open, mon_close = excluded.mon_close,
+            tue_open = excluded.tue_open, tue_close = excluded.tue_close,
+            wed_open = excluded.wed_open, wed_close = excluded.wed_close,
+            thu_open = excluded.thu_open, thu_close = excluded.thu_close,
+            fri_open = excluded.fri_open, fri_close = excluded.fri_close,
+            sat_open = excluded.sat_open, sat_close = excluded.sat_close,
+            sun_open = excluded.sun_open, sun_close = excluded.sun_close
+        RETURNING id
+    """, (
+        pharmacy["name"], pharmacy["cashBalance"],
+        hours["Mon"][0], hours["Mon"][1], hours["Tue"][0], hours["Tue"][1],
+        hours["Wed"][0], hours["Wed"][1], hours["Thu"][0], hours["Thu"][1],
+        hours["Fri"][0], hours["Fri"][1], hours["Sat"][0], hours["Sat"][1],
+        hours["Sun"][0], hours["Sun"][1]
+    )).fetchone()[0]
+
+    # sync the mask prices of the pharmacy
+    mask_ids_of_pharmacy = []
+    for mask in pharmacy["masks"]:
+        mask_id = insert_mask(mask["name"])
+        mask_ids_of_pharmacy.append(mask_id)
+        cursor.execute("""
+            INSERT INTO pharmacy_masks (mask_id, pharmacy_id, price)
+            VALUES (?, ?, ?)
+            ON CONFLICT (pharmacy_id, mask_id) DO UPDATE SET price = excluded.price
+        """, (mask_id, pharmacy_id, mask["price"]))
+    if mask_ids_of_pharmacy:
+        cursor.execute(f"""
+            DELETE FROM pharmacy_masks
+            WHERE pharmacy_id = ? AND mask_id NOT IN ({", ".join("?" * len(mask_ids_of_pharmacy))})
+        """, (pharmacy_id, *mask_ids_of_pharmacy))
+    else:
+        cursor.execute("DELETE FROM pharmacy_masks WHERE pharmacy_id = ?", (pharmacy_id,))
+
+    tracker.save("pharmacy", pharmacy["name"], pharmacy_id, new_hash)
+    return pharmacy_id
+
+def delete_removed_pharmacies():
+    """ Deletes pharmacies that disappeared from the raw data (kept while transactions refer to them) """
+    for pharmacy_id in tracker.pop_unseen("pharmacy"):
+        cursor.execute("DELETE FROM pharmacy_masks WHERE pharmacy_id = ?", (pharmacy_id,))
+        cursor.execute("""
+            DELETE FROM pharmacies WHERE id = ?
+            AND NOT EXISTS (SELECT 1 FROM transactions WHERE pharmacy_id = pharmacies.id)
+        """, (pharmacy_id,))
+        if cursor.rowcount == 0:
+            print(f"Pharmacy {pharmacy_id} was removed from the raw data but is kept for its transactions")
+
+
+def main():
+    global cursor, tracker
+
+    parser = argparse.ArgumentParser(description="Load pharmacy data into the database.")
+    parser.add_argument("--data", default="data/pharmacies.json", help="path of the raw pharmacy data")
+    parser.add_argument("--db", default=default_database(),
+                        help="SQLite path or PostgreSQL URL (defaults to the DATABASE_* environment variables)")
+    parser.add_argument("--profile", default="bulk", choices=sorted(PROFILES), help="PRAGMA profile of the connection")
+    parser.add_argument("--stream", action="store_true",
+                        help="parse the file incrementally and commit in chunks with resumable checkpoints")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="records per commit in --stream and --incremental mode")
+    parser.add_argument("--restart", action="store_true",
+                        help="delete the rows and the checkpoint of a previous --stream run and load from the top")
+    parser.add_argument("--incremental", action="store_true",
+                        help="upsert only records that changed since the last run and delete removed ones")
+    args = parser.parse_args()
+
+    # SQLite or PostgreSQL connection
+    conn = connect(args.db, args.profile)
+    cursor = conn.cursor()
+
+    if args.incremental:
+        tracker = ChangeTracker(cursor)
+        incremental_load(conn, args.data, upsert_pharmacy, args.chunk_size)
+        delete_removed_pharmacies()
+        conn.commit()
+        tracker.report()
+    elif args.stream:
+        stream_load(conn, "pharmacies", args.data, insert_pharmacy, args.chunk_size, args.restart)
+    else:
+        # read json data
+        with open(args.data, "r", encoding="utf-8") as f:
+            pharmacies_data = json.load(f)
+
+        for pharmacy in pharmacies_data:
+            insert_pharmacy(pharmacy)
+        conn.commit()
+
+    bump_catalog_version(cursor)
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
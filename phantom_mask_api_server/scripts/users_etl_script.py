@@ -1,17 +1,15 @@
+import argparse
 import json
-import sqlite3
 import re
 from datetime import datetime
+from db_backend import PROFILES, connect, default_database, default_transaction_store, rebuild_transaction_store, reset_transaction_rollup, sync_id_sequences
+from json_stream import stream_load
+from etl_incremental import ChangeTracker, incremental_load, occurrence_keys
 
-""" ETL script to extract, transform and load user data from JSON file into SQLite database """
+""" ETL script to extract, transform and load user data from JSON file into the database (SQLite or PostgreSQL) """
 
-# read json data
-with open("data/users.json", "r", encoding="utf-8") as f:
-    users_data = json.load(f)
-
-# SQLite connection
-conn = sqlite3.connect("db/phantom_mask_db.db")
-cursor = conn.cursor()
+cursor = None
+tracker = None
 
 def parse_mask_name(mask_name):
     """Parses a mask name string and extracts model, color and num_per_pack
@@ -29,43 +27,175 @@ def parse_mask_name(mask_name):
     # else:
     #     raise ValueError("Invalid mask name format")
 
+# pharmacy and mask ids looked up so far, bounded by the size of the catalog
+pharmacy_ids = {}
+mask_ids = {}
+
+def get_pharmacy_id(pharmacy_name):
+    if pharmacy_name not in pharmacy_ids:
+        cursor.execute("SELECT id FROM pharmacies WHERE name = ?", (pharmacy_name,))
+        pharmacy_ids[pharmacy_name] = cursor.fetchone()[0]
+    return pharmacy_ids[pharmacy_name]
+
+def get_mask_id(mask_name):
+    if mask_name not in mask_ids:
+        model, color, num_per_pack = parse_mask_name(mask_name)
+        cursor.execute("SELECT id FROM masks WHERE model = ? AND color = ? AND num_per_pack = ?", (model, color, num_per_pack))
+        mask_result = cursor.fetchone()
+        mask_ids[mask_name] = mask_result[0] if mask_result else None
+    return mask_ids[mask_name]
+
 # insert data
-def insert_data():
-    for user in users_data:
-        # insert user data
+def insert_user(user):
+    """ Inserts a user record with its purchase histories and returns the user id """
+    # insert user data
+    cursor.execute("""
+        INSERT INTO users (name, cash_balance)
+        VALUES (?, ?)
+        RETURNING id
+    """, (user["name"], user["cashBalance"]))
+
+    # get user ID
+    user_id = cursor.fetchone()[0]
+
+    # insert transaction data
+    for transaction in user["purchaseHistories"]:
+        # get pharmacy ID
+        pharmacy_id = get_pharmacy_id(transaction["pharmacyName"])
+
+        # get mask ID
+        mask_id = get_mask_id(transaction["maskName"])
+        if mask_id is None:
+            print(f"{user['name']}, Mask not found: {transaction['maskName']}")
+            continue
+
+        # transaction_date = datetime.strptime(transaction["transactionDate"], "%Y-%m-%d %H:%M:%S")
+
+        # insert transaction
         cursor.execute("""
-            INSERT INTO users (name, cash_balance)
-            VALUES (?, ?)
-        """, (user["name"], user["cashBalance"]))
+            INSERT INTO transactions (user_id, pharmacy_id, mask_id, transaction_amount, transaction_date)
+            VALUES (?, ?, ?, ?, ?)
+        """, (user_id, pharmacy_id, mask_id, transaction["transactionAmount"], transaction["transactionDate"]))
 
-        # get user ID
-        user_id = cursor.execute("""SELECT id FROM users WHERE name = ?""", (user["name"],)).fetchone()[0]
+    return user_id
 
-        # insert transaction data
-        for transaction in user["purchaseHistories"]:
-            model, color, num_per_pack = parse_mask_name(transaction["maskName"])
+def upsert_user(user):
+    """ Inserts or updates a user and the purchase histories that changed since the last run """
+    # the cash balance is set on insert only: purchases change it in the database afterwards
+    user_id, new_hash = tracker.check("user", user["name"], {})
+    if new_hash is not None:
+        user_id = cursor.execute("""
+            INSERT INTO users (name, cash_balance)
+            VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET name = excluded.name
+            RETURNING id
+        """, (user["name"], user["cashBalance"])).fetchone()[0]
+        tracker.save("user", user["name"], user_id, new_hash)
 
-            # get pharmacy ID
-            cursor.execute("SELECT id FROM pharmacies WHERE name = ?", (transaction["pharmacyName"],))
-            pharmacy_id = cursor.fetchone()[0]
+    histories = user["purchaseHistories"]
+    keys = occurrence_keys([
+        (user["name"], h["pharmacyName"], h["maskName"], h["transactionDate"]) for h in histories
+    ])
+    for key, transaction in zip(keys, histories):
+        transaction_id, new_hash = tracker.check("transaction", key, {"transactionAmount": transaction["transactionAmount"]})
+        if new_hash is None:
+            continue
 
-            # get mask ID
-            cursor.execute("SELECT id FROM masks WHERE model = ? AND color = ? AND num_per_pack = ?", (model, color, num_per_pack))
-            mask_result = cursor.fetchone()
-            if mask_result is None:
-                print(f"{user["name"]}, Mask not found: {model}, {color}, {num_per_pack}")
-                continue
-            else:
-                mask_id = mask_result[0]
+        pharmacy_id = get_pharmacy_id(transaction["pharmacyName"])
+        mask_id = get_mask_id(transaction["maskName"])
+        if mask_id is None:
+            print(f"{user['name']}, Mask not found: {transaction['maskName']}")
+            continue
 
-            # transaction_date = datetime.strptime(transaction["transactionDate"], "%Y-%m-%d %H:%M:%S")
+        if transaction_id is None:
+            # adopt a matching row loaded by a previous full (non-incremental) run
+            row = cursor.execute("""
+                SELECT t.id FROM transactions t
+                WHERE t.user_id = ? AND t.pharmacy_id = ? AND t.mask_id = ? AND t.transaction_date = ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM etl_record_hashes h WHERE h.entity = 'transaction' AND h.row_id = t.id
+                )
+                ORDER BY t.id LIMIT 1
+            """, (user_id, pharmacy_id, mask_id, transaction["transactionDate"])).fetchone()
+            transaction_id = row[0] if row else None
 
-            # insert transaction
-            cursor.execute("""
+        if transaction_id is None:
+            transaction_id = cursor.execute("""
                 INSERT INTO transactions (user_id, pharmacy_id, mask_id, transaction_amount, transaction_date)
                 VALUES (?, ?, ?, ?, ?)
-            """, (user_id, pharmacy_id, mask_id, transaction["transactionAmount"], transaction["transactionDate"]))
+                RETURNING id
+            """, (user_id, pharmacy_id, mask_id, transaction["transactionAmount"], transaction["transactionDate"])).fetchone()[0]
+        else:
+            # the stored row may have been deleted since (e.g. a cancelled transaction); it is recreated then
+            cursor.execute("""
+                INSERT INTO transactions (id, user_id, pharmacy_id, mask_id, transaction_amount, transaction_date)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET transaction_amount = excluded.transaction_amount
+            """, (transaction_id, user_id, pharmacy_id, mask_id, transaction["transactionAmount"], transaction["transactionDate"]))
+        tracker.save("transaction", key, transaction_id, new_hash)
+
+    return user_id
+
+def delete_removed_records():
+    """ Deletes purchase histories and users that disappeared from the raw data """
+    cursor.executemany("DELETE FROM transactions WHERE id = ?", [
+        (transaction_id,) for transaction_id in tracker.pop_unseen("transaction")
+    ])
+    for user_id in tracker.pop_unseen("user"):
+        cursor.execute("""
+            DELETE FROM users WHERE id = ?
+            AND NOT EXISTS (SELECT 1 FROM transactions WHERE user_id = users.id)
+        """, (user_id,))
+        if cursor.rowcount == 0:
+            print(f"User {user_id} was removed from the raw data but is kept for its transactions")
+
+
+def main():
+    global cursor, tracker
+
+    parser = argparse.ArgumentParser(description="Load user data and purchase histories into the database.")
+    parser.add_argument("--data", default="data/users.json", help="path of the raw user data")
+    parser.add_argument("--db", default=default_database(),
+                        help="SQLite path or PostgreSQL URL (defaults to the DATABASE_* environment variables)")
+    parser.add_argument("--profile", default="bulk", choices=sorted(PROFILES), help="PRAGMA profile of the connection")
+    parser.add_argument("--stream", action="store_true",
+                        help="parse the file incrementally and commit in chunks with resumable checkpoints")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="records per commit in --stream and --incremental mode")
+    parser.add_argument("--restart", action="store_true",
+                        help="delete the rows and the checkpoint of a previous --stream run and load from the top")
+    parser.add_argument("--incremental", action="store_true",
+                        help="upsert only records that changed since the last run and delete removed ones")
+    parser.add_argument("--transaction-store",
+                        help="folder of the columnar transaction store to rebuild (defaults to the one of the database)")
+    args = parser.parse_args()
+
+    # SQLite or PostgreSQL connection
+    conn = connect(args.db, args.profile)
+    cursor = conn.cursor()
+
+    if args.incremental:
+        tracker = ChangeTracker(cursor)
+        incremental_load(conn, args.data, upsert_user, args.chunk_size)
+        delete_removed_records()
+        sync_id_sequences(cursor)
+        conn.commit()
+        tracker.report()
+    elif args.stream:
+        stream_load(conn, "users", args.data, insert_user, args.chunk_size, args.restart)
+    else:
+        # read json data
+        with open(args.data, "r", encoding="utf-8") as f:
+            users_data = json.load(f)
+
+        for user in users_data:
+            insert_user(user)
+        conn.commit()
+
+    # the analytics endpoints read the transactions from the store, or from the daily totals
+    reset_transaction_rollup(conn)
+    rebuild_transaction_store(conn, args.transaction_store or default_transaction_store(args.db))
+    conn.close()
+
 
-insert_data()
-conn.commit()
-conn.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
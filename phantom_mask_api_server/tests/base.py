@@ -0,0 +1,133 @@
+import logging
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from django.db import connection, connections, transaction
+from django.test import TestCase, override_settings
+from phantom_mask.catalog_snapshot import clear_catalog_snapshots
+from phantom_mask.catalog_version import forget_catalog_version
+from phantom_mask.models import Masks, Pharmacies, PharmacyMasks, Transactions, Users
+from phantom_mask.transaction_store import TransactionStore
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from db_setup import SCHEMA, postgres_schema  # noqa: E402
+
+""" Base test case of the API tests
+
+The models are unmanaged (the tables are created by scripts/db_setup.py, not by migrations), so
+the test database gets the schema of db_setup.py before the first test. Tests load synthetic
+data with dataset(), which rolls it back when the block ends; the transaction store is only
+used within dataset(), which builds one of its own.
+"""
+
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+COLORS = ["black", "blue", "green"]
+
+
+def create_schema(connection):
+    """ Creates the tables of scripts/db_setup.py in a test database (they are created only once) """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(postgres_schema())
+    else:
+        # executescript() commits first, so this has to run outside of the test transactions
+        connection.ensure_connection()
+        connection.connection.executescript(SCHEMA)
+
+
+class Dataset:
+    """ Ids and names of a loaded dataset, for the request parameters of the tests """
+
+    def __init__(self, size, pharmacies, masks, pharmacy_masks, users):
+        self.size = size
+        self.pharmacies = pharmacies
+        self.masks = masks
+        self.pharmacy_masks = pharmacy_masks
+        self.users = users
+
+
+class PhantomMaskTestCase(TestCase):
+    """ TestCase on the schema of db_setup.py """
+
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        for alias in connections:
+            if not connections[alias].settings_dict["TEST"].get("MIRROR"):
+                create_schema(connections[alias])
+
+        # never the transaction store of the development database
+        cls.enterClassContext(override_settings(TRANSACTION_STORE_DIR=""))
+
+        # the performance log line of every request would bury the test output
+        performance_logger = logging.getLogger("phantom_mask.performance")
+        cls.addClassCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+        super().setUpClass()
+
+    @contextmanager
+    def dataset(self, size):
+        """ Loads a synthetic dataset for the block and rolls it back afterwards
+
+        Args:
+            size (int): Scale of the data: 5 x size pharmacies (each selling 5 masks), 3 x size
+                masks and 5 x size users (with 3 purchases each in January 2021).
+
+        Yields:
+            Dataset: The loaded pharmacies, masks and users.
+        """
+        with transaction.atomic():
+            pharmacies = Pharmacies.objects.bulk_create(
+                Pharmacies(
+                    name=f"Pharmacy {i}",
+                    cash_balance=1000.0,
+                    # every third pharmacy is open overnight
+                    **{f"{day}_open": "20:00" if i % 3 == 0 else "08:00" for day in DAYS},
+                    **{f"{day}_close": "02:00" if i % 3 == 0 else "18:00" for day in DAYS},
+                )
+                for i in range(5 * size)
+            )
+            masks = Masks.objects.bulk_create(
+                Masks(
+                    model=f"Model {i // len(COLORS)}",
+                    color=COLORS[i % len(COLORS)],
+                    num_per_pack=1 + i % 10,
+                    name=f"Model {i // len(COLORS)} ({COLORS[i % len(COLORS)]}) ({1 + i % 10} per pack)",
+                )
+                for i in range(3 * size)
+            )
+            pharmacy_masks = PharmacyMasks.objects.bulk_create(
+                PharmacyMasks(pharmacy=pharmacy, mask=masks[(i + j) % len(masks)], price=5.0 + (i * 7 + j * 3) % 40)
+                for i, pharmacy in enumerate(pharmacies)
+                for j in range(min(5, len(masks)))
+            )
+            users = Users.objects.bulk_create(Users(name=f"User {i}", cash_balance=500.0) for i in range(5 * size))
+            start = datetime(2021, 1, 1, 9, tzinfo=timezone.utc)
+            Transactions.objects.bulk_create(
+                Transactions(
+                    user=user,
+                    pharmacy=pharmacy_masks[(i * 3 + j) % len(pharmacy_masks)].pharmacy,
+                    mask=pharmacy_masks[(i * 3 + j) % len(pharmacy_masks)].mask,
+                    transaction_amount=pharmacy_masks[(i * 3 + j) % len(pharmacy_masks)].price,
+                    transaction_date=start + timedelta(days=(i + j * 7) % 28, minutes=i),
+                )
+                for i, user in enumerate(users)
+                for j in range(3)
+            )
+            # bulk_create() doesn't bump the catalog version, and the rollback would undo a bump anyway
+            forget_catalog_version()
+            clear_catalog_snapshots()
+            with tempfile.TemporaryDirectory() as store_dir, override_settings(TRANSACTION_STORE_DIR=store_dir):
+                TransactionStore(store_dir).rebuild(connection.cursor())
+                try:
+                    yield Dataset(size, pharmacies, masks, pharmacy_masks, users)
+                finally:
+                    forget_catalog_version()
+                    clear_catalog_snapshots()
+            transaction.set_rollback(True)
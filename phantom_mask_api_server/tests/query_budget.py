@@ -0,0 +1,64 @@
+import functools
+from contextlib import ExitStack, contextmanager
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+""" SQL query budgets of the endpoints
+
+An endpoint has a fixed query budget: fetching 5 or 500 rows must take the same number of queries.
+query_budget() runs a test at several dataset sizes and fails when a request goes over its budget,
+which is how per-row (N+1) queries show up; the failure lists the SQL that was run.
+"""
+
+# dataset sizes of PhantomMaskTestCase.dataset() every budget is checked at
+DATASET_SIZES = (1, 5, 25)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """ A block ran more SQL queries than its budget """
+
+
+@contextmanager
+def assert_max_queries(budget, label="block"):
+    """ Fails when the block runs more than budget queries, on all database aliases together
+
+    Args:
+        budget (int): Maximum number of queries.
+        label (str): Name of the block in the failure message.
+
+    Raises:
+        QueryBudgetExceeded: With the numbered SQL of every query of the block.
+    """
+    with ExitStack() as stack:
+        contexts = {alias: stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections}
+        yield
+
+    queries = [(alias, query["sql"]) for alias, context in contexts.items() for query in context.captured_queries]
+    if len(queries) > budget:
+        sql = "\n".join(f"  {number}. [{alias}] {sql}" for number, (alias, sql) in enumerate(queries, 1))
+        raise QueryBudgetExceeded(f"{label} ran {len(queries)} queries, over its budget of {budget}:\n{sql}")
+
+
+def query_budget(route, budget, sizes=DATASET_SIZES):
+    """ Declares the query budget of a route; the decorated test makes one request to it
+
+    The test (a method of PhantomMaskTestCase) is run once per dataset size, with the dataset
+    passed as its argument; only the queries of the test itself count, not the loading.
+
+    Args:
+        route (str): Name of the route in phantom_mask/urls.py.
+        budget (int): Maximum number of queries of one request, at any dataset size.
+        sizes (tuple): Dataset sizes to run the test at.
+    """
+    def decorator(test):
+        @functools.wraps(test)
+        def wrapper(self):
+            for size in sizes:
+                with self.subTest(size=size), self.dataset(size) as data:
+                    with assert_max_queries(budget, label=f"{route} at dataset size {size}"):
+                        test(self, data)
+
+        wrapper.query_budget_route = route
+        return wrapper
+
+    return decorator
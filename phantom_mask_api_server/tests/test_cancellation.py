@@ -0,0 +1,40 @@
+from unittest import mock
+from django.db.models import QuerySet
+from django.urls import reverse
+from phantom_mask.models import OutboxEvents, Pharmacies, Transactions, Users
+from .base import PhantomMaskTestCase
+
+""" Cancel latest transaction: the balances are reverted once per deleted transaction """
+
+
+class CancellationTests(PhantomMaskTestCase):
+
+    def cancel(self):
+        return self.client.post(reverse("cancel-latest-transaction-view"), {}, content_type="application/json")
+
+    def balances(self, transaction):
+        return (Users.objects.get(id=transaction.user_id).cash_balance,
+                Pharmacies.objects.get(id=transaction.pharmacy_id).cash_balance)
+
+    def test_cancellations_revert_the_current_balances(self):
+        with self.dataset(1):
+            for _ in range(2):
+                latest = Transactions.objects.order_by("-transaction_date").first()
+                user_balance, pharmacy_balance = self.balances(latest)
+                response = self.cancel()
+                self.assertEqual(response.status_code, 200, response.content)
+                self.assertFalse(Transactions.objects.filter(id=latest.id).exists())
+                self.assertEqual(self.balances(latest), (
+                    user_balance + latest.transaction_amount, pharmacy_balance - latest.transaction_amount
+                ))
+
+    def test_transaction_deleted_by_another_cancellation(self):
+        with self.dataset(1):
+            latest = Transactions.objects.order_by("-transaction_date").first()
+            balances = self.balances(latest)
+            # the row is gone when this request deletes it
+            with mock.patch.object(QuerySet, "delete", return_value=(0, {})):
+                response = self.cancel()
+            self.assertEqual(response.status_code, 409, response.content)
+            self.assertEqual(self.balances(latest), balances)
+            self.assertFalse(OutboxEvents.objects.exists())
@@ -0,0 +1,33 @@
+from django.test import override_settings
+from django.urls import reverse
+from .base import PhantomMaskTestCase
+from .test_query_budgets import NO_RESPONSE_CACHE
+
+""" The catalog endpoints answer the same from the catalog snapshot as from the database """
+
+CATALOG_REQUESTS = [
+    ("pharmacies-open-list-view", {"day": "mon", "time": "01:00"}),
+    ("pharmacies-open-list-view", {"day": "sun", "time": "12:00"}),
+    ("pharmacy-masks-list-view", {"pharmacy": "Pharmacy 3", "sort_by": "price"}),
+    ("pharmacy-masks-list-view", {"pharmacy": "Pharmacy 3", "sort_by": "name"}),
+    ("pharmacy-masks-list-view", {"pharmacy": "Pharmacy 3"}),
+    ("pharmacies-compare-mask-list-view", {"min": "10", "max": "20", "cond": "gte2"}),
+    # pharmacies without a mask in the range count 0
+    ("pharmacies-compare-mask-list-view", {"min": "10", "max": "20", "cond": "lt1"}),
+    ("pharmacies-compare-mask-list-view", {"min": "20", "max": "10", "cond": "lte0"}),
+    ("pharmacies-compare-mask-list-view", {"ranges": "0-10,10.5-20,15-12,30-"}),
+]
+
+
+@override_settings(CACHES=NO_RESPONSE_CACHE, REPLICA_SNAPSHOT_PATH="/nonexistent/replica.db")
+class CatalogSnapshotTests(PhantomMaskTestCase):
+
+    def test_snapshot_matches_database(self):
+        with self.dataset(5):
+            for route, params in CATALOG_REQUESTS:
+                with self.subTest(route=route, params=params):
+                    snapshot = self.client.get(reverse(route), params, HTTP_ACCEPT="application/json")
+                    with self.settings(CATALOG_SNAPSHOT=False):
+                        database = self.client.get(reverse(route), params, HTTP_ACCEPT="application/json")
+                    self.assertEqual(snapshot.status_code, 200, snapshot.content)
+                    self.assertEqual(snapshot.content, database.content)
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.test import override_settings
+from phantom_mask import db_backup
+from .base import PhantomMaskTestCase
+
+""" Online backups: verified copies taken while another connection writes, rotated by count """
+
+
+class DatabaseBackupTests(PhantomMaskTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.database = os.path.join(self.directory, "phantom_mask_db.db")
+
+    def create_database(self, journal_mode, rows=500):
+        conn = sqlite3.connect(self.database)
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}").fetchall()
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO users (name) VALUES (?)", ((f"user {i}" * 20,) for i in range(rows)))
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def count_users(path):
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_wal_database_is_copied_in_one_step(self):
+        self.create_database("WAL").close()
+        target = os.path.join(self.directory, "backup.db")
+        stats = db_backup.snapshot_database(self.database, target, step_pages=2)
+        self.assertEqual(stats["steps"], 1)
+        self.assertEqual(self.count_users(target), 500)
+        conn = sqlite3.connect(target)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone(), ("delete",))
+        conn.close()
+
+    def test_rollback_database_is_copied_in_steps(self):
+        writer = self.create_database("DELETE")
+        self.addCleanup(writer.close)
+        target = os.path.join(self.directory, "backup.db")
+        stats = db_backup.snapshot_database(self.database, target, step_pages=4, step_pause=0)
+        self.assertEqual(stats["steps"], -(-stats["pages"] // 4))
+        self.assertEqual(stats["restarts"], 0)
+
+        # a commit in every pause restarts the copy, until the rest is copied in one step
+        def write(seconds):
+            writer.execute("INSERT INTO users (name) VALUES ('new')")
+            writer.commit()
+
+        with mock.patch.object(db_backup.time, "sleep", write):
+            stats = db_backup.snapshot_database(self.database, target, step_pages=4, max_restarts=3)
+        self.assertEqual(stats["restarts"], 4)
+        self.assertEqual(self.count_users(target), self.count_users(self.database))
+
+    def test_command_rotates_backups_and_installs_replica(self):
+        self.create_database("WAL").close()
+        backups = os.path.join(self.directory, "backups")
+        os.makedirs(backups)
+        old = [os.path.join(backups, f"phantom_mask_db-2026010{day}-000000.db") for day in (1, 2, 3)]
+        for path in old + [os.path.join(backups, "notes.txt")]:
+            open(path, "w").close()
+
+        replica = os.path.join(self.directory, "replica.db")
+        with override_settings(DATABASE_ENGINE="sqlite", REPLICA_SNAPSHOT_PATH=replica):
+            call_command("backup_database", source=self.database, output_dir=backups, keep=2, replica=True,
+                         stdout=StringIO())
+
+        kept = db_backup.list_backups(backups, self.database)
+        self.assertEqual(kept[0], old[2])
+        self.assertEqual(len(kept), 2)
+        self.assertTrue(os.path.exists(os.path.join(backups, "notes.txt")))
+        self.assertEqual(self.count_users(kept[1]), 500)
+        self.assertEqual(self.count_users(replica), 500)
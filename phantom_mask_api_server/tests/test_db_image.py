@@ -0,0 +1,76 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from .base import PhantomMaskTestCase, SCRIPTS_DIR
+
+import db_image  # noqa: E402  (scripts/, on the path through .base)
+
+""" scripts/db_image.py: an image built from the sample data is installed once, and checked """
+
+DATA_DIR = os.path.join(os.path.dirname(SCRIPTS_DIR), "data")
+
+
+class DatabaseImageTests(PhantomMaskTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.image = os.path.join(cls.directory, "db_image")
+        with redirect_stdout(StringIO()):
+            cls.manifest = db_image.build_image(
+                cls.image, os.path.join(DATA_DIR, "pharmacies.json"), os.path.join(DATA_DIR, "users.json"), workers=1
+            )
+
+    def install(self, database, **kwargs):
+        return db_image.install_image(self.image, database, db_image.store_dir(database), **kwargs)
+
+    def test_image_is_analyzed_and_complete(self):
+        conn = sqlite3.connect(os.path.join(self.image, db_image.DATABASE_FILE))
+        try:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone(), ("delete",))
+            self.assertTrue(conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0])
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM transactions").fetchone(), (100,))
+        finally:
+            conn.close()
+        self.assertEqual(set(self.manifest["files"]), set(db_image.image_files(self.image)))
+
+    def test_install_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, "db", "phantom_mask_db.db")
+            replica = os.path.join(directory, "replica.db")
+            self.assertEqual(self.install(database, replica=replica), "installed")
+            self.assertEqual(db_image.file_sha256(database), self.manifest["files"][db_image.DATABASE_FILE]["sha256"])
+            self.assertTrue(os.path.exists(os.path.join(db_image.store_dir(database), "generation.npy")))
+            self.assertTrue(os.path.exists(replica))
+
+            # the server writes to the installed database: it is still the one of the image
+            conn = sqlite3.connect(database)
+            conn.execute("UPDATE users SET cash_balance = cash_balance + 1")
+            conn.commit()
+            conn.close()
+            self.assertEqual(self.install(database), "current")
+            self.assertNotEqual(db_image.file_sha256(database), self.manifest["files"][db_image.DATABASE_FILE]["sha256"])
+
+    def test_other_database_is_kept(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, "phantom_mask_db.db")
+            sqlite3.connect(database).close()
+            self.assertEqual(self.install(database), "kept")
+            self.assertEqual(os.path.getsize(database), 0)
+            self.assertEqual(self.install(database, force=True), "installed")
+            self.assertGreater(os.path.getsize(database), 0)
+
+    def test_corrupt_image_is_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            image = shutil.copytree(self.image, os.path.join(directory, "db_image"))
+            with open(os.path.join(image, db_image.DATABASE_FILE), "r+b") as f:
+                f.seek(200)
+                f.write(b"\xff")
+            database = os.path.join(directory, "phantom_mask_db.db")
+            with self.assertRaises(SystemExit):
+                db_image.install_image(image, database)
+            self.assertFalse(os.path.exists(database))
@@ -0,0 +1,108 @@
+import asyncio
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.db import router
+from django.test import RequestFactory
+from django.urls import reverse
+from rest_framework import views
+from rest_framework.response import Response
+from phantom_mask.async_views import AsyncAPIView
+from phantom_mask.db_routers import PRIMARY_PIN_COOKIE
+from phantom_mask.models import Pharmacies
+from phantom_mask.views import PrimaryPinMixin, ReplicaReadMixin
+from .base import PhantomMaskTestCase
+
+""" Read/write routing: read-only views read from the replica, writes and pinned clients use the primary """
+
+
+def aliases():
+    return {"read": router.db_for_read(Pharmacies), "write": router.db_for_write(Pharmacies)}
+
+
+class ReadView(ReplicaReadMixin, views.APIView):
+
+    def get(self, request):
+        return Response(aliases())
+
+
+class AsyncReadView(ReplicaReadMixin, AsyncAPIView):
+
+    async def get(self, request):
+        before = aliases()
+        await asyncio.sleep(0.01)
+        # after the handler was suspended, and in the thread of sync_to_async
+        return Response({"before": before, "after": aliases(), "in_thread": await sync_to_async(aliases)()})
+
+
+class WriteView(PrimaryPinMixin, views.APIView):
+
+    def post(self, request):
+        return Response({}, status=int(request.query_params["status"]))
+
+
+class RoutingTests(PhantomMaskTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.replica = True
+        for target in ("phantom_mask.db_routers.replica_available", "phantom_mask.views.replica_available"):
+            patcher = mock.patch(target, lambda: self.replica)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get(self, view, **cookies):
+        request = self.factory.get("/")
+        request.COOKIES.update(cookies)
+        return view.as_view()(request)
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        self.assertEqual(self.get(ReadView).data, {"read": "replica", "write": "default"})
+        # outside of the view
+        self.assertEqual(aliases(), {"read": "default", "write": "default"})
+
+    def test_pinned_clients_and_missing_replica_use_the_primary(self):
+        self.assertEqual(self.get(ReadView, **{PRIMARY_PIN_COOKIE: "1"}).data, {"read": "default", "write": "default"})
+        self.replica = False
+        self.assertEqual(self.get(ReadView).data, {"read": "default", "write": "default"})
+
+    async def test_async_views_read_from_the_replica_until_they_return(self):
+        response = await self.get(AsyncReadView)
+        expected = {"read": "replica", "write": "default"}
+        self.assertEqual(response.data, {"before": expected, "after": expected, "in_thread": expected})
+        self.assertEqual(aliases(), {"read": "default", "write": "default"})
+
+        response = await self.get(AsyncReadView, **{PRIMARY_PIN_COOKIE: "1"})
+        self.assertEqual(response.data["after"], {"read": "default", "write": "default"})
+
+    def test_successful_writes_pin_the_client_to_the_primary(self):
+        for status, pinned in ((200, True), (201, True), (400, False), (404, False), (500, False)):
+            with self.subTest(status=status):
+                response = WriteView.as_view()(self.factory.post(f"/?status={status}"))
+                self.assertEqual(PRIMARY_PIN_COOKIE in response.cookies, pinned)
+        self.assertEqual(response.status_code, 500)
+
+        # without a replica, clients are pinned only while a transaction store (one is built by dataset()) follows the writes
+        self.replica = False
+        with self.settings(TRANSACTION_STORE_DIR=""):
+            response = WriteView.as_view()(self.factory.post("/?status=200"))
+            self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+        with self.dataset(1):
+            response = WriteView.as_view()(self.factory.post("/?status=200"))
+            self.assertIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_purchase_pins_the_client(self):
+        with self.dataset(1) as data:
+            pharmacy_mask = data.pharmacy_masks[0]
+            purchase = {
+                "user_id": data.users[0].id, "pharmacy_id": pharmacy_mask.pharmacy_id,
+                "mask_id": pharmacy_mask.mask_id, "quantity": 1,
+            }
+            response = self.client.post(reverse("purchase-mask-view"), purchase, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            cookie = response.cookies[PRIMARY_PIN_COOKIE]
+            self.assertEqual((cookie.value, cookie["httponly"]), ("1", True))
+
+            self.client.cookies.clear()
+            response = self.client.post(reverse("purchase-mask-view"), {**purchase, "user_id": 0}, content_type="application/json")
+            self.assertEqual(response.status_code, 404, response.content)
+            self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
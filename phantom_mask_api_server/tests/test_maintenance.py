@@ -0,0 +1,66 @@
+from unittest import mock
+from django.db import connection
+from django.urls import reverse
+from phantom_mask import maintenance, outbox
+from phantom_mask.models import TransactionRollupWatermark
+from phantom_mask.transaction_rollup import compact_batch
+from .base import PhantomMaskTestCase
+
+""" Maintenance jobs: the daily totals of the transactions answer like the transactions, jobs run when due """
+
+AMOUNTS_REQUESTS = [
+    {"start": "2021-01-01", "end": "2021-01-31"},
+    {"start": "2021-01-10"},
+    {"end": "2021-01-10"},
+    {},
+    {"start": "2021-02-01", "end": "2021-02-28"},
+]
+
+
+class MaintenanceTests(PhantomMaskTestCase):
+
+    def get_amounts(self, params):
+        response = self.client.get(reverse("mask-transactions-view"), params, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.content
+
+    def assert_rollup_matches_store(self):
+        for params in AMOUNTS_REQUESTS:
+            with self.subTest(params=params):
+                store = self.get_amounts(params)
+                with self.settings(TRANSACTION_STORE_DIR=""):
+                    self.assertEqual(self.get_amounts(params), store)
+
+    def test_compaction_and_cancellation(self):
+        with self.dataset(5) as data:
+            # part of the transactions folded, then all of them
+            self.assertEqual(compact_batch(batch_size=20), (20, True))
+            self.assert_rollup_matches_store()
+            while compact_batch(batch_size=20)[1]:
+                pass
+            self.assertEqual(TransactionRollupWatermark.objects.get().last_transaction_id,
+                             max(transaction.id for transaction in data.users[-1].transactions.all()))
+            self.assert_rollup_matches_store()
+
+            response = self.client.post(reverse("cancel-latest-transaction-view"), {}, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            outbox.run_consumers(["transaction_store"])
+            self.assert_rollup_matches_store()
+
+    def test_jobs_run_when_due(self):
+        # (a WAL checkpoint can't run in the transaction of the test)
+        jobs = ["optimize", "incremental_vacuum", "compact_transactions"]
+        with self.dataset(1):
+            last_runs = {}
+            runs = {name: (result, more) for name, result, more, _ in maintenance.run_due_jobs(last_runs, jobs)}
+            self.assertEqual(set(runs), set(jobs))
+            self.assertEqual(runs["optimize"][0], "analyzed" if connection.vendor == "sqlite" else "skipped on postgresql")
+            self.assertEqual(runs["compact_transactions"], ("15 transactions folded", False))
+            self.assertEqual(maintenance.run_due_jobs(last_runs, jobs), [])
+
+            # a job that stops with work left runs again at the next check
+            last_runs.pop("compact_transactions")
+            busy = {"run": lambda connection, deadline: ("busy", True)}
+            with mock.patch.dict(maintenance.JOBS["compact_transactions"], busy):
+                self.assertEqual(len(maintenance.run_due_jobs(last_runs, jobs)), 1)
+                self.assertEqual(len(maintenance.run_due_jobs(last_runs, jobs)), 1)
@@ -0,0 +1,42 @@
+import os
+import tempfile
+from io import StringIO
+from django.core.management import call_command
+from django.test import override_settings
+from phantom_mask import openapi_schema
+from phantom_mask.urls import urlpatterns
+from .base import PhantomMaskTestCase
+
+""" /swagger/ serves the OpenAPI document rendered by build_openapi_schema, or renders it itself """
+
+
+class OpenAPISchemaTests(PhantomMaskTestCase):
+
+    def setUp(self):
+        openapi_schema._documents = None
+        self.addCleanup(setattr, openapi_schema, "_documents", None)
+
+    def get(self, params=None, **headers):
+        return self.client.get("/swagger/", params, HTTP_HOST="localhost", **headers)
+
+    def test_document_lists_every_route(self):
+        with override_settings(OPENAPI_SCHEMA_DIR="/nonexistent/openapi"):
+            response = self.get({"format": "openapi"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/openapi+json; charset=utf-8")
+        paths = response.json()["paths"]
+        self.assertEqual(len(paths), len(urlpatterns))
+        self.assertNotIn("host", response.json())
+
+    def test_serves_the_built_files(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(OPENAPI_SCHEMA_DIR=directory):
+            call_command("build_openapi_schema", stdout=StringIO())
+            with open(os.path.join(directory, "swagger.yaml"), "a") as f:
+                f.write("# built\n")
+
+            response = self.get()
+            self.assertEqual(response["Content-Type"], "application/yaml; charset=utf-8")
+            self.assertTrue(response.content.endswith(b"# built\n"))
+            response = self.get(HTTP_ACCEPT="application/json")
+            self.assertEqual(response.json()["info"]["title"], openapi_schema.API_INFO["title"])
+            self.assertEqual(self.get({"format": "xml"}).status_code, 404)
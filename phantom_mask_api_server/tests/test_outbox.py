@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+from unittest import mock
+from django.urls import reverse
+from django.utils.timezone import now
+from phantom_mask import outbox
+from phantom_mask.models import OutboxEvents, OutboxOffsets
+from .base import PhantomMaskTestCase
+
+""" Outbox: purchases and cancellations publish events, consumers get each of them at least once """
+
+
+class RecordingConsumer(outbox.Consumer):
+    batch_size = 2
+
+    def __init__(self, name, topics=None):
+        self.name = name
+        self.topics = topics
+        self.received = []
+        self.failing = False
+
+    def handle(self, events):
+        if self.failing:
+            raise RuntimeError("consumer down")
+        self.received.extend(event.id for event in events)
+
+
+class OutboxTests(PhantomMaskTestCase):
+
+    def publish(self, count, topic="purchase"):
+        """ Publishes count events and returns their ids """
+        published = set(OutboxEvents.objects.values_list("id", flat=True))
+        for i in range(count):
+            outbox.publish(topic, {"n": i})
+        return [id for id in OutboxEvents.objects.order_by("id").values_list("id", flat=True) if id not in published]
+
+    def test_purchase_and_cancellation_publish_events(self):
+        with self.dataset(1) as data:
+            pharmacy_mask = data.pharmacy_masks[0]
+            response = self.client.post(reverse("purchase-mask-view"), {
+                "user_id": data.users[0].id, "pharmacy_id": pharmacy_mask.pharmacy_id,
+                "mask_id": pharmacy_mask.mask_id, "quantity": 1,
+            }, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            response = self.client.post(reverse("cancel-latest-transaction-view"), {}, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+
+            purchase, cancellation = outbox.read_events()
+            self.assertEqual((purchase.topic, cancellation.topic), ("purchase", "cancellation"))
+            self.assertEqual(purchase.payload, cancellation.payload)
+            self.assertEqual(purchase.payload["pharmacy_id"], pharmacy_mask.pharmacy_id)
+            self.assertEqual(purchase.payload["mask_count"], pharmacy_mask.mask.num_per_pack)
+
+    def test_at_least_once_delivery_and_offsets(self):
+        ids = self.publish(5)
+        orders = RecordingConsumer("orders")
+        cancellations = RecordingConsumer("cancellations", topics=("cancellation",))
+        with mock.patch.dict(outbox.CONSUMERS, {"orders": orders, "cancellations": cancellations}, clear=True):
+            # a failing batch is handed over again
+            orders.failing = True
+            with self.assertRaises(RuntimeError):
+                outbox.consume(orders)
+            orders.failing = False
+            self.assertEqual(outbox.run_consumers(), [("orders", 5)])
+            self.assertEqual(orders.received, ids)
+            self.assertEqual(cancellations.received, [])
+
+            # each consumer moved its own offset past all the events
+            self.assertEqual(dict(OutboxOffsets.objects.values_list("consumer", "last_event_id")),
+                             {"orders": ids[-1], "cancellations": ids[-1]})
+            ids += self.publish(1, "cancellation")
+            self.assertEqual(outbox.run_consumers(), [("orders", 1), ("cancellations", 1)])
+            self.assertEqual(cancellations.received, ids[-1:])
+
+    def test_gaps_wait_for_the_gap_timeout(self):
+        ids = self.publish(3)
+        # the event of a transaction that is still committing (or was rolled back)
+        OutboxEvents.objects.filter(id=ids[1]).delete()
+        self.assertEqual([event.id for event in outbox.read_events(ids[0])], [])
+        with self.settings(OUTBOX_GAP_TIMEOUT=0):
+            self.assertEqual([event.id for event in outbox.read_events(ids[0])], ids[2:])
+
+    def test_export_and_prune(self):
+        ids = self.publish(3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "events.jsonl")
+            with self.settings(OUTBOX_EXPORT_PATH=path):
+                self.assertEqual(outbox.run_consumers(["export"]), [("export", 3)])
+            with open(path, encoding="utf-8") as file:
+                self.assertEqual([json.loads(line)["id"] for line in file], ids)
+
+        # only the events read by every consumer are deleted
+        ids += self.publish(2)
+        OutboxOffsets.objects.create(consumer="behind", last_event_id=ids[1], updated_at=now())
+        with self.settings(OUTBOX_RETENTION=0):
+            self.assertEqual(outbox.prune_batch(), (2, False))
+        self.assertEqual(list(OutboxEvents.objects.values_list("id", flat=True)), ids[2:])
@@ -0,0 +1,54 @@
+from unittest import mock
+from django.db.models import F
+from django.urls import reverse
+from phantom_mask.models import Pharmacies, PharmacyMasks, Transactions, Users
+from .base import PhantomMaskTestCase
+
+""" Purchase: the balances move by the cost of the purchase, from the balances at the time of the write """
+
+
+class PurchaseTests(PhantomMaskTestCase):
+
+    def purchase(self, user, pharmacy_mask, quantity=1):
+        return self.client.post(reverse("purchase-mask-view"), {
+            "user_id": user.id, "pharmacy_id": pharmacy_mask.pharmacy_id,
+            "mask_id": pharmacy_mask.mask_id, "quantity": quantity,
+        }, content_type="application/json")
+
+    def balances(self, user, pharmacy_mask):
+        return (Users.objects.get(id=user.id).cash_balance,
+                Pharmacies.objects.get(id=pharmacy_mask.pharmacy_id).cash_balance)
+
+    def concurrently(self, user_change, pharmacy_change):
+        """ Changes the balances after the view has read them, as a concurrent purchase would """
+        get = PharmacyMasks.objects.get
+
+        def get_then_change(*args, **kwargs):
+            pharmacy_mask = get(*args, **kwargs)
+            Users.objects.update(cash_balance=F("cash_balance") + user_change)
+            Pharmacies.objects.update(cash_balance=F("cash_balance") + pharmacy_change)
+            return pharmacy_mask
+        return mock.patch.object(PharmacyMasks.objects, "get", get_then_change)
+
+    def test_concurrent_changes_are_kept(self):
+        with self.dataset(1) as data:
+            user, pharmacy_mask = data.users[0], data.pharmacy_masks[0]
+            user_balance, pharmacy_balance = self.balances(user, pharmacy_mask)
+            with self.concurrently(-10, 10):
+                response = self.purchase(user, pharmacy_mask, 2)
+            self.assertEqual(response.status_code, 200, response.content)
+            cost = 2 * pharmacy_mask.price
+            self.assertEqual(self.balances(user, pharmacy_mask), (user_balance - 10 - cost, pharmacy_balance + 10 + cost))
+
+    def test_balance_spent_concurrently(self):
+        with self.dataset(1) as data:
+            user, pharmacy_mask = data.users[0], data.pharmacy_masks[0]
+            balances = self.balances(user, pharmacy_mask)
+            transactions = Transactions.objects.count()
+            # enough when the view read it, not any more when it writes
+            with self.concurrently(pharmacy_mask.price - balances[0] - 0.01, 0):
+                response = self.purchase(user, pharmacy_mask)
+            self.assertEqual(response.status_code, 400, response.content)
+            # (the change of the test is rolled back with the purchase)
+            self.assertEqual(self.balances(user, pharmacy_mask), balances)
+            self.assertEqual(Transactions.objects.count(), transactions)
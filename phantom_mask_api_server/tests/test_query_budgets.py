@@ -0,0 +1,120 @@
+import asyncio
+from asgiref.sync import async_to_sync
+from django.test import override_settings
+from django.urls import reverse
+from phantom_mask.urls import urlpatterns
+from .base import PhantomMaskTestCase
+from .query_budget import assert_max_queries, query_budget
+
+""" Query budgets of every route in phantom_mask/urls.py
+
+The budgets are the queries an endpoint needs today; lower one when a change saves a query.
+The response cache is off, so every request computes its response. Each test starts with no
+catalog snapshot, so the catalog endpoints are measured while loading one (4 queries). The
+analytics endpoints read the transaction store of the dataset and only query the user names.
+"""
+
+NO_RESPONSE_CACHE = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "responses": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+}
+
+
+@override_settings(CACHES=NO_RESPONSE_CACHE, REPLICA_SNAPSHOT_PATH="/nonexistent/replica.db")
+class QueryBudgetTests(PhantomMaskTestCase):
+
+    def get(self, route, params):
+        response = self.client.get(reverse(route), params, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def post(self, route, data):
+        response = self.client.post(reverse(route), data, content_type="application/json", HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def test_every_route_has_a_budget(self):
+        budgeted = {getattr(getattr(self, name), "query_budget_route", None) for name in dir(self) if name.startswith("test_")}
+        missing = [pattern.name for pattern in urlpatterns if pattern.name not in budgeted]
+        self.assertEqual(missing, [], "routes without a query budget")
+
+    @query_budget("api-root-view", 0)
+    def test_api_root(self, data):
+        self.get("api-root-view", {})
+
+    @query_budget("pharmacies-open-list-view", 4)
+    def test_open_pharmacies(self, data):
+        response = self.get("pharmacies-open-list-view", {"day": "mon", "time": "23:00"})
+        self.assertEqual(len(response.json()), len(range(0, 5 * data.size, 3)))
+
+    @query_budget("pharmacy-masks-list-view", 4)
+    def test_pharmacy_masks(self, data):
+        response = self.get("pharmacy-masks-list-view", {"pharmacy": data.pharmacies[0].name, "sort_by": "price"})
+        self.assertTrue(response.json())
+
+    @query_budget("pharmacies-compare-mask-list-view", 4)
+    def test_compare_masks(self, data):
+        response = self.get("pharmacies-compare-mask-list-view", {"min": "0", "max": "100", "cond": "gte1"})
+        self.assertEqual(len(response.json()), len(data.pharmacies))
+
+    @query_budget("pharmacies-compare-mask-list-view", 4)
+    def test_compare_masks_in_price_ranges(self, data):
+        response = self.get("pharmacies-compare-mask-list-view", {"ranges": "0-4.5,5-19.5,20-"})
+        self.assertEqual(len(response.json()), len(data.pharmacies))
+        self.assertEqual(sum(sum(row["mask_counts"]) for row in response.json()), len(data.pharmacy_masks))
+
+    @override_settings(CATALOG_VERSION_TTL=60)
+    def test_catalog_snapshot_serves_without_queries(self):
+        with self.dataset(5) as data:
+            params = {
+                "pharmacies-open-list-view": {"day": "mon", "time": "23:00"},
+                "pharmacy-masks-list-view": {"pharmacy": data.pharmacies[0].name, "sort_by": "name"},
+                "pharmacies-compare-mask-list-view": {"min": "0", "max": "100", "cond": "gte1"},
+            }
+            for route in params:
+                self.get(route, params[route])
+            with assert_max_queries(0, label="catalog endpoints with a loaded snapshot"):
+                for route in params:
+                    self.get(route, params[route])
+
+    @query_budget("freq-transactions-user-list-view", 1)
+    def test_active_users(self, data):
+        response = self.get("freq-transactions-user-list-view", {"start": "2021-01-01", "end": "2021-01-31"})
+        self.assertEqual(len(response.json()), len(data.users))
+
+    @query_budget("mask-transactions-view", 0)
+    def test_transaction_amounts(self, data):
+        response = self.get("mask-transactions-view", {"start": "2021-01-01", "end": "2021-01-31"})
+        self.assertEqual(response.json()["total_mask_product_count"], 3 * len(data.users))
+
+    async def watch_sales_stream(self, viewers):
+        streams = [(await self.async_client.get(reverse("sales-stream-view"))).streaming_content for _ in range(viewers)]
+        for messages in streams:
+            self.assertTrue((await asyncio.wait_for(anext(messages), 5)).startswith(b"event: snapshot\n"))
+        # the viewers go away, which stops the stream
+        for messages in streams:
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(anext(messages), 0.01)
+
+    @query_budget("sales-stream-view", 1)
+    def test_sales_stream(self, data):
+        # the viewers share one aggregation of the day (the stream runs on ASGI only)
+        async_to_sync(self.watch_sales_stream)(3)
+        self.assertEqual(self.client.get(reverse("sales-stream-view")).status_code, 501)
+
+    @query_budget("search-view", 2)
+    def test_search(self, data):
+        response = self.get("search-view", {"type": "mask", "q": "model"})
+        self.assertEqual(len(response.json()), len({mask.model for mask in data.masks}))
+
+    @query_budget("purchase-mask-view", 10)
+    def test_purchase(self, data):
+        pharmacy_mask = data.pharmacy_masks[0]
+        self.post("purchase-mask-view", {
+            "user_id": data.users[0].id, "pharmacy_id": pharmacy_mask.pharmacy_id,
+            "mask_id": pharmacy_mask.mask_id, "quantity": 1,
+        })
+
+    @query_budget("cancel-latest-transaction-view", 8)
+    def test_cancel_latest_transaction(self, data):
+        self.post("cancel-latest-transaction-view", {})
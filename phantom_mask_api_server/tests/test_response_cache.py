@@ -0,0 +1,78 @@
+from django.test import override_settings
+from django.urls import reverse
+from phantom_mask.catalog_version import get_catalog_version
+from phantom_mask.models import Pharmacies
+from phantom_mask.response_cache import make_etag
+from .base import PhantomMaskTestCase
+
+""" Response cache of the catalog endpoints: strong ETags, 304s, and keys that change with the catalog version """
+
+RESPONSE_CACHE = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "responses": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-responses"},
+}
+
+
+@override_settings(CACHES=RESPONSE_CACHE, REPLICA_SNAPSHOT_PATH="/nonexistent/replica.db")
+class ResponseCacheTests(PhantomMaskTestCase):
+
+    def get(self, params, **headers):
+        return self.client.get(reverse("pharmacies-open-list-view"), params, HTTP_ACCEPT="application/json", **headers)
+
+    def test_etag_and_not_modified(self):
+        with self.dataset(1):
+            response = self.get({"day": "mon", "time": "12:00"})
+            self.assertEqual(response.status_code, 200, response.content)
+            # strong (no W/ prefix): a hash of the body at the catalog version
+            etag = response["ETag"]
+            self.assertEqual(etag, make_etag(get_catalog_version(), response.content))
+            self.assertEqual(response["Vary"], "Accept")
+
+            # the order of the parameters doesn't matter
+            response = self.get({"time": "12:00", "day": "mon"}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual((response.status_code, response.content, response["ETag"]), (304, b"", etag))
+            self.assertEqual(self.get({"day": "mon", "time": "12:00"}, HTTP_IF_NONE_MATCH="*").status_code, 304)
+            self.assertEqual(self.get({"day": "mon", "time": "12:00"}, HTTP_IF_NONE_MATCH='"0-other"').status_code, 200)
+
+    def test_catalog_changes_change_the_cached_response(self):
+        with self.dataset(1) as data:
+            params = {"day": "mon", "time": "12:00"}
+            before = self.get(params)
+            open_pharmacy = next(pharmacy for pharmacy in data.pharmacies if pharmacy.name.encode() in before.content)
+
+            # an update() bypasses the signals: the cached response is still served
+            Pharmacies.objects.filter(id=open_pharmacy.id).update(name="Renamed Pharmacy")
+            self.assertEqual(self.get(params).content, before.content)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                open_pharmacy.name = "Renamed Pharmacy"
+                open_pharmacy.save()
+            after = self.get(params, HTTP_IF_NONE_MATCH=before["ETag"])
+            self.assertEqual(after.status_code, 200)
+            self.assertIn(b"Renamed Pharmacy", after.content)
+            self.assertNotEqual(after["ETag"], before["ETag"])
+
+    def test_catalog_writes_bump_the_version(self):
+        with self.dataset(1) as data:
+            pharmacy, mask, pharmacy_mask = data.pharmacies[0], data.masks[0], data.pharmacy_masks[0]
+            version = get_catalog_version()
+            writes = [
+                (lambda: pharmacy.save(), 1),
+                (lambda: mask.save(update_fields=["name"]), 1),
+                (lambda: pharmacy.save(update_fields=["cash_balance", "name"]), 1),
+                (lambda: pharmacy_mask.delete(), 1),
+                # purchases only move cash balances
+                (lambda: pharmacy.save(update_fields=["cash_balance"]), 0),
+                (lambda: data.users[0].save(), 0),
+            ]
+            for write, bumps in writes:
+                write()
+                self.assertEqual(get_catalog_version(), version + bumps)
+                version += bumps
+
+            response = self.client.post(reverse("purchase-mask-view"), {
+                "user_id": data.users[0].id, "pharmacy_id": data.pharmacy_masks[1].pharmacy_id,
+                "mask_id": data.pharmacy_masks[1].mask_id, "quantity": 1,
+            }, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(get_catalog_version(), version)
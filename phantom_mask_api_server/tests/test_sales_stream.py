@@ -0,0 +1,69 @@
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from phantom_mask import outbox, sales_stream
+from .base import PhantomMaskTestCase
+
+""" Sales stream: totals of the day per pharmacy, a snapshot then the changes of each purchase """
+
+
+def parse(message):
+    """ Kind, id and data of an encoded server-sent event """
+    fields = dict(line.split(": ", 1) for line in message.decode().strip().split("\n"))
+    return fields["event"], int(fields["id"]), json.loads(fields["data"])
+
+
+def publish_purchase(pharmacy_id, amount, mask_count):
+    with transaction.atomic():
+        outbox.publish("purchase", {
+            "transaction_id": 1, "user_id": 1, "pharmacy_id": pharmacy_id, "mask_id": 1,
+            "transaction_amount": amount, "mask_count": mask_count,
+            "transaction_date": timezone.now().isoformat(),
+        })
+
+
+class SalesStreamTests(PhantomMaskTestCase):
+
+    def test_totals_follow_purchases_and_cancellations(self):
+        with self.dataset(1) as data:
+            pharmacy_mask = data.pharmacy_masks[0]
+            response = self.client.post(reverse("purchase-mask-view"), {
+                "user_id": data.users[0].id, "pharmacy_id": pharmacy_mask.pharmacy_id,
+                "mask_id": pharmacy_mask.mask_id, "quantity": 2,
+            }, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            sales = sales_stream.load_sales_totals()
+            expected = [2 * pharmacy_mask.price, 1, pharmacy_mask.mask.num_per_pack]
+            self.assertEqual(sales.totals, {pharmacy_mask.pharmacy_id: expected})
+
+            # the transactions of 2021 are on another day
+            response = self.client.post(reverse("cancel-latest-transaction-view"), {}, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            changes = sales.apply(outbox.read_events(sales.last_event_id))
+            self.assertEqual(changes, {pharmacy_mask.pharmacy_id: [-expected[0], -1, -expected[2]]})
+            self.assertEqual(sales.totals[pharmacy_mask.pharmacy_id], [0.0, 0, 0])
+            self.assertEqual(sales.last_event_id, sales_stream.load_sales_totals().last_event_id)
+
+    async def test_stream_sends_a_snapshot_then_deltas(self):
+        with self.settings(SALES_STREAM_POLL_INTERVAL=0.01):
+            response = await self.async_client.get(reverse("sales-stream-view"))
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            messages = response.streaming_content
+            kind, last_id, data = parse(await asyncio.wait_for(anext(messages), 5))
+            self.assertEqual((kind, data), ("snapshot", {"day": timezone.localdate().isoformat(), "pharmacies": {}}))
+
+            await sync_to_async(publish_purchase)(7, 12.5, 6)
+            kind, event_id, data = parse(await asyncio.wait_for(anext(messages), 5))
+            self.assertEqual(kind, "delta")
+            self.assertGreater(event_id, last_id)
+            self.assertEqual(data["pharmacies"], {"7": {
+                "total_transaction_amount": 12.5, "total_mask_product_count": 1, "total_mask_count": 6,
+            }})
+
+            # a client that goes away: Django cancels the response while it waits for a message
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(anext(messages), 0.05)
+            self.assertIsNone(sales_stream._streams["default"].task)
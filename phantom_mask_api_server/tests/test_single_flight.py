@@ -0,0 +1,79 @@
+import asyncio
+from unittest import mock
+from django.core.cache import caches
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.response import Response
+from phantom_mask.views import MaskTransactionsView
+from .base import PhantomMaskTestCase
+
+""" Identical concurrent requests of the analytics and search endpoints share one computation """
+
+
+class SingleFlightTests(PhantomMaskTestCase):
+
+    def setUp(self):
+        self.computations = 0
+
+    async def slow_get(self, view, request):
+        self.computations += 1
+        await asyncio.sleep(0.05)
+        return Response({"start": request.query_params.get("start"), "computation": self.computations})
+
+    async def get_concurrently(self, params_list):
+        url = reverse("mask-transactions-view")
+        return await asyncio.gather(*(
+            self.async_client.get(url, params, headers={"accept": "application/json"}) for params in params_list
+        ))
+
+    async def test_identical_requests_share_one_computation(self):
+        with mock.patch.object(MaskTransactionsView, "get", lambda view, request: self.slow_get(view, request)):
+            responses = await self.get_concurrently(
+                # the order of the parameters doesn't matter
+                [{"start": "2021-01-01", "end": "2021-01-31"}] * 4 + [{"end": "2021-01-31", "start": "2021-01-01"}]
+                + [{"start": "2021-01-02"}]
+            )
+            self.assertEqual(self.computations, 2)
+            self.assertEqual({response.content for response in responses[:5]}, {responses[0].content})
+            self.assertNotEqual(responses[5].content, responses[0].content)
+
+            # nothing is kept once the computation has finished
+            await self.get_concurrently([{"start": "2021-01-02"}])
+            self.assertEqual(self.computations, 3)
+
+    @override_settings(SINGLE_FLIGHT=False)
+    async def test_single_flight_can_be_turned_off(self):
+        with mock.patch.object(MaskTransactionsView, "get", lambda view, request: self.slow_get(view, request)):
+            await self.get_concurrently([{"start": "2021-01-01"}] * 3)
+        self.assertEqual(self.computations, 3)
+
+    @override_settings(SINGLE_FLIGHT_CACHE="default")
+    async def test_requests_wait_for_another_process(self):
+        cache = caches["default"]
+        published = {}
+        real_aadd = type(cache).aadd
+
+        async def aadd(cache, key, value, timeout=None, version=None):
+            # another process holds the lock of the first key, and publishes its response a bit later
+            if not published:
+                published["lock"] = key
+                await real_aadd(cache, key, "other-process", timeout, version)
+                asyncio.get_running_loop().call_later(0.05, publish, key)
+                return False
+            return await real_aadd(cache, key, value, timeout, version)
+
+        def publish(lock_key):
+            flight_key = lock_key.removesuffix(":lock")
+            cache.set(f"{flight_key}:other-process", (200, [("Content-Type", "application/json")], b'{"from":"other"}'))
+            cache.delete(lock_key)
+
+        with mock.patch.object(type(cache), "aadd", aadd), \
+                mock.patch.object(MaskTransactionsView, "get", lambda view, request: self.slow_get(view, request)):
+            responses = await self.get_concurrently([{"start": "2021-01-01"}] * 3)
+            self.assertEqual(self.computations, 0)
+            self.assertEqual({response.content for response in responses}, {b'{"from":"other"}'})
+
+            # the lock is free again: this process computes and releases it
+            await self.get_concurrently([{"start": "2021-01-01"}])
+            self.assertEqual(self.computations, 1)
+            self.assertIsNone(cache.get(published["lock"]))
@@ -0,0 +1,153 @@
+import os
+import tempfile
+import numpy as np
+from datetime import datetime
+from django.test import SimpleTestCase
+from django.urls import reverse
+from phantom_mask import outbox
+from phantom_mask.db_routers import PRIMARY_PIN_COOKIE
+from phantom_mask.models import OutboxOffsets
+from phantom_mask.transaction_store import TransactionStore
+from .base import PhantomMaskTestCase
+
+""" The analytics endpoints answer the same from the transaction store as from the database """
+
+ANALYTICS_REQUESTS = [
+    ("freq-transactions-user-list-view", {"start": "2021-01-01", "end": "2021-01-31"}),
+    ("freq-transactions-user-list-view", {"start": "2021-01-03", "end": "2021-01-09", "x": "4"}),
+    ("freq-transactions-user-list-view", {"start": "2021-02-01", "end": "2021-02-28"}),
+    ("mask-transactions-view", {"start": "2021-01-01", "end": "2021-01-31"}),
+    ("mask-transactions-view", {"start": "2021-01-10"}),
+    ("mask-transactions-view", {"end": "2021-01-10"}),
+    ("mask-transactions-view", {}),
+    ("mask-transactions-view", {"start": "2021-02-01", "end": "2021-02-28"}),
+]
+
+
+class TransactionStoreTests(PhantomMaskTestCase):
+
+    def get(self, route, params):
+        return self.client.get(reverse(route), params, HTTP_ACCEPT="application/json")
+
+    def assert_store_matches_database(self):
+        for route, params in ANALYTICS_REQUESTS:
+            with self.subTest(route=route, params=params):
+                store = self.get(route, params)
+                with self.settings(TRANSACTION_STORE_DIR=""):
+                    database = self.get(route, params)
+                self.assertEqual(store.status_code, 200, store.content)
+                self.assertEqual(store.content, database.content)
+
+    def test_store_matches_database(self):
+        with self.dataset(5):
+            self.assert_store_matches_database()
+
+    def test_purchases_and_cancellations_update_the_store(self):
+        with self.dataset(5) as data:
+            pharmacy_mask = data.pharmacy_masks[0]
+            response = self.client.post(reverse("purchase-mask-view"), {
+                "user_id": data.users[0].id, "pharmacy_id": pharmacy_mask.pharmacy_id,
+                "mask_id": pharmacy_mask.mask_id, "quantity": 2,
+            }, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            # the client that purchased reads its own write from the database
+            self.assertIn(PRIMARY_PIN_COOKIE, response.cookies)
+            self.assertEqual(self.get("mask-transactions-view", {}).json()["total_mask_product_count"], 3 * len(data.users) + 1)
+            # the others once the outbox consumer has applied it to the store
+            self.client.cookies.clear()
+            self.assertEqual(self.get("mask-transactions-view", {}).json()["total_mask_product_count"], 3 * len(data.users))
+            self.assertEqual(outbox.run_consumers(["transaction_store"]), [("transaction_store", 1)])
+            response = self.get("mask-transactions-view", {})
+            self.assertEqual(response.json()["total_mask_product_count"], 3 * len(data.users) + 1)
+            self.assert_store_matches_database()
+
+            response = self.client.post(reverse("cancel-latest-transaction-view"), {}, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            self.client.cookies.clear()
+            outbox.run_consumers(["transaction_store"])
+            response = self.get("mask-transactions-view", {})
+            self.assertEqual(response.json()["total_mask_product_count"], 3 * len(data.users))
+            self.assert_store_matches_database()
+
+            # events handled again change nothing
+            OutboxOffsets.objects.update(last_event_id=0)
+            self.assertEqual(outbox.run_consumers(["transaction_store"]), [("transaction_store", 2)])
+            self.assert_store_matches_database()
+
+class TableCursor:
+    """ Cursor that returns rows of the source query; during_read runs while the table is read """
+
+    def __init__(self, rows, during_read=None):
+        self.rows = rows
+        self.during_read = during_read
+
+    def execute(self, query):
+        pass
+
+    def fetchall(self):
+        if self.during_read:
+            self.during_read()
+        return self.rows
+
+
+def row(transaction_id):
+    return transaction_id, datetime(2021, 1, 1), 1, 2, 3, 10.0 * transaction_id, 6
+
+
+class TransactionStoreWriteTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = TransactionStore(directory.name)
+
+    @staticmethod
+    def stored(transaction_id):
+        """ Row of the store for row(transaction_id) """
+        return transaction_id, 1609459200, 1, 2, 3, 10.0 * transaction_id, 6
+
+    def append(self, *transaction_ids, store=None):
+        for transaction_id in transaction_ids:
+            (store or self.store).append(*self.stored(transaction_id))
+
+    def generation(self):
+        return int(np.load(os.path.join(self.store.directory, "generation.npy"))[0])
+
+    def rows(self):
+        columns = self.store.columns()
+        return list(zip(columns["id"].tolist(), columns["live"].tolist()))
+
+    def test_ids_stay_sorted_and_unique(self):
+        self.store.rebuild(TableCursor([row(1), row(5)]))
+        self.append(7, 3, 5, 3)
+        self.store.cancel(3)
+        self.store.cancel(4)
+        self.assertEqual(self.rows(), [(1, True), (3, False), (5, True), (7, True)])
+
+    def test_a_batch_writes_one_generation(self):
+        self.store.rebuild(TableCursor([row(1), row(5)]))
+        generation = self.generation()
+        # out of order and repeated, within the batch and with the store
+        self.store.append_many([self.stored(i) for i in (7, 3, 2, 9, 3, 5)])
+        self.store.cancel_many([3, 4, 9])
+        self.assertEqual(self.rows(), [(1, True), (2, True), (3, False), (5, True), (7, True), (9, False)])
+        self.assertEqual(self.generation(), generation + 1)
+
+        # after the last id: written in place
+        self.store.append_many([self.stored(i) for i in (11, 10)])
+        self.assertEqual(self.rows()[-2:], [(10, True), (11, True)])
+        self.assertEqual(self.generation(), generation + 1)
+
+    def test_rebuild_replays_the_writes_made_during_the_read(self):
+        self.store.rebuild(TableCursor([row(1), row(2)]))
+        other_process = TransactionStore(self.store.directory)
+
+        def commit_during_read():
+            # 4 was read; 3 commits after it, 6 after the read and 2 is cancelled
+            self.append(4, 3, 6, store=other_process)
+            other_process.cancel(2)
+
+        self.store.rebuild(TableCursor([row(1), row(2), row(4)], commit_during_read))
+        self.assertEqual(self.rows(), [(1, True), (2, False), (3, True), (4, True), (6, True)])
+        self.assertEqual(float(self.store.totals()[0]), 140.0)
+        self.assertFalse(os.path.exists(os.path.join(self.store.directory, "journal.txt")))